@@ -1,3 +1,8 @@
+-- Embedding columns are sized for EMBEDDING_DIMENSION=1536 (text-embedding-ada-002). With another
+-- EMBEDDING_DIMENSION, e.g. a local model, every (1536) below must match it or inserts fail:
+--     sed 's/(1536)/(768)/g' DDL/init.sql | psql "$DATABASE_URL"
+CREATE EXTENSION IF NOT EXISTS vector;
+
 -- Table for Context class
 CREATE TABLE contexts (
     id VARCHAR PRIMARY KEY,
@@ -22,8 +27,34 @@ CREATE TABLE documents (
 CREATE TABLE document_chunks (
     id VARCHAR PRIMARY KEY,
     document_id VARCHAR NOT NULL REFERENCES documents(id) ON DELETE CASCADE,
+    context_id VARCHAR REFERENCES contexts(id) ON DELETE CASCADE,
     chunk_index INTEGER NOT NULL,
     content TEXT NOT NULL,
-    embedding TEXT NOT NULL,
+    embedding vector(1536),
+    embedding_half halfvec(1536),
+    embedding_binary bit(1536),
+    content_hash VARCHAR,
+    source_page INTEGER,
+    filename TEXT,
     created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
-);
\ No newline at end of file
+);
+
+-- Retrieval filters chunks by context without joining documents
+CREATE INDEX ix_document_chunks_context_id ON document_chunks (context_id);
+
+-- ANN index for the vector candidate search, see utils/vector_index.py for the
+-- variants matching VECTOR_INDEX_TYPE and EMBEDDING_STORAGE_TIER
+CREATE INDEX ix_document_chunks_embedding_ann ON document_chunks
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
+
+
+-- Content-addressed embedding cache shared across documents and contexts
+CREATE TABLE embedding_cache (
+    key VARCHAR PRIMARY KEY,
+    model VARCHAR NOT NULL,
+    embedding vector(1536) NOT NULL,
+    created_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP,
+    last_used_at TIMESTAMP WITH TIME ZONE DEFAULT CURRENT_TIMESTAMP
+);
+
+CREATE INDEX ix_embedding_cache_last_used_at ON embedding_cache (last_used_at);
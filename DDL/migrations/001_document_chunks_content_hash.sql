@@ -0,0 +1,7 @@
+-- Content hash of every chunk, used to re-embed only changed chunks when a document is replaced.
+-- Matches DocumentProcessor.content_hash: hex sha256 of the UTF-8 chunk text.
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS content_hash VARCHAR;
+
+UPDATE document_chunks
+SET content_hash = encode(sha256(convert_to(content, 'UTF8')), 'hex')
+WHERE content_hash IS NULL;
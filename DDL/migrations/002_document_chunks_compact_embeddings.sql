@@ -0,0 +1,52 @@
+-- Compact embedding tiers (EMBEDDING_STORAGE_TIER=half or binary), requires pgvector >= 0.7.
+-- Iterative index scans (VECTOR_ITERATIVE_SCAN) need pgvector >= 0.8 and are left out on older versions.
+-- The full embedding column stays and is used to rerank the candidates exactly.
+-- (1536) is EMBEDDING_DIMENSION, replace it when that is set otherwise, as for init.sql.
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_half halfvec(1536);
+ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS embedding_binary bit(1536);
+
+-- Backfill existing rows in batches so no single transaction locks the whole table.
+-- Each backfill rewrites every row, so only the one of the tier being enabled runs:
+-- set it for the session first, e.g. SET docuchat.embedding_storage_tier = 'half';
+-- Run outside an explicit transaction block.
+DO $$
+DECLARE
+    updated integer;
+BEGIN
+    IF current_setting('docuchat.embedding_storage_tier', true) IS DISTINCT FROM 'half' THEN
+        RAISE NOTICE 'Skipping the embedding_half backfill, docuchat.embedding_storage_tier is not half';
+        RETURN;
+    END IF;
+    LOOP
+        UPDATE document_chunks SET embedding_half = embedding::halfvec(1536)
+        WHERE id IN (
+            SELECT id FROM document_chunks
+            WHERE embedding_half IS NULL AND embedding IS NOT NULL
+            LIMIT 10000
+        );
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        EXIT WHEN updated = 0;
+        COMMIT;
+    END LOOP;
+END $$;
+
+DO $$
+DECLARE
+    updated integer;
+BEGIN
+    IF current_setting('docuchat.embedding_storage_tier', true) IS DISTINCT FROM 'binary' THEN
+        RAISE NOTICE 'Skipping the embedding_binary backfill, docuchat.embedding_storage_tier is not binary';
+        RETURN;
+    END IF;
+    LOOP
+        UPDATE document_chunks SET embedding_binary = binary_quantize(embedding)::bit(1536)
+        WHERE id IN (
+            SELECT id FROM document_chunks
+            WHERE embedding_binary IS NULL AND embedding IS NOT NULL
+            LIMIT 10000
+        );
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        EXIT WHEN updated = 0;
+        COMMIT;
+    END LOOP;
+END $$;
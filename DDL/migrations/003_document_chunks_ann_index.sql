@@ -0,0 +1,21 @@
+-- ANN index on document_chunks for the vector candidate search.
+-- Statements below must run outside a transaction block (CREATE INDEX CONCURRENTLY).
+-- For other VECTOR_INDEX_TYPE / EMBEDDING_STORAGE_TIER settings, print the matching
+-- statement with `python -m utils.vector_index ddl` or run `python -m utils.vector_index create`.
+-- (1536) is EMBEDDING_DIMENSION, replace it when that is set otherwise, as for init.sql.
+CREATE EXTENSION IF NOT EXISTS vector;
+
+-- Databases created from the old init.sql stored embeddings as TEXT
+DO $$
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'document_chunks' AND column_name = 'embedding' AND data_type = 'text'
+    ) THEN
+        ALTER TABLE document_chunks ALTER COLUMN embedding DROP NOT NULL;
+        ALTER TABLE document_chunks ALTER COLUMN embedding TYPE vector(1536) USING embedding::vector(1536);
+    END IF;
+END $$;
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_document_chunks_embedding_ann ON document_chunks
+    USING hnsw (embedding vector_cosine_ops) WITH (m = 16, ef_construction = 64);
@@ -0,0 +1,40 @@
+-- Denormalized context_id on document_chunks, so retrieval filters by context
+-- instead of loading the context's documents and passing their ids as an IN-list.
+-- The column takes the type of contexts.id: VARCHAR in databases created from init.sql,
+-- UUID in those created from the models.
+DO $$
+DECLARE
+    id_type text;
+BEGIN
+    SELECT data_type INTO id_type FROM information_schema.columns
+    WHERE table_schema = current_schema() AND table_name = 'contexts' AND column_name = 'id';
+    EXECUTE format(
+        'ALTER TABLE document_chunks ADD COLUMN IF NOT EXISTS context_id %s REFERENCES contexts(id) ON DELETE CASCADE',
+        id_type
+    );
+END $$;
+
+-- Backfill existing rows in batches so no single transaction locks the whole table.
+-- Run outside an explicit transaction block.
+DO $$
+DECLARE
+    updated integer;
+BEGIN
+    LOOP
+        UPDATE document_chunks AS c SET context_id = d.context_id
+        FROM documents AS d
+        WHERE d.id = c.document_id
+          AND c.id IN (
+            SELECT id FROM document_chunks
+            WHERE context_id IS NULL
+            LIMIT 10000
+          );
+        GET DIAGNOSTICS updated = ROW_COUNT;
+        EXIT WHEN updated = 0;
+        COMMIT;
+    END LOOP;
+END $$;
+
+-- With the btree index, the planner can read a small context's chunks directly and rank
+-- them exactly, and use the ANN index (with VECTOR_ITERATIVE_SCAN) for large ones.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_document_chunks_context_id ON document_chunks (context_id);
@@ -1,22 +1,75 @@
-from fastapi import APIRouter, Depends, Body, Request
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, Body, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import Optional
 
-from utils.database import get_db
+from utils.database import get_async_db
 from schemas.chat_schema import ChatRequest, ChatResponse
 from services.chat_service import ChatService
+from utils.query_embedding_cache import get_query_embedding_cache
+from utils.embedding_batcher import get_embedding_batcher
+from utils.embedding_cache import get_embedding_cache
+from utils.answer_cache import get_answer_cache
+from utils.history_compaction import get_history_compactor
+from utils.prompt_cache import get_prompt_cache_stats
+from utils.stage_timing import StageTimer
+from utils.deadline import Deadline, LATENCY_BUDGET_HEADER
 
 router = APIRouter()
 
 @router.post("/chat", response_model=ChatResponse)
-def chat_with_context(
+async def chat_with_context(
     request: Request,
+    response: Response,
     chat_request: ChatRequest = Body(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
-    Chat with the assistant based on a specific context
+    Chat with the assistant based on a specific context, within the latency budget
+    of the X-Latency-Budget-Ms header or CHAT_LATENCY_BUDGET_MS
     """
-    return ChatService.chat_with_context(db, chat_request, request.state.user.get("id"))
+    timer = StageTimer()
+    deadline = Deadline.from_header(request.headers.get(LATENCY_BUDGET_HEADER))
+    try:
+        return await ChatService.chat_with_context(db, chat_request, request.state.user.get("id"), timer, deadline)
+    finally:
+        response.headers["Server-Timing"] = timer.server_timing()
 
-   
 
+@router.post("/chat/stream")
+async def stream_chat_with_context(
+    request: Request,
+    chat_request: ChatRequest = Body(...),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """
+    Chat with the assistant based on a specific context, streaming the answer as Server-Sent Events
+    """
+    # Retrieval runs before the response starts, so a missing context is still a plain 404
+    timer = StageTimer()
+    deadline = Deadline.from_header(request.headers.get(LATENCY_BUDGET_HEADER))
+    prepared = await ChatService.prepare_chat(db, chat_request, request.state.user.get("id"), timer, deadline)
+    return StreamingResponse(
+        ChatService.stream_chat(request, chat_request, prepared, deadline),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": timer.server_timing()},
+    )
+
+
+@router.get("/chat/metrics")
+def chat_metrics(context_id: Optional[str] = None):
+    """
+    Hit ratios of the embedding, answer and history summary caches, query embedding
+    batch sizes and the provider's prompt cache use in this process, per prompt layout
+    or for context_id
+    """
+    embedding_cache = get_embedding_cache()
+    answer_cache = get_answer_cache()
+    return {
+        "query_embedding_cache": get_query_embedding_cache().stats(),
+        "embedding_batcher": get_embedding_batcher().stats(),
+        "embedding_cache": embedding_cache.stats() if embedding_cache else None,
+        "answer_cache": answer_cache.stats() if answer_cache else None,
+        "history_compaction": get_history_compactor().stats(),
+        "prompt_cache": get_prompt_cache_stats().stats(context_id),
+    }
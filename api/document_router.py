@@ -53,6 +53,23 @@ async def update_context_text(
     return document
 
 
+@router.put("/contexts/{context_id}/documents/{document_id}", response_model=DocumentResponse)
+async def replace_context_file(
+    request: Request,
+    context_id: str = Path(...),
+    document_id: str = Path(...),
+    file: UploadFile = File(...),
+    db:Session = Depends(get_db)):
+    """
+    Replace the file of an existing document, only changed chunks are re-embedded
+    """
+    
+    if not file:
+        raise HTTPException(status_code=403, detail="Please provide the file to be uploaded")
+    
+    return await DocumentService.replace_document(db, document_id, context_id, get_user_id_from_req(request), file)
+
+
 @router.delete("/contexts/{context_id}/documents/{document_id}")
 def delete_document(
     request: Request,
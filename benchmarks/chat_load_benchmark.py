@@ -0,0 +1,239 @@
+"""
+Concurrency ceiling of the chat endpoint.
+
+simulate: serves the real POST /api/chat in-process, through AuthMiddleware, the chat router,
+ChatService, the embedding batcher and scheduler, and AsyncOpenAI clients, without a database
+or API key. OpenAI answers from an in-process transport and the repository queries sleep,
+all after latencies drawn from a log-normal distribution around the given medians. A session
+holds one of ASYNC_DB_POOL_SIZE + ASYNC_DB_MAX_OVERFLOW connections from its first query until
+it commits, like an AsyncSession does. Every chat asks a new question, so nothing is cached.
+It is compared with a sync endpoint blocking a threadpool thread for the same median latencies,
+like /chat did with the sync OpenAI client and Session.
+
+http: fires real chats at a running server, e.g. to find where upstream rate limits
+become the ceiling.
+
+Usage (from the repository root):
+    python -m benchmarks.chat_load_benchmark simulate --concurrency 10 40 100 400 --completion-ms 2000
+    python -m benchmarks.chat_load_benchmark http --url http://localhost:8000/api/chat \\
+        --token <jwt> --context-id <id> --concurrency 10 50 100
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import time
+import uuid
+import httpx
+import numpy as np
+from fastapi import FastAPI
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "postgresql://benchmark@localhost/benchmark")
+os.environ.setdefault("SECRET_KEY", "benchmark")
+os.environ.setdefault("ALGORITHM", "HS256")
+
+
+class FakeOpenAI:
+    """Embeddings and chat completions endpoints answering after a simulated latency"""
+
+    def __init__(self, args, sleep):
+        self.args = args
+        self.sleep = sleep
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        from utils.embedding_provider import EMBEDDING_DIMENSION
+
+        body = json.loads(request.content)
+        if request.url.path.endswith("/embeddings"):
+            await self.sleep(self.args.embedding_ms)
+            data = [{"object": "embedding", "index": i, "embedding": [1.0] * EMBEDDING_DIMENSION} for i in range(len(body["input"]))]
+            usage = {"prompt_tokens": len(body["input"]), "total_tokens": len(body["input"])}
+            return httpx.Response(200, json={"object": "list", "data": data, "model": body["model"], "usage": usage})
+
+        await self.sleep(self.args.completion_ms)
+        return httpx.Response(200, json={
+            "id": "chatcmpl-benchmark",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body["model"],
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": "The renewal notice period is 90 days."}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 500, "completion_tokens": 10, "total_tokens": 510},
+        })
+
+
+class Session:
+    """Stands in for an AsyncSession, holding a pool connection from its first query until commit"""
+
+    def __init__(self, pool: asyncio.Semaphore):
+        self.pool = pool
+        self.connected = False
+
+    async def connection(self):
+        if not self.connected:
+            await self.pool.acquire()
+            self.connected = True
+
+    async def commit(self):
+        if self.connected:
+            self.pool.release()
+            self.connected = False
+
+    close = commit
+
+
+def simulated_app(args) -> FastAPI:
+    import openai
+    import models.context_model, models.user_model, models.document_model  # noqa: F401  (mapper registry)
+    import services.chat_service as chat_service
+    from api.chat_router import router as chat_router
+    from middleware.auth_middleware import AuthMiddleware
+    from repository.chat_repository import ChatRepository, ChunkHit
+    from repository.context_repository import ContextRepository
+    from repository.document_repository import DocumentRepository
+    from utils import embedding_scheduler
+    from utils.database import get_async_db, ASYNC_DB_POOL_SIZE, ASYNC_DB_MAX_OVERFLOW
+
+    rng = np.random.default_rng(0)
+
+    async def sleep(median_ms):
+        await asyncio.sleep(median_ms * rng.lognormal(0, 0.3) / 1000)
+
+    def client(max_retries: int) -> openai.AsyncOpenAI:
+        transport = httpx.MockTransport(FakeOpenAI(args, sleep).handle)
+        return openai.AsyncOpenAI(api_key="benchmark", max_retries=max_retries, http_client=httpx.AsyncClient(transport=transport))
+
+    chat_service.async_client = client(max_retries=2)
+    embedding_scheduler._scheduler = embedding_scheduler.EmbeddingScheduler(client=client(max_retries=0))
+
+    class Context:
+        id = uuid.uuid4()
+
+    chunks = [
+        ChunkHit(uuid.uuid4(), Context.id, i, "Either party may renew the contract with 90 days notice. " * 20, i + 1, "contract.pdf", 0.8)
+        for i in range(8)
+    ]
+
+    async def ownership(db, context_id, owner_id):
+        await db.connection()
+        await sleep(args.db_ms)
+        return Context()
+
+    async def versions(db, context_id):
+        await db.connection()
+        await sleep(args.db_ms)
+        return []
+
+    async def retrieval(db, context_id, query, top_k=3, similarity_threshold=0.75, mmr=False):
+        await db.connection()
+        await sleep(args.retrieval_ms)
+        return chunks[:top_k]
+
+    ContextRepository.aget_by_id_and_owner = staticmethod(ownership)
+    DocumentRepository.aget_versions_by_context_id = staticmethod(versions)
+    ChatRepository.aget_relevant_chunk_by_context_and_query = staticmethod(retrieval)
+    chat_service.get_context_vector_index = lambda: None
+
+    pool = asyncio.Semaphore(ASYNC_DB_POOL_SIZE + ASYNC_DB_MAX_OVERFLOW)
+
+    async def session():
+        db = Session(pool)
+        try:
+            yield db
+        finally:
+            await db.close()
+
+    app = FastAPI()
+    app.add_middleware(AuthMiddleware)
+    app.include_router(chat_router, prefix="/api")
+    app.dependency_overrides[get_async_db] = session
+
+    @app.post("/sync")
+    def sync_chat():
+        time.sleep((2 * args.db_ms + args.embedding_ms + args.retrieval_ms + args.completion_ms) / 1000)
+        return {"response": "ok"}
+
+    return app
+
+
+async def load(client: httpx.AsyncClient, url: str, concurrency: int, requests: int, body=None, **kwargs):
+    """
+    Send requests with at most concurrency in flight, returning latencies and wall time.
+    body, when given, makes each request's JSON body.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one():
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(url, **({"json": body()} if body else {}), **kwargs)
+            response.raise_for_status()
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return np.array(latencies), time.perf_counter() - start
+
+
+def report(name: str, concurrency: int, latencies, elapsed: float):
+    print(
+        f"{name:<8} {concurrency:>11} {len(latencies) / elapsed:>11.1f} "
+        f"{np.percentile(latencies, 50):>8.2f} {np.percentile(latencies, 95):>8.2f}"
+    )
+
+
+async def simulate(args):
+    from jose import jwt
+
+    token = jwt.encode({"id": 0, "exp": time.time() + 3600}, os.environ["SECRET_KEY"], algorithm=os.environ["ALGORITHM"])
+    headers = {"Authorization": f"Bearer {token}"}
+    questions = itertools.count()
+
+    def body():
+        return {"context_id": str(uuid.uuid4()), "message": f"{args.message} ({next(questions)})", "history": []}
+
+    transport = httpx.ASGITransport(app=simulated_app(args))
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=None) as client:
+        for concurrency in args.concurrency:
+            requests = args.requests or concurrency * 2
+            latencies, elapsed = await load(client, "/sync", concurrency, requests, headers=headers)
+            report("sync", concurrency, latencies, elapsed)
+            latencies, elapsed = await load(client, "/api/chat", concurrency, requests, body=body, headers=headers)
+            report("chat", concurrency, latencies, elapsed)
+
+
+async def http(args):
+    limits = httpx.Limits(max_connections=max(args.concurrency))
+    headers = {"Authorization": f"Bearer {args.token}"}
+    body = {"context_id": args.context_id, "message": args.message, "history": []}
+    async with httpx.AsyncClient(limits=limits, timeout=None) as client:
+        for concurrency in args.concurrency:
+            latencies, elapsed = await load(
+                client, args.url, concurrency, args.requests or concurrency * 2, json=body, headers=headers
+            )
+            report("http", concurrency, latencies, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["simulate", "http"])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[10, 40, 100, 400])
+    parser.add_argument("--requests", type=int, help="Requests per level, defaults to twice the concurrency")
+    parser.add_argument("--db-ms", type=float, default=3.0, help="Median latency of a simple query")
+    parser.add_argument("--embedding-ms", type=float, default=150.0)
+    parser.add_argument("--retrieval-ms", type=float, default=15.0)
+    parser.add_argument("--completion-ms", type=float, default=2000.0)
+    parser.add_argument("--url")
+    parser.add_argument("--token")
+    parser.add_argument("--context-id")
+    parser.add_argument("--message", default="What is this document about?")
+    args = parser.parse_args()
+
+    print(f"{'endpoint':<8} {'concurrency':>11} {'requests/s':>11} {'p50 s':>8} {'p95 s':>8}")
+    asyncio.run(simulate(args) if args.mode == "simulate" else http(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""
+Stage timings and p50 latency of chat pre-processing, sequential versus fanned out.
+
+simulate: runs ChatService.prepare_chat in-process with every stage replaced by a sleep
+drawn from a log-normal distribution around the given median latencies, against the same
+stages awaited one after another as chat_with_context used to. No database or API key needed.
+
+http: sends chats to a running server and summarizes the Server-Timing header it returns.
+
+Usage (from the repository root):
+    python -m benchmarks.chat_stage_benchmark simulate --requests 200 --embedding-ms 150 --history 12
+    python -m benchmarks.chat_stage_benchmark http --url http://localhost:8000/api/chat \\
+        --token <jwt> --context-id <id> --requests 100
+"""
+import argparse
+import asyncio
+import os
+import time
+import uuid
+from collections import defaultdict
+
+import numpy as np
+
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("DATABASE_URL", "postgresql://benchmark@localhost/benchmark")
+
+
+def simulated_stages(args, rng):
+    async def sleep(median_ms):
+        await asyncio.sleep(median_ms * rng.lognormal(0, 0.3) / 1000)
+
+    class Context:
+        id = uuid.uuid4()
+
+    async def ownership(db, context_id, owner_id):
+        await sleep(args.db_ms)
+        return Context()
+
+    async def versions(db, context_id):
+        await sleep(args.db_ms)
+        return []
+
+    async def embedding(text):
+        await sleep(args.embedding_ms)
+        return [1.0] * 8
+
+    async def retrieval(db, context_id, query, top_k=3, similarity_threshold=0.75, mmr=False):
+        await sleep(args.retrieval_ms)
+        return [object()]
+
+    async def compaction(history, model):
+        if history:
+            await sleep(args.compaction_ms)
+        return history
+
+    return ownership, versions, embedding, retrieval, compaction
+
+
+class Session:
+    async def commit(self):
+        pass
+
+
+async def simulate(args):
+    import models.context_model, models.user_model, models.document_model  # noqa: F401  (mapper registry)
+    import services.chat_service as chat_service
+    from services.chat_service import ChatService
+    from repository.chat_repository import ChatRepository
+    from repository.context_repository import ContextRepository
+    from repository.document_repository import DocumentRepository
+    from schemas.chat_schema import ChatRequest
+    from utils.stage_timing import StageTimer
+
+    rng = np.random.default_rng(0)
+    ownership, versions, embedding, retrieval, compaction = simulated_stages(args, rng)
+    ContextRepository.aget_by_id_and_owner = staticmethod(ownership)
+    DocumentRepository.aget_versions_by_context_id = staticmethod(versions)
+    ChatService.aget_embedding = staticmethod(embedding)
+    ChatRepository.aget_relevant_chunk_by_context_and_query = staticmethod(retrieval)
+    compactor = chat_service.get_history_compactor()
+    compactor.compact = compaction
+    compactor.needs_compaction = lambda history, model: bool(history)
+    chat_service.get_context_vector_index = lambda: None
+
+    history = [{"role": "user" if i % 2 == 0 else "assistant", "content": f"message {i}"} for i in range(args.history)]
+    request = ChatRequest(context_id=str(uuid.uuid4()), message="What does the contract say about renewals?", history=history)
+
+    async def sequential():
+        # The order the stages used to run in
+        context = await ownership(None, request.context_id, 0)
+        query = ChatService.format_chat_for_vector_search(request.history, request.message)
+        query_embedding = await embedding(query)
+        await retrieval(None, context.id, query_embedding)
+        await compaction(request.history, "gpt-4")
+
+    results = defaultdict(list)
+    stages = defaultdict(list)
+    for _ in range(args.requests):
+        start = time.perf_counter()
+        await sequential()
+        results["sequential"].append((time.perf_counter() - start) * 1000)
+
+        timer = StageTimer()
+        start = time.perf_counter()
+        await ChatService.prepare_chat(Session(), request, 0, timer)
+        results["fan-out"].append((time.perf_counter() - start) * 1000)
+        for name, duration in timer.stages.items():
+            stages[name].append(duration)
+
+    print(f"{'pipeline':<12} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, latencies in results.items():
+        print(f"{name:<12} {np.percentile(latencies, 50):>8.1f} {np.percentile(latencies, 95):>8.1f}")
+    print()
+    print(f"{'stage':<12} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, durations in stages.items():
+        print(f"{name:<12} {np.percentile(durations, 50):>8.1f} {np.percentile(durations, 95):>8.1f}")
+
+
+async def http(args):
+    import httpx
+
+    headers = {"Authorization": f"Bearer {args.token}"}
+    body = {"context_id": args.context_id, "message": args.message, "history": []}
+    stages = defaultdict(list)
+    async with httpx.AsyncClient(timeout=None) as client:
+        for _ in range(args.requests):
+            response = await client.post(args.url, json=body, headers=headers)
+            response.raise_for_status()
+            for entry in response.headers.get("server-timing", "").split(","):
+                name, _, duration = entry.strip().partition(";dur=")
+                if duration:
+                    stages[name].append(float(duration))
+
+    print(f"{'stage':<12} {'p50 ms':>8} {'p95 ms':>8}")
+    for name, durations in stages.items():
+        print(f"{name:<12} {np.percentile(durations, 50):>8.1f} {np.percentile(durations, 95):>8.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("mode", choices=["simulate", "http"])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--db-ms", type=float, default=3.0, help="Median latency of a simple query")
+    parser.add_argument("--embedding-ms", type=float, default=150.0)
+    parser.add_argument("--retrieval-ms", type=float, default=15.0)
+    parser.add_argument("--compaction-ms", type=float, default=400.0, help="Median latency of a history summary")
+    parser.add_argument("--history", type=int, default=0, help="Messages of history sent with the chat")
+    parser.add_argument("--url")
+    parser.add_argument("--token")
+    parser.add_argument("--context-id")
+    parser.add_argument("--message", default="What is this document about?")
+    args = parser.parse_args()
+    asyncio.run(simulate(args) if args.mode == "simulate" else http(args))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+"""
+Compare rows/sec of the document_chunks writers against a local Postgres with pgvector.
+
+Every run writes into a scratch context and document inside a transaction that is
+rolled back, so the database is left untouched. DATABASE_URL must point at a
+database with the application schema, created from the models (uuid ids) or from
+DDL/init.sql (VARCHAR ids). The COPY writers match the ids to the declared column
+type, which is printed first.
+
+Usage (from the repository root):
+    DATABASE_URL=postgresql://... python -m benchmarks.chunk_writer_benchmark --rows 2000
+"""
+from dotenv import load_dotenv
+load_dotenv()
+
+import argparse
+import time
+import uuid
+import numpy as np
+
+from utils.database import SessionLocal, engine
+from models.context_model import Context
+from models.document_model import Document
+from models.document_chunk_model import DocumentChunk
+from repository.document_chunk_repository import DocumentChunkRepository
+from utils.pg_copy import column_types
+import repository.document_chunk_repository as chunk_repository
+from utils.embedding_provider import EMBEDDING_DIMENSION
+
+
+def make_chunks(document_id, context_id, rows: int, dimension: int = EMBEDDING_DIMENSION):
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((rows, dimension), dtype=np.float32)
+    return [
+        DocumentChunk(
+            document_id=document_id,
+            context_id=context_id,
+            chunk_index=i,
+            content=f"chunk {i} " + "lorem ipsum dolor sit amet " * 35,
+            content_hash=uuid.uuid4().hex,
+            embedding=vectors[i].tolist(),
+            source_page=i // 4 + 1,
+            filename="benchmark.pdf",
+        )
+        for i in range(rows)
+    ]
+
+
+def per_row_add(db, chunks):
+    for chunk in chunks:
+        DocumentChunkRepository.insert(db, chunk)
+    db.flush()
+
+
+def orm_bulk(db, chunks):
+    DocumentChunkRepository.insert_bulk(db, chunks)
+
+
+def copy_binary(db, chunks):
+    chunk_repository.CHUNK_COPY_FORMAT = "binary"
+    DocumentChunkRepository.copy_bulk(db, chunks)
+
+
+def copy_text(db, chunks):
+    chunk_repository.CHUNK_COPY_FORMAT = "text"
+    DocumentChunkRepository.copy_bulk(db, chunks)
+
+
+WRITERS = {
+    "db.add per row": per_row_add,
+    "bulk_save_objects": orm_bulk,
+    "COPY text": copy_text,
+    "COPY binary": copy_binary,
+}
+
+
+def run(writer, rows: int) -> float:
+    db = SessionLocal()
+    try:
+        context = Context(name=f"benchmark-{uuid.uuid4()}", owner_id=0)
+        db.add(context)
+        db.flush()
+        document = Document(context_id=context.id, filename="benchmark.pdf", content_type="application/pdf", file_data=b"")
+        db.add(document)
+        db.flush()
+
+        chunks = make_chunks(document.id, context.id, rows)
+        start = time.perf_counter()
+        writer(db, chunks)
+        db.flush()
+        return time.perf_counter() - start
+    finally:
+        db.rollback()
+        db.close()
+
+
+def main():
+    # SQL echo would dominate the timings
+    engine.echo = False
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=2000)
+    args = parser.parse_args()
+
+    chunk_repository.CHUNK_COPY_MIN_ROWS = 0
+    db = SessionLocal()
+    try:
+        print(f"document_chunks.id is {column_types(db, DocumentChunk.__tablename__)['id']}")
+    finally:
+        db.close()
+    print(f"{'writer':<20} {'seconds':>8} {'rows/sec':>10}")
+    for name, writer in WRITERS.items():
+        elapsed = run(writer, args.rows)
+        print(f"{name:<20} {elapsed:>8.3f} {args.rows / elapsed:>10.0f}")
+
+
+if __name__ == "__main__":
+    main()
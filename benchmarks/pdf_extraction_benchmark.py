@@ -0,0 +1,72 @@
+"""
+Compare sequential and process-pool PDF text extraction on synthetic PDFs.
+
+Usage (from the repository root):
+    python -m benchmarks.pdf_extraction_benchmark --pages 200 400 800 --workers 4
+"""
+import argparse
+import time
+from io import BytesIO
+import fitz
+
+import utils.pdf_extraction as pdf_extraction
+
+
+def make_pdf(pages: int, lines_per_page: int = 60) -> bytes:
+    """Build a text-dense PDF with the given number of pages"""
+    doc = fitz.open()
+    line = "The quick brown fox jumps over the lazy dog while the ledger is reconciled. " * 2
+    for number in range(pages):
+        page = doc.new_page()
+        text = "\n".join(f"{number}.{i} {line}" for i in range(lines_per_page))
+        page.insert_textbox(page.rect + (36, 36, -36, -36), text, fontsize=7)
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def sequential(contents: bytes):
+    """The original single-process page loop"""
+    text = {}
+    with fitz.open(stream=BytesIO(contents), filetype="pdf") as pdf:
+        for i, page in enumerate(pdf):
+            text[i+1] = page.get_text("text") + "\n"
+    return text
+
+
+def parallel(contents: bytes):
+    return dict(pdf_extraction.iter_pdf_pages(contents))
+
+
+def best_of(fn, contents, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(contents)
+        timings.append(time.perf_counter() - start)
+    return min(timings), result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pages", type=int, nargs="+", default=[200, 400, 800])
+    parser.add_argument("--workers", type=int, default=pdf_extraction.PDF_EXTRACT_WORKERS)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    pdf_extraction.PDF_EXTRACT_WORKERS = args.workers
+    pdf_extraction.PDF_PARALLEL_MIN_PAGES = 0
+    # Start the pool before timing so worker start-up is not counted against one size
+    parallel(make_pdf(args.workers * 2))
+
+    print(f"{'pages':>6} {'sequential s':>13} {'parallel s':>11} {'speedup':>8}")
+    for pages in args.pages:
+        contents = make_pdf(pages)
+        seq_time, seq_result = best_of(sequential, contents, args.repeat)
+        par_time, par_result = best_of(parallel, contents, args.repeat)
+        assert seq_result == par_result, "parallel extraction changed the output"
+        print(f"{pages:>6} {seq_time:>13.3f} {par_time:>11.3f} {seq_time / par_time:>7.2f}x")
+
+
+if __name__ == "__main__":
+    main()
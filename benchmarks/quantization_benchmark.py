@@ -0,0 +1,85 @@
+"""
+Recall and latency of the compact embedding tiers against exact cosine search.
+
+Runs offline on a synthetic clustered corpus (or the hashing embedding provider with
+--hashing) and mirrors ChatRepository._fetch_candidate_chunks: a candidate pass over
+the compact representation fetching top_k * overfetch rows, then an exact rerank.
+
+Usage (from the repository root):
+    python -m benchmarks.quantization_benchmark --rows 50000 --queries 200 --top-k 6
+"""
+import argparse
+import time
+import numpy as np
+
+from utils.embedding_provider import EMBEDDING_DIMENSION
+
+
+def clustered_corpus(rows: int, dimension: int, clusters: int, rng):
+    """Unit vectors drawn around cluster centres, closer to real embeddings than pure noise"""
+    centres = rng.standard_normal((clusters, dimension), dtype=np.float32)
+    labels = rng.integers(0, clusters, rows)
+    corpus = centres[labels] + 0.6 * rng.standard_normal((rows, dimension), dtype=np.float32)
+    return corpus / np.linalg.norm(corpus, axis=1, keepdims=True), centres
+
+
+def top(scores, k):
+    if k >= len(scores):
+        return np.argsort(-scores)
+    part = np.argpartition(-scores, k)[:k]
+    return part[np.argsort(-scores[part])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=6)
+    parser.add_argument("--clusters", type=int, default=500)
+    parser.add_argument("--dimension", type=int, default=EMBEDDING_DIMENSION)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    corpus, centres = clustered_corpus(args.rows, args.dimension, args.clusters, rng)
+    queries = centres[rng.integers(0, args.clusters, args.queries)] + 0.8 * rng.standard_normal((args.queries, args.dimension), dtype=np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+
+    # Values rounded to half precision; kept as float32 because numpy has no fast float16 matmul
+    half = corpus.astype(np.float16).astype(np.float32)
+    bits = np.packbits(corpus > 0, axis=1)
+    popcount = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1)
+
+    def half_pass(query, limit):
+        return top(half @ query.astype(np.float16).astype(np.float32), limit)
+
+    def binary_pass(query, limit):
+        query_bits = np.packbits(query > 0)
+        hamming = popcount[np.bitwise_xor(bits, query_bits)].sum(axis=1)
+        return top(-hamming.astype(np.float32), limit)
+
+    tiers = [
+        ("full", None, [1], 4 * args.dimension),
+        ("half", half_pass, [1, 2, 4], 2 * args.dimension),
+        ("binary", binary_pass, [1, 4, 10, 20], args.dimension // 8),
+    ]
+
+    print(f"{'tier':<7} {'overfetch':>9} {f'recall@{args.top_k}':>10} {'ms/query':>9} {'bytes/vector':>13}")
+    truth = [set(top(corpus @ query, args.top_k)) for query in queries]
+    for name, candidate_pass, factors, vector_bytes in tiers:
+        for factor in factors:
+            found = 0
+            start = time.perf_counter()
+            for query, expected in zip(queries, truth):
+                if candidate_pass is None:
+                    result = top(corpus @ query, args.top_k)
+                else:
+                    candidates = candidate_pass(query, args.top_k * factor)
+                    result = candidates[top(corpus[candidates] @ query, args.top_k)]
+                found += len(expected.intersection(result.tolist()))
+            elapsed = (time.perf_counter() - start) / args.queries * 1000
+            recall = found / (args.top_k * args.queries)
+            print(f"{name:<7} {factor:>9} {recall:>10.3f} {elapsed:>9.2f} {vector_bytes:>13}")
+
+
+if __name__ == "__main__":
+    main()
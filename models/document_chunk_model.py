@@ -1,23 +1,32 @@
-from sqlalchemy import Column, Integer, ARRAY, ForeignKey, DateTime, Text, Float
+from sqlalchemy import Column, Integer, ARRAY, ForeignKey, DateTime, Text, Float, String
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.dialects.postgresql import UUID
 import uuid
 from models.base import Base
-from pgvector.sqlalchemy import Vector
+from pgvector.sqlalchemy import Vector, HALFVEC, BIT
+from utils.embedding_provider import EMBEDDING_DIMENSION
+from utils.vector_index import table_indexes
 
 
 class DocumentChunk(Base):
     __tablename__ = "document_chunks"
+    __table_args__ = table_indexes()
 
     id = Column(UUID(as_uuid=True), primary_key=True, default=uuid.uuid4, unique=True, nullable=False)
     document_id = Column(UUID(as_uuid=True), ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
+    # Copy of the document's context_id, so retrieval filters chunks without joining documents
+    context_id = Column(UUID(as_uuid=True), ForeignKey("contexts.id", ondelete="CASCADE"), index=True)
     chunk_index = Column(Integer, nullable=False)
     content = Column(Text, nullable=False)
-    embedding = Column(Vector(1536))
+    embedding = Column(Vector(EMBEDDING_DIMENSION))
+    # Compact copies for the candidate pass, filled according to EMBEDDING_STORAGE_TIER
+    embedding_half = Column(HALFVEC(EMBEDDING_DIMENSION))
+    embedding_binary = Column(BIT(EMBEDDING_DIMENSION))
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     source_page = Column(Integer)
     filename = Column(Text)
+    content_hash = Column(String)
 
     document = relationship("Document", back_populates="chunks")
\ No newline at end of file
@@ -0,0 +1,15 @@
+from sqlalchemy import Column, String, DateTime
+from sqlalchemy.sql import func
+from models.base import Base
+from pgvector.sqlalchemy import Vector
+from utils.embedding_provider import EMBEDDING_DIMENSION
+
+
+class EmbeddingCacheEntry(Base):
+    __tablename__ = "embedding_cache"
+
+    key = Column(String, primary_key=True)
+    model = Column(String, nullable=False)
+    embedding = Column(Vector(EMBEDDING_DIMENSION), nullable=False)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    last_used_at = Column(DateTime(timezone=True), server_default=func.now(), index=True)
@@ -1,10 +1,16 @@
 
 from sqlalchemy.orm import Session
-from sqlalchemy import select, func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import select, func, literal
 from models.document_chunk_model import DocumentChunk
 from models.document_model import Document
-from typing import List
-import numpy as np
+from repository.document_repository import DocumentRepository
+import math
+from typing import List, Optional
+from utils.vector_index import apply_search_settings, aapply_search_settings
+from utils.context_vector_index import ContextVectorIndex
+from utils.quantization import EMBEDDING_STORAGE_TIER, HALF_OVERFETCH_FACTOR, BINARY_OVERFETCH_FACTOR, quantize_half, quantize_binary
+from utils.mmr import RETRIEVAL_MMR_ENABLED, RETRIEVAL_MMR_OVERFETCH_FACTOR, select_diverse
 
 class ChatRepository:
     @staticmethod
@@ -18,48 +24,180 @@ class ChatRepository:
         return db.scalars(stmt).all()
     
     @staticmethod
-    def get_relevant_chunk_by_context_and_query(db: Session, document_ids: List[str], query: List[float], top_k: int=3, similarity_threshold: float=0.75):
-        # First get candidates from database
-        candidates = ChatRepository._fetch_candidate_chunks(db, document_ids, query, top_k)
-        
-        # Then filter and score them
-        return ChatRepository._filter_chunks_by_similarity(candidates, query, top_k, similarity_threshold)
-    
+    def get_relevant_chunk_by_context_and_query(db: Session, context_id: str, query: List[float], top_k: int=3, similarity_threshold: float=0.75, mmr: bool=RETRIEVAL_MMR_ENABLED) -> List["ChunkHit"]:
+        """
+        Return the top_k chunks of the context most similar to query as ChunkHit records.
+        Chunks scoring at least similarity_threshold are preferred; when fewer than top_k
+        do, the best candidates are returned regardless, all from the same query.
+        With mmr (RETRIEVAL_MMR_ENABLED), top_k diverse chunks are picked from a larger candidate set.
+        """
+        if not any(query):
+            # Cosine similarity is undefined for a zero (failed) query embedding
+            return []
+
+        # First get scored candidates from the database
+        candidates = ChatRepository._fetch_candidate_chunks(db, context_id, query, top_k, mmr)
+
+        # Then apply the threshold to the scores computed by the database
+        return ChatRepository._filter_chunks_by_similarity(candidates, top_k, similarity_threshold, mmr)
+
     @staticmethod
-    def _fetch_candidate_chunks(db: Session, document_ids: List[str], query: List[float], top_k: int):
-        """Fetch candidate chunks from the database ordered by vector similarity"""
-        stmt = (
-            select(DocumentChunk)
-            .where(DocumentChunk.document_id.in_(document_ids))
-            .order_by(DocumentChunk.embedding.cosine_distance(query))
-            .limit(top_k * 2)  # Retrieve more candidates initially
-        )        
-        return db.execute(stmt).scalars().all()
-    
+    async def aget_relevant_chunk_by_context_and_query(db: AsyncSession, context_id: str, query: List[float], top_k: int=3, similarity_threshold: float=0.75, mmr: bool=RETRIEVAL_MMR_ENABLED) -> List["ChunkHit"]:
+        """get_relevant_chunk_by_context_and_query for an AsyncSession"""
+        if not any(query):
+            return []
+        candidates = await ChatRepository._afetch_candidate_chunks(db, context_id, query, top_k, mmr)
+        return ChatRepository._filter_chunks_by_similarity(candidates, top_k, similarity_threshold, mmr)
+
+    @staticmethod
+    def get_relevant_chunk_by_context_index(db: Session, index: "ContextVectorIndex", context_id: str, query: List[float], top_k: int=3, similarity_threshold: float=0.75, mmr: bool=RETRIEVAL_MMR_ENABLED) -> List["ChunkHit"]:
+        """
+        Same as get_relevant_chunk_by_context_and_query, with the candidates scored against the
+        context's memory-mapped matrix and only their text loaded from the database
+        """
+        documents = DocumentRepository.get_versions_by_context_id(db, context_id)
+        scored = index.search(db, context_id, documents, query, _candidate_limit(top_k, mmr), with_vectors=mmr)
+        if not scored:
+            return []
+
+        hits = {hit.id: hit for hit in ChatRepository.get_chunk_hits_by_ids(db, [chunk_id for chunk_id, *_ in scored])}
+        candidates = []
+        for chunk_id, score, *vector in scored:
+            hit = hits.get(chunk_id)
+            # Rows of a chunk deleted since the matrix was written are skipped
+            if hit is not None:
+                hit.score = score
+                hit.embedding = vector[0] if vector else None
+                candidates.append(hit)
+        return ChatRepository._filter_chunks_by_similarity(candidates, top_k, similarity_threshold, mmr)
+
+    @staticmethod
+    def get_chunk_hits_by_ids(db: Session, ids: List[str]) -> List["ChunkHit"]:
+        """Chunks by id as unscored ChunkHit records"""
+        stmt = select(*_hit_columns, literal(None).label("score")).where(DocumentChunk.id.in_(ids))
+        return [ChunkHit(*row) for row in db.execute(stmt)]
+
+    @staticmethod
+    def _fetch_candidate_chunks(db: Session, context_id: str, query: List[float], top_k: int, mmr: bool=RETRIEVAL_MMR_ENABLED) -> List["ChunkHit"]:
+        """
+        Fetch candidate chunks from the database ordered by vector similarity, with the
+        cosine similarity computed in SQL and without transferring the embeddings.
+        """
+        exact = apply_search_settings(db, _index_candidates(top_k, mmr), context_id)
+        stmt = ChatRepository._candidate_statement(context_id, query, top_k, mmr, exact)
+        return [ChunkHit(*row) for row in db.execute(stmt)]
+
+    @staticmethod
+    async def _afetch_candidate_chunks(db: AsyncSession, context_id: str, query: List[float], top_k: int, mmr: bool=RETRIEVAL_MMR_ENABLED) -> List["ChunkHit"]:
+        exact = await aapply_search_settings(db, _index_candidates(top_k, mmr), context_id)
+        stmt = ChatRepository._candidate_statement(context_id, query, top_k, mmr, exact)
+        return [ChunkHit(*row) for row in await db.execute(stmt)]
+
+    @staticmethod
+    def _candidate_statement(context_id: str, query: List[float], top_k: int, mmr: bool=RETRIEVAL_MMR_ENABLED, exact: bool=False):
+        """
+        The candidate query.
+        With a compact storage tier, an over-fetched candidate set is found with the
+        half-precision or binary embedding and reranked exactly with the full one.
+        With exact, the context's chunks are read through the context_id index and ranked
+        exactly with the full embedding, which the ANN index cannot serve.
+        The embeddings themselves are only selected when MMR needs them.
+        """
+        limit = _candidate_limit(top_k, mmr)
+        distance = DocumentChunk.embedding.cosine_distance(query)
+        columns = (*_hit_columns, (1 - distance).label("score"))
+        if mmr:
+            columns += (DocumentChunk.embedding,)
+
+        if exact:
+            # An expression the ANN index does not match, so the planner sorts the filtered rows
+            return (
+                select(*columns)
+                .where(DocumentChunk.context_id == context_id)
+                .order_by(distance + 0)
+                .limit(limit)
+            )
+        if EMBEDDING_STORAGE_TIER == "half":
+            candidate_distance = DocumentChunk.embedding_half.cosine_distance(quantize_half(query))
+        elif EMBEDDING_STORAGE_TIER == "binary":
+            candidate_distance = DocumentChunk.embedding_binary.hamming_distance(quantize_binary(query))
+        else:
+            return (
+                select(*columns)
+                .where(DocumentChunk.context_id == context_id)
+                .order_by(distance)
+                .limit(limit)
+            )
+
+        candidates = (
+            select(DocumentChunk.id)
+            .where(DocumentChunk.context_id == context_id)
+            .order_by(candidate_distance)
+            .limit(_index_candidates(top_k, mmr))
+            .subquery()
+        )
+        return (
+            select(*columns)
+            .join(candidates, DocumentChunk.id == candidates.c.id)
+            .order_by(distance)
+            .limit(limit)
+        )
+
     @staticmethod
-    def _filter_chunks_by_similarity(candidates, query: List[float], top_k: int, similarity_threshold: float):
-        """Filter chunks by similarity threshold and return top_k most relevant"""
-        candidates_with_scores = []
-        
-        for chunk in candidates:
-            # Calculate cosine similarity manually
-            chunk_embedding = np.array(chunk.embedding)
-            query_embedding = np.array(query)
-            
-            norm_chunk = np.linalg.norm(chunk_embedding)
-            norm_query = np.linalg.norm(query_embedding)
-            
-            if norm_chunk > 0 and norm_query > 0:
-                cosine_similarity = np.dot(chunk_embedding, query_embedding) / (norm_chunk * norm_query)
-                candidates_with_scores.append((chunk, cosine_similarity))
-        
+    def _filter_chunks_by_similarity(candidates: List["ChunkHit"], top_k: int, similarity_threshold: float, mmr: bool=RETRIEVAL_MMR_ENABLED) -> List["ChunkHit"]:
+        """Filter scored chunks by similarity threshold and return the top_k most relevant, or the top_k picked by MMR"""
+        # Chunks with a zero embedding get a NaN score from pgvector. A relaxed_order
+        # iterative index scan may return the rest slightly out of order.
+        scored = sorted((hit for hit in candidates if not math.isnan(hit.score)), key=lambda hit: hit.score, reverse=True)
+
         # Filter by similarity threshold
-        filtered_candidates = [chunk for chunk, score in candidates_with_scores if score >= similarity_threshold]
-        
-        # If we have enough chunks after filtering, return them (up to top_k)
-        if len(filtered_candidates) >= top_k:
-            return filtered_candidates[:top_k]
-        
-        # Otherwise, fall back to the original candidates (already sorted by the database)
-        return [chunk for chunk, _ in candidates_with_scores][:top_k]
-    
+        filtered_candidates = [hit for hit in scored if hit.score >= similarity_threshold]
+
+        # If we have enough chunks after filtering, pick from them, otherwise fall back
+        # to the original candidates (already sorted by the database)
+        pool = filtered_candidates if len(filtered_candidates) >= top_k else scored
+        if mmr:
+            return select_diverse(pool, top_k)
+        return pool[:top_k]
+
+
+def _candidate_limit(top_k: int, mmr: bool) -> int:
+    """Candidates to retrieve for top_k chunks, more when MMR picks among them"""
+    return top_k * (max(2, RETRIEVAL_MMR_OVERFETCH_FACTOR) if mmr else 2)
+
+
+def _index_candidates(top_k: int, mmr: bool) -> int:
+    """Rows the ANN index scan has to produce, over-fetched with a compact storage tier"""
+    overfetch = {"half": HALF_OVERFETCH_FACTOR, "binary": BINARY_OVERFETCH_FACTOR}.get(EMBEDDING_STORAGE_TIER, 1)
+    return _candidate_limit(top_k, mmr) * overfetch
+
+
+class ChunkHit:
+    """
+    A retrieved chunk and its cosine similarity to the query, with the embedding
+    only when MMR needs it
+    """
+    __slots__ = ("id", "document_id", "chunk_index", "content", "source_page", "filename", "score", "embedding")
+
+    def __init__(self, id, document_id, chunk_index: int, content: str, source_page: Optional[int], filename: Optional[str], score: float, embedding=None):
+        self.id = id
+        self.document_id = document_id
+        self.chunk_index = chunk_index
+        self.content = content
+        self.source_page = source_page
+        self.filename = filename
+        self.score = float(score) if score is not None else math.nan
+        self.embedding = embedding
+
+    def __repr__(self):
+        return f"ChunkHit(id={self.id!r}, chunk_index={self.chunk_index}, score={self.score:.4f})"
+
+
+_hit_columns = (
+    DocumentChunk.id,
+    DocumentChunk.document_id,
+    DocumentChunk.chunk_index,
+    DocumentChunk.content,
+    DocumentChunk.source_page,
+    DocumentChunk.filename,
+)
@@ -3,7 +3,8 @@ from models.context_model import Context
 from fastapi import HTTPException
 from sqlalchemy.orm import Session
 from typing import Optional
-from sqlalchemy import delete
+from sqlalchemy import delete, select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 
 
@@ -15,6 +16,14 @@ class ContextRepository:
             Context.owner_id == owner_id
         ).first()
     
+    @staticmethod
+    async def aget_by_id_and_owner(db:AsyncSession, context_id, owner_id):
+        result = await db.execute(select(Context).where(
+            Context.id == context_id,
+            Context.owner_id == owner_id
+        ).limit(1))
+        return result.scalars().first()
+    
     @staticmethod
     def get_by_owner_and_name(db:Session, name, user_id):
         return db.query(Context).filter(
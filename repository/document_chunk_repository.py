@@ -1,7 +1,32 @@
+import os
+import uuid
 from sqlalchemy.orm import Session
 from typing import List
 from models.document_chunk_model import DocumentChunk
-from sqlalchemy import delete
+from sqlalchemy import delete, select, update, case
+from utils.pg_copy import copy_rows, column_types, match_column_types, UUID, INT4, TEXT, VECTOR, HALFVEC, BIT
+
+
+# Batches smaller than this are inserted through the ORM, COPY only pays off for larger ones
+CHUNK_COPY_MIN_ROWS = int(os.getenv("CHUNK_COPY_MIN_ROWS", 64))
+CHUNK_COPY_FORMAT = os.getenv("CHUNK_COPY_FORMAT", "binary")  # binary or text
+
+# Ids are uuid in databases created from the models and VARCHAR in those created from
+# init.sql, the columns are matched to the table's declared types on the first COPY
+CHUNK_COPY_COLUMNS = [
+    ("id", UUID),
+    ("document_id", UUID),
+    ("context_id", UUID),
+    ("chunk_index", INT4),
+    ("content", TEXT),
+    ("content_hash", TEXT),
+    ("embedding", VECTOR),
+    ("embedding_half", HALFVEC),
+    ("embedding_binary", BIT),
+    ("source_page", INT4),
+    ("filename", TEXT),
+]
+_copy_columns = None
 
 
 class DocumentChunkRepository:
@@ -9,10 +34,85 @@ class DocumentChunkRepository:
     def delete_by_document_ids(db: Session, doc_ids: List[str]):
         db.execute(delete(DocumentChunk).where(DocumentChunk.document_id.in_(doc_ids)))
 
+    @staticmethod
+    def delete_by_ids(db: Session, ids: List[str]):
+        db.execute(delete(DocumentChunk).where(DocumentChunk.id.in_(ids)))
+
     @staticmethod
     def insert(db:Session, document_chunk: DocumentChunk):
         db.add(document_chunk)
     
     @staticmethod
     def insert_bulk(db:Session, document_chunk: List[DocumentChunk]):
-        db.bulk_save_objects(document_chunk)
\ No newline at end of file
+        db.bulk_save_objects(document_chunk)
+
+    @staticmethod
+    def copy_bulk(db: Session, document_chunks: List[DocumentChunk]):
+        """
+        Write chunks with COPY in the session's transaction, falling back to
+        insert_bulk for batches below CHUNK_COPY_MIN_ROWS
+        """
+        if len(document_chunks) < CHUNK_COPY_MIN_ROWS:
+            DocumentChunkRepository.insert_bulk(db, document_chunks)
+            return
+
+        rows = (
+            (
+                chunk.id or uuid.uuid4(),
+                chunk.document_id,
+                chunk.context_id,
+                chunk.chunk_index,
+                chunk.content,
+                chunk.content_hash,
+                chunk.embedding,
+                chunk.embedding_half,
+                chunk.embedding_binary,
+                chunk.source_page,
+                chunk.filename,
+            )
+            for chunk in document_chunks
+        )
+        copy_rows(db, DocumentChunk.__tablename__, DocumentChunkRepository._copy_columns(db), rows, CHUNK_COPY_FORMAT)
+
+    @staticmethod
+    def _copy_columns(db: Session):
+        """CHUNK_COPY_COLUMNS matched to the column types of the table, looked up once per process"""
+        global _copy_columns
+        if _copy_columns is None:
+            _copy_columns = match_column_types(CHUNK_COPY_COLUMNS, column_types(db, DocumentChunk.__tablename__))
+        return _copy_columns
+
+    @staticmethod
+    def get_fingerprints_by_document_id(db: Session, document_id):
+        """Chunk positions and content hashes of a document, without the embeddings"""
+        stmt = (
+            select(
+                DocumentChunk.id,
+                DocumentChunk.chunk_index,
+                DocumentChunk.source_page,
+                DocumentChunk.filename,
+                DocumentChunk.content_hash,
+                # Only rows written before content_hash existed need their content
+                case((DocumentChunk.content_hash.is_(None), DocumentChunk.content), else_=None).label("content"),
+            )
+            .where(DocumentChunk.document_id == document_id)
+            .order_by(DocumentChunk.chunk_index)
+        )
+        return db.execute(stmt).all()
+
+    @staticmethod
+    def update_bulk(db: Session, values: List[dict]):
+        """Update columns of many chunks by primary key, each dict holds an id and the new values"""
+        if values:
+            db.execute(update(DocumentChunk), values)
+
+    @staticmethod
+    def get_embeddings_by_document_ids(db: Session, document_ids: List[str]):
+        """(id, document_id, embedding) of every chunk of the documents, streamed in batches"""
+        stmt = (
+            select(DocumentChunk.id, DocumentChunk.document_id, DocumentChunk.embedding)
+            .where(DocumentChunk.document_id.in_(document_ids))
+            .order_by(DocumentChunk.document_id, DocumentChunk.chunk_index)
+            .execution_options(yield_per=1000)
+        )
+        return db.execute(stmt)
@@ -2,7 +2,8 @@
 from models.document_model import Document, UploadStatus
 from sqlalchemy.orm import Session
 from typing import List
-from sqlalchemy import delete, and_, func
+from sqlalchemy import delete, and_, func, select
+from sqlalchemy.ext.asyncio import AsyncSession
 from utils.database import get_db
 
 
@@ -11,6 +12,15 @@ class DocumentRepository:
     def get_by_context_id(db:Session, context_id):
         return db.query(Document.id, Document.filename, Document.context_id, Document.content_type, Document.created_at, Document.upload_status).filter(Document.context_id == context_id).order_by(Document.created_at.desc()).all()
     
+    @staticmethod
+    def get_versions_by_context_id(db:Session, context_id):
+        return db.query(Document.id, Document.created_at, Document.updated_at, Document.upload_status).filter(Document.context_id == context_id).all()
+
+    @staticmethod
+    async def aget_versions_by_context_id(db:AsyncSession, context_id):
+        result = await db.execute(select(Document.id, Document.created_at, Document.updated_at, Document.upload_status).where(Document.context_id == context_id))
+        return result.all()
+
     @staticmethod
     def get_by_id(db:Session, id):
         return db.query(Document).filter(Document.id == id).first()
@@ -34,4 +44,8 @@ class DocumentRepository:
     @staticmethod
     def get_number_of_documents_by_context_id(db:Session, context_id):
         return db.query(func.count(Document.id)).filter(Document.context_id == context_id).scalar()
-    
\ No newline at end of file
+
+    @staticmethod
+    async def aget_number_of_documents_by_context_id(db:AsyncSession, context_id):
+        result = await db.execute(select(func.count(Document.id)).where(Document.context_id == context_id))
+        return result.scalar()
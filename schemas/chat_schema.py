@@ -8,4 +8,8 @@ class ChatRequest(BaseModel):
 
 class ChatResponse(BaseModel):
     response: str
-    sources: Optional[List[str]] = None
\ No newline at end of file
+    sources: Optional[List[str]] = None
+    # Prompt tokens per section, only when a completion was made
+    usage: Optional[Dict[str, Any]] = None
+    # Work left out to stay within the request's latency budget
+    degradations: Optional[List[str]] = None
\ No newline at end of file
@@ -1,75 +1,129 @@
 import os
+import json
 import time
+import asyncio
+import logging
 import openai
 from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from schemas.chat_schema import ChatRequest, ChatResponse
 from repository.chat_repository import ChatRepository
 from repository.context_repository import ContextRepository
 from repository.document_repository import DocumentRepository
-from fastapi import HTTPException
+from fastapi import HTTPException, Request
+from utils.embedding_provider import get_embedding_provider, EMBEDDING_DIMENSION
+from utils.query_embedding_cache import get_query_embedding_cache
+from utils.embedding_batcher import get_embedding_batcher
+from utils.query_vector import QUERY_VECTOR_MODE, history_texts, combine
+from utils.context_vector_index import get_context_vector_index, document_versions, fingerprint
+from utils.answer_cache import get_answer_cache
+from utils.prompt_budget import pack_prompt
+from utils.prompt_cache import PROMPT_LAYOUT, chunk_order, cached_tokens, get_prompt_cache_stats
+from utils.history_compaction import get_history_compactor
+from utils.stage_timing import StageTimer
+from utils.deadline import Deadline, DeadlineExceeded
+from utils.mmr import RETRIEVAL_MMR_ENABLED
+from typing import Optional
+from utils.database import SessionLocal
 
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 LLM_MODEL = os.getenv("LLM_MODEL", "gpt-4")
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
 DOCUCHAT_WEB_URL = os.getenv("DOCUCHAT_WEB_URL")
-client = openai.OpenAI()
+async_client = openai.AsyncOpenAI()
+
+logger = logging.getLogger(__name__)
+
+_static_instructions = """You are a knowledgeable assistant that provides accurate information based exclusively on the context information below and the conversation history.
+
+INSTRUCTIONS:
+1. Answer questions ONLY using information from the provided context and previous conversation history.
+2. If the answer cannot be fully determined from the context or history, state: "Based on the available information, I cannot provide a complete answer to that question."
+3. Do not use prior knowledge or make assumptions beyond what is explicitly stated in the context.
+4. When citing information, refer to the specific document number (e.g., "According to Document 2...").
+5. If the user asks for clarification about a previous answer, refer to both the context and the conversation history.
+6. Provide concise, well-structured answers that directly address the user's query.
+7. If the user's question is ambiguous, ask for clarification rather than making assumptions.
+8. If the context contains conflicting information, acknowledge the discrepancy and present both viewpoints.
+
+Remember: Your goal is to be helpful while remaining strictly faithful to the provided information."""
 
 
 class ChatService:
     @staticmethod
-    def get_embedding(text, retry_count=3):
+    def get_embedding(text):
         """
-        Get embedding for text using OpenAI API with retry logic and error handling
+        Get embedding for text from the configured embedding provider. With OpenAI, requests go
+        through the shared embedding scheduler, which retries rate-limited and failed requests
+        within the process-wide budget. Repeated queries are answered from the query embedding cache.
         
         Args:
             text: The text to embed
-            retry_count: Number of retries on failure
             
         Returns:
             List of floats representing the embedding vector
         """
         if not text or text.strip() == "":
-            return [0.0] * 1536  # Return zero vector for empty text
-            
-        # Truncate text if it's too long (OpenAI has token limits)
-        max_tokens = 8000  # Adjust based on model limits
-        if len(text) > max_tokens * 4:  # Rough estimate: 4 chars per token
-            text = text[:max_tokens * 4]
-            
-        for attempt in range(retry_count):
-            try:
-                response = client.embeddings.create(
-                    input=text,
-                    model=EMBEDDING_MODEL
-                )
-                return response.data[0].embedding
-            except Exception as e:
-                if attempt == retry_count - 1:  # Last attempt
-                    print(f"Failed to get embedding after {retry_count} attempts: {str(e)}")
-                    # Return a zero vector as fallback
-                    return [0.0] * 1536  # Adjust dimension based on your model
-                else:
-                    # Exponential backoff
-                    time.sleep(2 ** attempt)
+            return [0.0] * EMBEDDING_DIMENSION  # Return zero vector for empty text
+
+        try:
+            provider = get_embedding_provider()
+            return get_query_embedding_cache().get_or_compute(provider.model, text, ChatService._embed)
+        except Exception as e:
+            logger.warning(f"Failed to get embedding: {e}")
+            # Return a zero vector as fallback, it is never cached
+            return [0.0] * EMBEDDING_DIMENSION
+
+    @staticmethod
+    def _embed(text):
+        provider = get_embedding_provider()
+        # Truncate text if it's too long (embedding models have token limits)
+        text = provider.truncate(text)
+        return provider.embed_batches([([text], provider.count_tokens(text))])[0][0]
+
+    @staticmethod
+    async def aget_embedding(text):
+        """get_embedding without blocking the event loop"""
+        if not text or text.strip() == "":
+            return [0.0] * EMBEDDING_DIMENSION
+
+        try:
+            provider = get_embedding_provider()
+            return await get_query_embedding_cache().aget_or_compute(provider.model, text, ChatService._aembed)
+        except Exception as e:
+            logger.warning(f"Failed to get embedding: {e}")
+            return [0.0] * EMBEDDING_DIMENSION
+
+    @staticmethod
+    async def aget_query_embedding(chat_history: list, message: str, query: str):
+        """
+        Retrieval vector of a chat turn. With QUERY_VECTOR_MODE=weighted it combines the embeddings
+        of the new message and of each recent history message, which are cached by content, so only
+        the new message costs an embeddings request. Otherwise query, the recent history and the
+        message as one text, is embedded.
+        """
+        if QUERY_VECTOR_MODE != "weighted":
+            return await ChatService.aget_embedding(query)
+
+        vectors = await asyncio.gather(
+            ChatService.aget_embedding(f"User: {message}"),
+            *(ChatService.aget_embedding(text) for text in history_texts(chat_history)),
+        )
+        return combine(vectors[0], list(vectors[1:]))
+
+    @staticmethod
+    async def _aembed(text):
+        # Concurrent chats share embeddings requests, see EmbeddingBatcher
+        return await get_embedding_batcher().embed(text)
 
     @staticmethod
     def retrieve_relevant_chunks(db: Session, context_id: str, query_embedding, top_k=5):
         """Retrieve most relevant chunks for a given context and query"""
-        return ChatRepository.get_relevant_chunk_by_context_and_query(db, context_id, top_k)
+        return ChatRepository.get_relevant_chunk_by_context_and_query(db, context_id, query_embedding, top_k)
 
     @staticmethod
-    def generate_response(query, context_chunks, history=None):
-        """Generate response using OpenAI API with retrieved context"""
-        if history is None:
-            history = []
-        
-        # Prepare context from chunks
-        context_text = "\n\n".join([f"Document {i+1}: {doc.content}" for i, doc in enumerate(context_chunks)])
-        
-        messages = [
-        {"role": "system", 
-         "content": f"""
+    def render_system_prompt(context_text):
+        return f"""
             You are a knowledgeable assistant that provides accurate information based exclusively on the provided context and conversation history.
 
             CONTEXT INFORMATION:
@@ -86,86 +140,309 @@ class ChatService:
             8. If the context contains conflicting information, acknowledge the discrepancy and present both viewpoints.
 
             Remember: Your goal is to be helpful while remaining strictly faithful to the provided information.
-        """}        
-        ]
-        
-        # Format chat history
-        formatted_query = ChatService.format_chat_for_vector_search(history, query)
-        
-        # Add formatted history as separate messages instead of combining with query
-        for msg in history:
-            messages.append({"role": msg["role"], "content": msg["content"]})
-        
-        # Add the current query as the final user message
-        messages.append({"role": "user", "content": query})
-        
-        response = client.chat.completions.create(
-            model=LLM_MODEL,
-            messages=messages,
-            temperature=0.7,
-            max_tokens=1000
-        )
+        """
+
+    @staticmethod
+    def render_prefix_cached_system_prompt(context_text):
+        # Nothing varies before the context, so every prompt shares the instructions as a cached prefix
+        return f"{_static_instructions}\n\nCONTEXT INFORMATION:\n{context_text}"
+
+    @staticmethod
+    def build_messages(query, context_chunks, history=None):
+        """
+        Build the completion messages within PROMPT_TOKEN_BUDGET: instructions with the retrieved
+        context, the history, then the query. See pack_prompt for what is kept when it does not all fit.
+        With PROMPT_LAYOUT=prefix_cache the static instructions come first and the chunks follow
+        in document and chunk order.
 
-        sources = list(set(f"{chunk.filename} - page {chunk.source_page}" for chunk in context_chunks))
+        Returns:
+            dict with "messages", the "chunks" that made it into the prompt and per-section token "usage"
+        """
+        if PROMPT_LAYOUT == "prefix_cache":
+            return pack_prompt(
+                ChatService.render_prefix_cached_system_prompt, context_chunks, history, query, LLM_MODEL,
+                chunk_order=chunk_order,
+            )
+        return pack_prompt(ChatService.render_system_prompt, context_chunks, history, query, LLM_MODEL)
+
+    @staticmethod
+    def record_completion_usage(prompt: dict, usage, context_id, seconds: float):
+        """Add the provider's token counts, cached prompt tokens included, to the prompt usage"""
+        if usage is None:
+            return
+        prompt["usage"]["layout"] = PROMPT_LAYOUT
+        prompt["usage"]["prompt_tokens"] = usage.prompt_tokens
+        prompt["usage"]["cached_tokens"] = cached_tokens(usage)
+        prompt["usage"]["completion_tokens"] = usage.completion_tokens
+        get_prompt_cache_stats().record(context_id, PROMPT_LAYOUT, usage.prompt_tokens, cached_tokens(usage), seconds)
+
+    @staticmethod
+    def completion_client(deadline: Deadline):
+        """The completion client, limited to the time left of a latency budget without retries"""
+        if deadline.expired():
+            raise HTTPException(status_code=504, detail=str(DeadlineExceeded("completion")))
+        remaining = deadline.remaining()
+        if remaining is None:
+            return async_client
+        return async_client.with_options(timeout=remaining, max_retries=0)
+
+    @staticmethod
+    def format_sources(context_chunks):
+        return list(set(f"{chunk.filename} - page {chunk.source_page}" for chunk in context_chunks))
+
+    @staticmethod
+    async def generate_response(query, context_chunks, history=None, context_id=None, deadline: Optional[Deadline] = None):
+        """
+        Generate response using OpenAI API with retrieved context, history is expected compacted.
+        With a latency budget, max_tokens is cut to what can be generated in the time left.
+        """
+        deadline = deadline or Deadline()
+        prompt = ChatService.build_messages(query, context_chunks, history)
         
+        start = time.perf_counter()
+        try:
+            response = await ChatService.completion_client(deadline).chat.completions.create(
+                model=LLM_MODEL,
+                messages=prompt["messages"],
+                temperature=0.7,
+                max_tokens=deadline.max_tokens(1000)
+            )
+        except openai.APITimeoutError:
+            raise HTTPException(status_code=504, detail=str(DeadlineExceeded("completion")))
+        ChatService.record_completion_usage(prompt, response.usage, context_id, time.perf_counter() - start)
+
         return {
             "response": response.choices[0].message.content,
-            "sources": sources
+            "sources": ChatService.format_sources(prompt["chunks"]),
+            "usage": prompt["usage"]
         }
 
     @staticmethod
-    def chat_with_context(db: Session, chat_request: ChatRequest, user_id):
-        context = ContextRepository.get_by_id_and_owner(db, chat_request.context_id, user_id)
+    async def prepare_chat(
+        db: AsyncSession, chat_request: ChatRequest, user_id, timer: Optional[StageTimer] = None, deadline: Optional[Deadline] = None
+    ) -> dict:
+        """
+        Everything before the completion: ownership check, query embedding, answer cache lookup,
+        retrieval and history compaction.
+
+        The embedding request and the history compaction depend on nothing but the request, so they
+        start at once and run while the database lookups happen; a failed ownership check cancels them.
+
+        Within a latency budget, embedding and retrieval raise a 504 when they run over their share
+        of it, while history compaction and MMR are skipped or abandoned, see Deadline.
+
+        Returns:
+            dict with "response", a finished ChatResponse when no completion is needed (else None),
+            "chunks", the retrieved chunks, "history", the compacted history, and "cache",
+            where to store the answer (or None)
+        """
+        timer = timer or StageTimer()
+        deadline = deadline or Deadline()
+
+        # Create a more comprehensive query by combining history and current message
+        query = ChatService.format_chat_for_vector_search(chat_request.history, chat_request.message)
+        embedding_task = asyncio.create_task(
+            timer.timed("embedding", ChatService.aget_query_embedding(chat_request.history, chat_request.message, query))
+        )
+        compactor = get_history_compactor()
+        history_task = None
+        if compactor.needs_compaction(chat_request.history, LLM_MODEL) and deadline.allows("compaction"):
+            history_task = asyncio.create_task(timer.timed("compaction", compactor.compact(chat_request.history, LLM_MODEL)))
+        try:
+            prepared = await ChatService._prepare_with_context(db, chat_request, user_id, timer, deadline, query, embedding_task)
+            if prepared["response"] is None:
+                prepared["history"] = chat_request.history
+                if history_task is not None:
+                    # Out of time, the prompt budget drops the oldest turns instead
+                    prepared["history"] = await deadline.optional("compaction", history_task, chat_request.history)
+            return prepared
+        except DeadlineExceeded as e:
+            raise HTTPException(status_code=504, detail=str(e))
+        finally:
+            # Early answers and failures leave the background work unused
+            for task in (embedding_task, history_task):
+                if task is not None and not task.done():
+                    task.cancel()
+
+    @staticmethod
+    async def _prepare_with_context(db: AsyncSession, chat_request: ChatRequest, user_id, timer: StageTimer, deadline: Deadline, query, embedding_task) -> dict:
+        with timer.stage("ownership"):
+            context = await ContextRepository.aget_by_id_and_owner(db, chat_request.context_id, user_id)
         if not context:
             raise HTTPException(status_code=404, detail="Context not found")
         
-        documents = DocumentRepository.get_by_context_id(db, context_id=context.id)
-        if not documents:
-            return ChatResponse(
-                response=f"You have not added any documents to the context. Go to [this page]({DOCUCHAT_WEB_URL}/contexts/{context.id}) to add"
-            )
+        # A history-free question may already have been answered in other words
+        cache = None
+        answer_cache = get_answer_cache() if not chat_request.history else None
+        if answer_cache is not None:
+            with timer.stage("fingerprint"):
+                documents_fingerprint = fingerprint(document_versions(await DocumentRepository.aget_versions_by_context_id(db, context.id)))
         
-        # Create a more comprehensive query by combining history and current message
-        query = ChatService.format_chat_for_vector_search(chat_request.history, chat_request.message)
-        query_embedding = ChatService.get_embedding(query)
+        query_embedding = await deadline.required("embedding", embedding_task)
         
-        doc_ids = [doc.id for doc in documents]
+        if answer_cache is not None:
+            cached = answer_cache.get(context.id, documents_fingerprint, query_embedding)
+            if cached is not None:
+                response, sources = cached
+                return {"response": ChatResponse(response=response, sources=sources), "chunks": [], "history": [], "cache": None}
+            cache = (answer_cache, context.id, documents_fingerprint, query_embedding)
         
         # Adjust top_k based on query complexity
         query_words = len(query.split())
         dynamic_top_k = min(max(3, query_words // 10), 8)  # Between 3-8 based on query length
         
-        # Get relevant chunks with dynamic top_k
-        relevant_chunks = ChatRepository.get_relevant_chunk_by_context_and_query(
-            db, 
-            doc_ids, 
-            query_embedding,
-            top_k=dynamic_top_k
-        )
+        # Get relevant chunks with dynamic top_k, the threshold falls back to the best
+        # candidates within the same query when too few chunks pass it
+        vector_index = get_context_vector_index()
+        mmr = RETRIEVAL_MMR_ENABLED and deadline.allows("mmr")
+        with timer.stage("retrieval"):
+            if vector_index is not None:
+                # Building a context's matrix reads embeddings with a sync session, off the event loop
+                retrieval = asyncio.to_thread(
+                    ChatService._retrieve_from_index, vector_index, context.id, query_embedding, dynamic_top_k, mmr
+                )
+            else:
+                retrieval = ChatRepository.aget_relevant_chunk_by_context_and_query(
+                    db, 
+                    context.id, 
+                    query_embedding,
+                    top_k=dynamic_top_k,
+                    mmr=mmr
+                )
+            relevant_chunks = await deadline.required("retrieval", retrieval)
         
-        # If we don't have enough relevant chunks, try to get more context
-        if len(relevant_chunks) < 2 and not chat_request.history:
-            # Try with a more lenient threshold
-            relevant_chunks = ChatRepository.get_relevant_chunk_by_context_and_query(
-                db, doc_ids, query_embedding, top_k=dynamic_top_k, similarity_threshold=0.5
+        # Only a context without chunks needs to know whether it has documents at all
+        if not relevant_chunks and not await DocumentRepository.aget_number_of_documents_by_context_id(db, context.id):
+            response = ChatResponse(
+                response=f"You have not added any documents to the context. Go to [this page]({DOCUCHAT_WEB_URL}/contexts/{context.id}) to add"
             )
+            return {"response": response, "chunks": [], "history": [], "cache": None}
         
         if not relevant_chunks and not chat_request.history:
-            return ChatResponse(
+            response = ChatResponse(
                 response="I don't have enough information to answer that question based on the available documents.",
                 sources=[]
             )
+            return {"response": response, "chunks": [], "history": [], "cache": None}
         
-        response_data = ChatService.generate_response(
-            query=chat_request.message,
-            context_chunks=relevant_chunks,
-            history=chat_request.history
-        )
+        # Release the connection before the completion, which takes far longer than the queries
+        await db.commit()
+        return {"response": None, "chunks": relevant_chunks, "history": None, "cache": cache}
+
+    @staticmethod
+    def _retrieve_from_index(vector_index, context_id, query_embedding, top_k, mmr=RETRIEVAL_MMR_ENABLED):
+        db = SessionLocal()
+        try:
+            return ChatRepository.get_relevant_chunk_by_context_index(db, vector_index, context_id, query_embedding, top_k=top_k, mmr=mmr)
+        finally:
+            db.close()
+
+    @staticmethod
+    def cache_answer(prepared: dict, response: str, sources, deadline: Deadline):
+        """
+        Store the answer for paraphrases of the question, unless the latency budget degraded it:
+        a cut or skimped answer would be served to every later request, budget or not
+        """
+        if prepared["cache"] is not None and not deadline.degradations:
+            answer_cache, context_id, documents_fingerprint, query_embedding = prepared["cache"]
+            answer_cache.put(context_id, documents_fingerprint, query_embedding, response, sources)
+
+    @staticmethod
+    async def chat_with_context(
+        db: AsyncSession, chat_request: ChatRequest, user_id, timer: Optional[StageTimer] = None, deadline: Optional[Deadline] = None
+    ):
+        timer = timer or StageTimer()
+        deadline = deadline or Deadline()
+        prepared = await ChatService.prepare_chat(db, chat_request, user_id, timer, deadline)
+        if prepared["response"] is not None:
+            response = prepared["response"]
+            response.degradations = deadline.degradations or None
+            return response
+        
+        with timer.stage("completion"):
+            response_data = await ChatService.generate_response(
+                query=chat_request.message,
+                context_chunks=prepared["chunks"],
+                history=prepared["history"],
+                context_id=chat_request.context_id,
+                deadline=deadline
+            )
+        ChatService.cache_answer(prepared, response_data["response"], response_data["sources"], deadline)
     
         return ChatResponse(
             response=response_data["response"],
-            sources=response_data["sources"]
+            sources=response_data["sources"],
+            usage=response_data["usage"],
+            degradations=deadline.degradations or None
         )
+
+    @staticmethod
+    async def stream_chat(request: Request, chat_request: ChatRequest, prepared: dict, deadline: Optional[Deadline] = None):
+        """
+        Stream the answer as Server-Sent Events: a "token" event per piece of content as the
+        completion produces it, then a "sources" event with the sources and prompt token usage. Answers that need no completion are sent
+        as a single "token" event. When the client disconnects, the upstream completion is closed.
+        An answer still streaming when the latency budget runs out is cut off there, which the
+        "sources" event lists among the degradations.
+        """
+        deadline = deadline or Deadline()
+        if prepared["response"] is not None:
+            yield ChatService._sse("token", {"content": prepared["response"].response})
+            yield ChatService._sse("sources", {"sources": prepared["response"].sources or [], "degradations": deadline.degradations})
+            return
+
+        prompt = ChatService.build_messages(chat_request.message, prepared["chunks"], prepared["history"])
+        sources = ChatService.format_sources(prompt["chunks"])
+
+        start = time.perf_counter()
+        try:
+            stream = await ChatService.completion_client(deadline).chat.completions.create(
+                model=LLM_MODEL,
+                messages=prompt["messages"],
+                temperature=0.7,
+                max_tokens=deadline.max_tokens(1000),
+                stream=True,
+                # The last chunk then carries the usage, cached prompt tokens included
+                stream_options={"include_usage": True}
+            )
+        except HTTPException as e:
+            yield ChatService._sse("error", {"detail": e.detail})
+            return
+        except Exception as e:
+            logger.warning(f"Failed to start completion: {e}")
+            yield ChatService._sse("error", {"detail": "Failed to generate a response"})
+            return
+
+        parts = []
+        usage = None
+        try:
+            async for chunk in stream:
+                if await request.is_disconnected():
+                    return
+                if deadline.expired():
+                    deadline.degrade("truncated")
+                    break
+                usage = chunk.usage or usage
+                content = chunk.choices[0].delta.content if chunk.choices else None
+                if content:
+                    parts.append(content)
+                    yield ChatService._sse("token", {"content": content})
+        except Exception as e:
+            logger.warning(f"Completion stream failed: {e}")
+            yield ChatService._sse("error", {"detail": "Failed to generate a response"})
+            return
+        finally:
+            # Closing the stream drops the upstream connection, which stops the generation
+            # when the client went away (the response task is cancelled at the next await)
+            await stream.close()
+
+        ChatService.record_completion_usage(prompt, usage, chat_request.context_id, time.perf_counter() - start)
+        ChatService.cache_answer(prepared, "".join(parts), sources, deadline)
+        yield ChatService._sse("sources", {"sources": sources, "usage": prompt["usage"], "degradations": deadline.degradations})
+
+    @staticmethod
+    def _sse(event: str, data: dict) -> str:
+        return f"event: {event}\ndata: {json.dumps(data)}\n\n"
     
     @staticmethod
     def format_chat_for_vector_search(chat_history: list, new_query: str, history_limit: int = 2) -> str:
@@ -11,6 +11,7 @@ from typing import List
 from schemas.base_schema import BaseResponse
 from schemas.document_schema import DocumentText
 import os
+from utils.context_vector_index import get_context_vector_index
 
 MAX_DOCUMENT_PER_CONTEXT = int(os.getenv("MAX_DOCUMENT_PER_CONTEXT", 5))
 
@@ -79,6 +80,11 @@ class ContextService:
         
         ContextRepository.delete_by_id(db, context.id)
         db.commit()
+
+        DocumentService.invalidate_context_caches(context.id)
+        vector_index = get_context_vector_index()
+        if vector_index is not None:
+            vector_index.drop(context.id)
         return BaseResponse(message="deleted", status=200)
         
     
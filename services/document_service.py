@@ -14,15 +14,21 @@ from utils.uuid import uuidv7
 from schemas.document_schema import DocumentText
 from models.enums import UploadStatus
 import os
+import logging
 from messaging.publisher import send_to_nsq_api, publish_to_nsq
 from utils.database import get_db, SessionLocal
-from concurrent.futures import ThreadPoolExecutor
+from utils.ingestion_pipeline import pipeline, batched, INGEST_BATCH_SIZE
+from utils.quantization import compact_embeddings
+from utils.context_vector_index import get_context_vector_index
+from utils.answer_cache import get_answer_cache
 
 
 
 
 ENABLE_BACKGROUND_EMBEDDING = os.getenv("ENABLE_BACKGROUND_EMBEDDING")
 
+logger = logging.getLogger(__name__)
+
 class DocumentService:
     @staticmethod
     def download_document(db:Session, document_id, context_id, owner_id):
@@ -47,8 +53,22 @@ class DocumentService:
         DocumentChunkRepository.delete_by_document_ids(db, [document_id])
         DocumentRepository.delete_by_ids(db, [document_id])
         db.commit()
+        DocumentService.invalidate_context_caches(context.id)
         return BaseResponse(status=200, message="deleted")
 
+    @staticmethod
+    def invalidate_context_caches(context_id):
+        """
+        Drop what this process caches about a context's documents after they changed.
+        Other processes notice the change through the context's document fingerprint.
+        """
+        vector_index = get_context_vector_index()
+        if vector_index is not None:
+            vector_index.invalidate(context_id)
+        answer_cache = get_answer_cache()
+        if answer_cache is not None:
+            answer_cache.invalidate(context_id)
+
     @staticmethod
     async def insert_context_document(db:Session, context_id:str, file:UploadFile)->Document:
         try:
@@ -72,24 +92,14 @@ class DocumentService:
                 return document
             
             # Process document
-            page_map = DocumentProcessor.extract_text_from_file(file_content, file.content_type)
-            chunks = DocumentProcessor.chunk_text_with_page_tracking(page_map)
+            pages = DocumentProcessor.iter_pages(file_content, file.content_type)
             
             # Save chunks with embeddings
-            for i, chunk_text in enumerate(chunks):
-                embedding = DocumentProcessor.get_embedding(chunk_text[1])
-                chunk = DocumentChunk(
-                    document_id=document.id,
-                    chunk_index=i,
-                    content=chunk_text,
-                    embedding=embedding,
-                    source_page = chunk_text[0],
-                    filename=file.filename
-                )
-                DocumentChunkRepository.insert(db, chunk)
-                
-                
+            DocumentService.ingest_pages(db, document.id, document.context_id, file.filename, pages)
+            # The status change also moves updated_at, which changes the context's document fingerprint
+            document.upload_status = UploadStatus.SUCCESS.value
             db.commit()
+            DocumentService.invalidate_context_caches(document.context_id)
             
             return documents
         except Exception as e:
@@ -119,24 +129,14 @@ class DocumentService:
             
             
             # Process document
-            page_map = {1: document_text.content}
-            chunks = DocumentProcessor.chunk_text_with_page_tracking(page_map)
+            pages = [(1, document_text.content)]
             
             # Save chunks with embeddings
-            for i, chunk_text in enumerate(chunks):
-                embedding = DocumentProcessor.get_embedding(chunk_text[1])
-                chunk = DocumentChunk(
-                    document_id=document.id,
-                    chunk_index=i,
-                    content=chunk_text,
-                    embedding=embedding,
-                    source_page = chunk_text[0],
-                    filename=document_text.filename
-                )
-                DocumentChunkRepository.insert(db, chunk)
-            
+            DocumentService.ingest_pages(db, document.id, document.context_id, document_text.filename, pages)
+            document.upload_status = UploadStatus.SUCCESS.value
             db.commit()
             db.refresh(document)
+            DocumentService.invalidate_context_caches(document.context_id)
                 
             return document
         except Exception as e:
@@ -144,29 +144,134 @@ class DocumentService:
             raise HTTPException(status_code=500, detail=str(e))
         
     @staticmethod
-    def chunk_and_embed_document(db: Session, document: Document):
-        page_map = DocumentProcessor.extract_text_from_file(document.file_data, document.content_type)
-        chunks = DocumentProcessor.chunk_text_with_page_tracking(page_map)
-
-        def process_chunk(i, chunk_text):
-            """Function to process and insert a chunk (runs in a thread)"""
-            embedding = DocumentProcessor.get_embedding(chunk_text[1])  # Possibly slow
-            chunk = DocumentChunk(
-                document_id=document.id,
-                chunk_index=i,
+    def build_document_chunks(document_id, context_id, filename, chunks) -> List[DocumentChunk]:
+        """
+        Embed chunks in token-packed batches and build their DocumentChunk rows
+
+        Args:
+            document_id: Id of the document the chunks belong to
+            context_id: Id of the document's context, stored on every chunk
+            filename: Filename stored on every chunk
+            chunks: List of tuples [(chunk_index, page_num, chunk_text), ...]
+        """
+        embeddings = DocumentProcessor.get_embeddings([chunk_text for _, _, chunk_text in chunks])
+
+        return [
+            DocumentChunk(
+                document_id=document_id,
+                context_id=context_id,
+                chunk_index=chunk_index,
                 content=chunk_text,
+                content_hash=DocumentProcessor.content_hash(chunk_text),
                 embedding=embedding,
-                source_page=chunk_text[0],
-                filename=document.filename,
+                source_page=page_num,
+                filename=filename,
+                **compact_embeddings(embedding),
             )
-            return chunk
+            for (chunk_index, page_num, chunk_text), embedding in zip(chunks, embeddings)
+        ]
 
-        with ThreadPoolExecutor(max_workers=4) as executor:
-            chunk_objects = list(executor.map(lambda args: process_chunk(*args), enumerate(chunks)))
+    @staticmethod
+    def ingest_pages(db: Session, document_id, context_id, filename, pages) -> dict:
+        """
+        Stream pages through chunk -> embed -> insert, writing INGEST_BATCH_SIZE chunks at a time.
+        Extraction, embedding and inserts overlap, and only a few batches are held in memory
+        at once however large the document is.
 
-        DocumentChunkRepository.insert_bulk(db, chunk_objects)
+        Chunks are diffed by content hash against the chunks the document already has:
+        unchanged chunks keep their row and embedding and only have their position updated,
+        new content is embedded and inserted, and chunks that no longer appear are deleted.
+        For a new document every chunk is new. The caller commits.
+
+        Args:
+            document_id: Id of the document the chunks belong to
+            context_id: Id of the document's context
+            filename: Filename stored on every chunk
+            pages: Iterable of (page_num, text) tuples, e.g. from DocumentProcessor.iter_pages
+
+        Returns:
+            dict: Number of chunks kept, inserted and deleted
+        """
+        existing = {}
+        for row in DocumentChunkRepository.get_fingerprints_by_document_id(db, document_id):
+            content_hash = row.content_hash or DocumentProcessor.content_hash(row.content)
+            existing.setdefault(content_hash, []).append(row)
+
+        chunks = DocumentProcessor.iter_chunks_with_page_tracking(pages)
+        batches = enumerate(batched(chunks, INGEST_BATCH_SIZE))
+
+        def diff_and_embed(numbered_batch):
+            batch_number, batch = numbered_batch
+            new_chunks = []
+            updates = []
+            for chunk_index, (page_num, chunk_text) in enumerate(batch, batch_number * INGEST_BATCH_SIZE):
+                matches = existing.get(DocumentProcessor.content_hash(chunk_text))
+                if not matches:
+                    new_chunks.append((chunk_index, page_num, chunk_text))
+                    continue
+                row = matches.pop(0)
+                if (row.chunk_index, row.source_page, row.filename) != (chunk_index, page_num, filename):
+                    updates.append({"id": row.id, "chunk_index": chunk_index, "source_page": page_num, "filename": filename})
+            kept = len(batch) - len(new_chunks)
+            return DocumentService.build_document_chunks(document_id, context_id, filename, new_chunks), updates, kept
+
+        stats = {"kept": 0, "inserted": 0, "deleted": 0}
+        for chunk_objects, updates, kept in pipeline(batches, [diff_and_embed]):
+            DocumentChunkRepository.copy_bulk(db, chunk_objects)
+            DocumentChunkRepository.update_bulk(db, updates)
+            stats["inserted"] += len(chunk_objects)
+            stats["kept"] += kept
+
+        removed = [row.id for rows in existing.values() for row in rows]
+        if removed:
+            DocumentChunkRepository.delete_by_ids(db, removed)
+        stats["deleted"] = len(removed)
+        return stats
+
+    @staticmethod
+    def chunk_and_embed_document(db: Session, document: Document):
+        pages = DocumentProcessor.iter_pages(document.file_data, document.content_type)
+        stats = DocumentService.ingest_pages(db, document.id, document.context_id, document.filename, pages)
+        logger.info(f"Embedded document {document.id}: {stats}")
+
+    @staticmethod
+    async def replace_document(db: Session, document_id, context_id, owner_id, file: UploadFile) -> Document:
+        """
+        Replace a document's file, re-embedding only the chunks whose content changed
+        """
+        context = ContextRepository.get_by_id_and_owner(db, context_id, owner_id)
+        if not context:
+            raise HTTPException(status_code=404, detail="Context not found")
+        document = DocumentRepository.get_by_id_and_context_id(db, document_id, context_id)
+        if not document:
+            raise HTTPException(status_code=404, detail="Document not found")
+
+        try:
+            file_content = await file.read()
+            document.filename = file.filename
+            document.content_type = file.content_type
+            document.file_data = file_content
+
+            if ENABLE_BACKGROUND_EMBEDDING == "1":
+                document.upload_status = UploadStatus.IN_QUEUE.value
+                db.commit()
+                db.refresh(document)
+                await publish_to_nsq("embed_document", {"document_id": str(document.id)})
+                return document
+
+            pages = DocumentProcessor.iter_pages(file_content, file.content_type)
+            stats = DocumentService.ingest_pages(db, document.id, document.context_id, file.filename, pages)
+            logger.info(f"Replaced document {document.id}: {stats}")
+
+            document.upload_status = UploadStatus.SUCCESS.value
+            db.commit()
+            db.refresh(document)
+            DocumentService.invalidate_context_caches(document.context_id)
+            return document
+        except Exception as e:
+            print(e)
+            raise HTTPException(status_code=500, detail=str(e))
 
-        
     @staticmethod
     def process_background_document_embedding(documentdata):
         db = None
@@ -193,6 +298,7 @@ class DocumentService:
             # Update status to success
             document.upload_status = UploadStatus.SUCCESS.value
             db.commit()            
+            DocumentService.invalidate_context_caches(document.context_id)
         except Exception as e:
             document.upload_status = UploadStatus.FAILED.value
             db.commit()
@@ -0,0 +1,5 @@
+import os
+
+# Modules create their engine and client on import, nothing connects to them in the tests
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("DATABASE_URL", "postgresql://test@localhost/test")
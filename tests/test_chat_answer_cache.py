@@ -0,0 +1,91 @@
+import models.context_model, models.user_model, models.document_model  # noqa: F401  (mapper registry)
+import asyncio
+import uuid
+import httpx
+import openai
+import pytest
+import services.chat_service as chat_service
+from services.chat_service import ChatService
+from repository.chat_repository import ChatRepository, ChunkHit
+from repository.context_repository import ContextRepository
+from repository.document_repository import DocumentRepository
+from schemas.chat_schema import ChatRequest
+from utils.answer_cache import SemanticAnswerCache
+from utils.deadline import Deadline
+
+
+class Context:
+    id = uuid.uuid4()
+
+
+class Session:
+    async def commit(self):
+        pass
+
+
+def completion(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(200, json={
+        "id": "chatcmpl-test",
+        "object": "chat.completion",
+        "created": 0,
+        "model": "test",
+        "choices": [{"index": 0, "message": {"role": "assistant", "content": "Ninety days."}, "finish_reason": "stop"}],
+        "usage": {"prompt_tokens": 100, "completion_tokens": 3, "total_tokens": 103},
+    })
+
+
+@pytest.fixture
+def answer_cache(monkeypatch):
+    cache = SemanticAnswerCache()
+    chunk = ChunkHit(uuid.uuid4(), uuid.uuid4(), 0, "Either party may renew with 90 days notice.", 1, "contract.pdf", 0.9)
+
+    async def ownership(db, context_id, owner_id):
+        return Context()
+
+    async def versions(db, context_id):
+        return []
+
+    async def query_embedding(chat_history, message, query):
+        return [1.0, 0.0, 0.0]
+
+    async def retrieval(db, context_id, query, top_k=3, similarity_threshold=0.75, mmr=False):
+        return [chunk]
+
+    def build_messages(query, context_chunks, history=None):
+        return {"messages": [{"role": "user", "content": query}], "chunks": context_chunks, "usage": {}}
+
+    monkeypatch.setattr(ContextRepository, "aget_by_id_and_owner", staticmethod(ownership))
+    monkeypatch.setattr(DocumentRepository, "aget_versions_by_context_id", staticmethod(versions))
+    monkeypatch.setattr(ChatService, "aget_query_embedding", staticmethod(query_embedding))
+    monkeypatch.setattr(ChatRepository, "aget_relevant_chunk_by_context_and_query", staticmethod(retrieval))
+    monkeypatch.setattr(ChatService, "build_messages", staticmethod(build_messages))
+    monkeypatch.setattr(chat_service, "get_answer_cache", lambda: cache)
+    monkeypatch.setattr(chat_service, "get_context_vector_index", lambda: None)
+    monkeypatch.setattr(chat_service, "async_client", openai.AsyncOpenAI(
+        api_key="test", max_retries=0, http_client=httpx.AsyncClient(transport=httpx.MockTransport(completion)),
+    ))
+    return cache
+
+
+def chat(deadline: Deadline):
+    request = ChatRequest(context_id=str(Context.id), message="How long is the renewal notice?", history=[])
+    return asyncio.run(ChatService.chat_with_context(Session(), request, 0, deadline=deadline))
+
+
+def test_answer_within_a_short_budget_is_not_cached(answer_cache):
+    response = chat(Deadline(budget_ms=1000))
+
+    assert "max_tokens" in response.degradations
+    assert answer_cache.stores == 0
+    # The next request, without a budget, gets a completion of its own
+    response = chat(Deadline())
+    assert response.usage is not None
+    assert answer_cache.stores == 1
+
+
+def test_answer_without_degradations_is_cached(answer_cache):
+    response = chat(Deadline())
+
+    assert response.degradations is None
+    assert answer_cache.stores == 1
+    assert answer_cache.get(Context.id, chat_service.fingerprint({}), [1.0, 0.0, 0.0]) == ("Ninety days.", ["contract.pdf - page 1"])
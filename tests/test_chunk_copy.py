@@ -0,0 +1,119 @@
+import models.context_model, models.user_model, models.document_model  # noqa: F401  (mapper registry)
+import struct
+import uuid
+from types import SimpleNamespace
+import pytest
+import repository.document_chunk_repository as chunk_repository
+from models.document_chunk_model import DocumentChunk
+from repository.document_chunk_repository import DocumentChunkRepository
+from utils.pg_copy import PGCOPY_HEADER
+
+# Declared column types of document_chunks as created from the models and from init.sql
+MODEL_SCHEMA = {"id": "uuid", "document_id": "uuid", "context_id": "uuid", "content": "text", "filename": "text"}
+INIT_SQL_SCHEMA = {
+    "id": "character varying",
+    "document_id": "character varying",
+    "context_id": "character varying",
+    "content": "text",
+    "filename": "text",
+}
+
+
+class FakeSession:
+    """Answers the column type lookup and keeps what is sent with COPY"""
+
+    def __init__(self, types: dict):
+        self.types = types
+        self.lookups = 0
+        self.copies = []
+
+    def execute(self, statement, params):
+        assert "pg_attribute" in str(statement) and params == {"table": "document_chunks"}
+        self.lookups += 1
+        return list(self.types.items())
+
+    def connection(self):
+        session = self
+
+        class Cursor:
+            def copy_expert(self, sql, buf):
+                session.copies.append((sql, buf.getvalue()))
+
+            def close(self):
+                pass
+
+        return SimpleNamespace(connection=SimpleNamespace(cursor=Cursor))
+
+
+def binary_rows(data: bytes):
+    """Field values of each row of a COPY binary stream"""
+    assert data.startswith(PGCOPY_HEADER)
+    offset, rows = len(PGCOPY_HEADER), []
+    while True:
+        (count,) = struct.unpack_from(">h", data, offset)
+        offset += 2
+        if count == -1:
+            return rows
+        row = []
+        for _ in range(count):
+            (length,) = struct.unpack_from(">i", data, offset)
+            offset += 4
+            row.append(None if length == -1 else data[offset:offset + length])
+            offset += max(length, 0)
+        rows.append(row)
+
+
+@pytest.fixture
+def chunks(monkeypatch):
+    monkeypatch.setattr(chunk_repository, "CHUNK_COPY_MIN_ROWS", 0)
+    monkeypatch.setattr(chunk_repository, "_copy_columns", None)
+    document_id, context_id = uuid.uuid4(), uuid.uuid4()
+    return [
+        DocumentChunk(
+            id=uuid.uuid4(), document_id=document_id, context_id=context_id, chunk_index=i,
+            content=f"chunk {i}", content_hash="hash", embedding=[1.0, 0.0], source_page=1, filename="a.pdf",
+        )
+        for i in range(3)
+    ]
+
+
+def test_binary_copy_writes_uuid_columns_as_16_bytes(monkeypatch, chunks):
+    monkeypatch.setattr(chunk_repository, "CHUNK_COPY_FORMAT", "binary")
+    db = FakeSession(MODEL_SCHEMA)
+
+    DocumentChunkRepository.copy_bulk(db, chunks)
+
+    sql, data = db.copies[0]
+    assert "FORMAT binary" in sql
+    rows = binary_rows(data)
+    assert [row[0] for row in rows] == [chunk.id.bytes for chunk in chunks]
+    assert rows[0][1] == chunks[0].document_id.bytes
+    assert rows[0][2] == chunks[0].context_id.bytes
+
+
+def test_binary_copy_writes_varchar_ids_as_text(monkeypatch, chunks):
+    monkeypatch.setattr(chunk_repository, "CHUNK_COPY_FORMAT", "binary")
+    db = FakeSession(INIT_SQL_SCHEMA)
+
+    DocumentChunkRepository.copy_bulk(db, chunks)
+    DocumentChunkRepository.copy_bulk(db, chunks)
+
+    assert db.lookups == 1
+    rows = binary_rows(db.copies[0][1])
+    assert [row[0] for row in rows] == [str(chunk.id).encode("utf-8") for chunk in chunks]
+    assert rows[0][1] == str(chunks[0].document_id).encode("utf-8")
+    assert rows[0][2] == str(chunks[0].context_id).encode("utf-8")
+    assert rows[0][4] == b"chunk 0"
+
+
+@pytest.mark.parametrize("schema", [MODEL_SCHEMA, INIT_SQL_SCHEMA])
+def test_text_copy_writes_ids_the_same_for_both_schemas(monkeypatch, chunks, schema):
+    monkeypatch.setattr(chunk_repository, "CHUNK_COPY_FORMAT", "text")
+    db = FakeSession(schema)
+
+    DocumentChunkRepository.copy_bulk(db, chunks)
+
+    sql, data = db.copies[0]
+    assert "FORMAT text" in sql
+    first = data.decode("utf-8").splitlines()[0].split("\t")
+    assert first[:3] == [str(chunks[0].id), str(chunks[0].document_id), str(chunks[0].context_id)]
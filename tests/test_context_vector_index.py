@@ -0,0 +1,124 @@
+import os
+import uuid
+import numpy as np
+import pytest
+from repository.document_chunk_repository import DocumentChunkRepository
+from utils.context_vector_index import ContextVectorIndex, _locked, fingerprint
+
+
+class FakeChunks:
+    """Chunk embeddings per document, served the way get_embeddings_by_document_ids streams them"""
+
+    def __init__(self, dimension: int = 4):
+        self.dimension = dimension
+        self.documents = {}
+        self.loaded = []
+
+    def add(self, document_id: str, *vectors):
+        self.documents[document_id] = [(uuid.uuid4(), uuid.UUID(document_id), list(vector)) for vector in vectors]
+
+    def get_embeddings_by_document_ids(self, db, document_ids):
+        self.loaded.append(sorted(document_ids))
+        return [row for document_id in document_ids for row in self.documents.get(document_id, [])]
+
+
+@pytest.fixture
+def chunks(monkeypatch):
+    chunks = FakeChunks()
+    monkeypatch.setattr(DocumentChunkRepository, "get_embeddings_by_document_ids", staticmethod(chunks.get_embeddings_by_document_ids))
+    return chunks
+
+
+def search(index, context_id, versions, query, limit=10):
+    matrix = index._get(None, context_id, versions)
+    positions, scores = matrix.search(np.asarray(query, dtype=np.float32), limit)
+    return [uuid.UUID(bytes=bytes(chunk_id)) for chunk_id in matrix.rows["chunk_id"][positions]], scores
+
+
+def test_context_without_chunks_can_be_extended(tmp_path, chunks):
+    index = ContextVectorIndex(str(tmp_path))
+    context_id = str(uuid.uuid4())
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    chunks.add(first)
+
+    found, _ = search(index, context_id, {first: "1"}, [1, 0, 0, 0])
+    assert found == []
+
+    chunks.add(second, [1, 0, 0, 0], [0, 1, 0, 0])
+    found, scores = search(index, context_id, {first: "1", second: "1"}, [1, 0, 0, 0])
+    assert found[0] == chunks.documents[second][0][0]
+    assert scores[0] == pytest.approx(1.0)
+    # The empty document was reused from the first file
+    assert chunks.loaded[-1] == [second]
+
+
+def test_legacy_empty_file_is_reused(tmp_path, chunks):
+    index = ContextVectorIndex(str(tmp_path))
+    context_id = str(uuid.uuid4())
+    first, second = str(uuid.uuid4()), str(uuid.uuid4())
+    path = os.path.join(str(tmp_path), context_id)
+    os.makedirs(path)
+    # Written before empty matrices had the embedding dimension
+    old = fingerprint({first: "1"})
+    np.save(os.path.join(path, f"{old}.matrix.npy"), np.empty((0, 0), dtype=np.float32))
+    np.save(os.path.join(path, f"{old}.rows.npy"), np.empty(0, dtype=[("chunk_id", "S16"), ("document_id", "S16")]))
+    with open(os.path.join(path, f"{old}.json"), "w") as f:
+        f.write(f'{{"{first}": "1"}}')
+
+    chunks.add(second, [0, 0, 1, 0])
+    found, _ = search(index, context_id, {first: "1", second: "1"}, [0, 0, 1, 0])
+    assert found == [chunks.documents[second][0][0]]
+
+
+def test_only_versions_older_than_the_new_one_are_removed(tmp_path, chunks):
+    # Two indexes on the same directory stand for two processes
+    first_process, second_process = ContextVectorIndex(str(tmp_path)), ContextVectorIndex(str(tmp_path))
+    context_id = str(uuid.uuid4())
+    path = os.path.join(str(tmp_path), context_id)
+    document = str(uuid.uuid4())
+    chunks.add(document, [1, 0, 0, 0])
+
+    search(first_process, context_id, {document: "1"}, [1, 0, 0, 0])
+    search(first_process, context_id, {document: "3"}, [1, 0, 0, 0])
+    older, newer = fingerprint({document: "1"}), fingerprint({document: "3"})
+    assert f"{older}.json" not in os.listdir(path)
+    # The second process builds from a stale view while the first one's file is newer
+    for name in os.listdir(path):
+        if name.startswith(newer):
+            os.utime(os.path.join(path, name), (4_000_000_000, 4_000_000_000))
+    search(second_process, context_id, {document: "2"}, [1, 0, 0, 0])
+
+    names = os.listdir(path)
+    assert f"{fingerprint({document: '2'})}.json" in names
+    assert {f"{newer}.json", f"{newer}.matrix.npy", f"{newer}.rows.npy"} <= set(names)
+
+
+def test_incomplete_version_is_rebuilt(tmp_path, chunks):
+    index = ContextVectorIndex(str(tmp_path))
+    context_id = str(uuid.uuid4())
+    document = str(uuid.uuid4())
+    chunks.add(document, [0, 1, 0, 0])
+    versions = {document: "1"}
+
+    search(index, context_id, versions, [0, 1, 0, 0])
+    os.remove(os.path.join(str(tmp_path), context_id, f"{fingerprint(versions)}.matrix.npy"))
+    index.invalidate(context_id)
+
+    found, _ = search(index, context_id, versions, [0, 1, 0, 0])
+    assert found == [chunks.documents[document][0][0]]
+
+
+def test_prune_skips_locked_contexts(tmp_path, chunks):
+    index = ContextVectorIndex(str(tmp_path), max_contexts=1)
+    busy, idle = str(tmp_path / "busy"), str(tmp_path / "idle")
+    os.makedirs(busy)
+    os.makedirs(idle)
+    os.utime(busy, (1, 1))
+    os.utime(idle, (2, 2))
+    os.makedirs(str(tmp_path / "recent"))
+
+    with _locked(busy):
+        index._prune()
+
+    assert os.path.isdir(busy)
+    assert not os.path.exists(idle)
@@ -0,0 +1,269 @@
+import json
+import time
+import asyncio
+import threading
+import httpx
+import openai
+import pytest
+from utils import embedding_scheduler
+from utils.embedding_scheduler import EmbeddingScheduler, TokenBucket, parse_reset_duration
+
+
+class FakeEmbeddingServer:
+    """
+    Local stand-in for the OpenAI embeddings endpoint. Requests and tokens per minute are
+    enforced with continuously refilled budgets like the real API: a request over either
+    budget gets a 429 with the x-ratelimit-* and retry-after-ms headers. throttle_first
+    answers the first requests with a 429 regardless of the budget.
+
+    An input's tokens are its words, and its vector is [its first word as a number].
+    """
+
+    def __init__(self, rpm: int, tpm: int, throttle_first: int = 0, latency: float = 0.005):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.request_level = float(rpm)
+        self.token_level = float(tpm)
+        self.updated_at = time.monotonic()
+        self.throttle_first = throttle_first
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.accepted = 0
+        self.rejected = 0
+        self.over_budget = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        elapsed = now - self.updated_at
+        self.request_level = min(self.rpm, self.request_level + elapsed * self.rpm / 60)
+        self.token_level = min(self.tpm, self.token_level + elapsed * self.tpm / 60)
+        self.updated_at = now
+
+    def _headers(self) -> dict:
+        return {
+            "x-ratelimit-limit-requests": str(self.rpm),
+            "x-ratelimit-remaining-requests": str(int(self.request_level)),
+            "x-ratelimit-limit-tokens": str(self.tpm),
+            "x-ratelimit-remaining-tokens": str(int(self.token_level)),
+            "x-ratelimit-reset-requests": f"{int(60000 / self.rpm)}ms",
+        }
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        texts = json.loads(request.content)["input"]
+        tokens = sum(len(text.split()) for text in texts)
+
+        with self.lock:
+            self._refill()
+            throttled = self.accepted + self.rejected < self.throttle_first
+            over_budget = self.request_level < 1 or self.token_level < tokens
+            if throttled or over_budget:
+                self.rejected += 1
+                self.over_budget += over_budget
+                headers = {**self._headers(), "retry-after-ms": "20"}
+                return httpx.Response(429, headers=headers, json={"error": {"message": "Rate limit reached", "type": "requests"}})
+            self.request_level -= 1
+            self.token_level -= tokens
+            self.accepted += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            headers = self._headers()
+
+        try:
+            await asyncio.sleep(self.latency)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+
+        # The API does not promise the order of data, reversing it checks that index is used
+        data = [
+            {"object": "embedding", "index": index, "embedding": [float(text.split()[0])]}
+            for index, text in enumerate(texts)
+        ]
+        body = {
+            "object": "list",
+            "data": data[::-1],
+            "model": "fake-embedding",
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+        return httpx.Response(200, headers=headers, json=body)
+
+
+class RecordingScheduler(EmbeddingScheduler):
+    """EmbeddingScheduler keeping every concurrency change as (throttled, before, after)"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.adaptations = []
+
+    def _adapt(self, headers, throttled: bool = False):
+        before = self.concurrency
+        super()._adapt(headers, throttled)
+        self.adaptations.append((throttled, before, self.concurrency))
+
+
+@pytest.fixture
+def make_scheduler():
+    schedulers = []
+
+    def make(server: FakeEmbeddingServer, **kwargs) -> RecordingScheduler:
+        client = openai.AsyncOpenAI(
+            api_key="test",
+            base_url="http://fake-openai/v1",
+            max_retries=0,
+            http_client=httpx.AsyncClient(transport=httpx.MockTransport(server.handle)),
+        )
+        scheduler = RecordingScheduler(client=client, model="fake-embedding", **kwargs)
+        schedulers.append(scheduler)
+        return scheduler
+
+    yield make
+    for scheduler in schedulers:
+        scheduler._loop.call_soon_threadsafe(scheduler._loop.stop)
+
+
+def make_batches(count: int, inputs: int, words: int):
+    """count batches of inputs texts of words words, the first word numbering the text"""
+    batches = []
+    for batch in range(count):
+        texts = [" ".join([str(batch * inputs + i)] + ["word"] * (words - 1)) for i in range(inputs)]
+        batches.append((texts, inputs * words))
+    return batches
+
+
+def assert_in_order(batches, results):
+    assert len(results) == len(batches)
+    for (texts, _), vectors in zip(batches, results):
+        assert vectors == [[float(text.split()[0])] for text in texts]
+
+
+def test_scheduler_completes_batches_in_order_within_request_budget(make_scheduler):
+    server = FakeEmbeddingServer(rpm=60, tpm=1_000_000)
+    scheduler = make_scheduler(server, rpm_limit=60, tpm_limit=1_000_000, min_concurrency=1, max_concurrency=8)
+    batches = make_batches(40, inputs=3, words=5)
+
+    results = scheduler.embed_batches(batches)
+
+    assert_in_order(batches, results)
+    assert server.over_budget == 0
+    assert server.accepted == 40
+    assert server.max_in_flight <= 8
+
+
+def test_scheduler_waits_for_token_budget_instead_of_exceeding_it(make_scheduler):
+    # 60000 tokens per minute refill 1000 per second, 62 batches of 1000 tokens need two seconds more
+    server = FakeEmbeddingServer(rpm=10_000, tpm=60_000)
+    scheduler = make_scheduler(server, rpm_limit=10_000, tpm_limit=60_000, min_concurrency=4, max_concurrency=16)
+    batches = make_batches(62, inputs=10, words=100)
+
+    start = time.monotonic()
+    results = scheduler.embed_batches(batches)
+    elapsed = time.monotonic() - start
+
+    assert_in_order(batches, results)
+    assert server.over_budget == 0
+    assert elapsed >= 1.5
+
+
+def test_scheduler_halves_concurrency_on_429_and_retries(make_scheduler):
+    server = FakeEmbeddingServer(rpm=100_000, tpm=10_000_000, throttle_first=3)
+    scheduler = make_scheduler(server, rpm_limit=100_000, tpm_limit=10_000_000, min_concurrency=1, max_concurrency=16)
+    scheduler.concurrency = 8
+    batches = make_batches(20, inputs=2, words=3)
+
+    results = scheduler.embed_batches(batches)
+
+    assert_in_order(batches, results)
+    assert server.rejected == 3
+    throttled = [(before, after) for was_throttled, before, after in scheduler.adaptations if was_throttled]
+    assert len(throttled) == 3
+    assert all(after == max(1, before // 2) for before, after in throttled)
+    assert throttled[0] == (8, 4)
+
+
+def test_scheduler_raises_after_max_retries(make_scheduler):
+    server = FakeEmbeddingServer(rpm=100_000, tpm=10_000_000, throttle_first=100)
+    scheduler = make_scheduler(server, rpm_limit=100_000, tpm_limit=10_000_000, max_retries=2)
+
+    with pytest.raises(openai.RateLimitError):
+        scheduler.embed_batches(make_batches(1, inputs=1, words=1))
+    assert server.rejected == 3
+
+
+@pytest.mark.parametrize(
+    "value, seconds",
+    [
+        ("20ms", 0.02),
+        ("1s", 1.0),
+        ("6m0s", 360.0),
+        ("1h2m3s", 3723.0),
+        ("1.5s", 1.5),
+        ("0.25", 0.25),
+        ("", None),
+        (None, None),
+        ("soon", None),
+    ],
+)
+def test_parse_reset_duration(value, seconds):
+    if seconds is None:
+        assert parse_reset_duration(value) is None
+    else:
+        assert parse_reset_duration(value) == pytest.approx(seconds)
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(embedding_scheduler, "time", clock)
+    return clock
+
+
+def test_token_bucket_starts_full_and_refills_per_minute(clock):
+    bucket = TokenBucket(600)
+    assert bucket.wait_time(600) == 0
+
+    bucket.take(600)
+    # 600 per minute refill 10 per second
+    assert bucket.wait_time(10) == pytest.approx(1.0)
+
+    clock.now += 0.5
+    assert bucket.wait_time(10) == pytest.approx(0.5)
+    clock.now += 0.5
+    assert bucket.wait_time(10) == 0
+
+
+def test_token_bucket_never_refills_beyond_capacity(clock):
+    bucket = TokenBucket(60)
+    clock.now += 3600
+    bucket.take(60)
+    assert bucket.wait_time(1) == pytest.approx(1.0)
+
+
+def test_token_bucket_caps_requests_larger_than_capacity(clock):
+    bucket = TokenBucket(100)
+    # A request above the whole budget waits for a full bucket instead of forever
+    assert bucket.wait_time(1000) == 0
+    bucket.take(1000)
+    assert bucket.level == 0
+    assert bucket.wait_time(1000) == pytest.approx(60.0)
+
+
+def test_token_bucket_syncs_with_server_headers(clock):
+    bucket = TokenBucket(100)
+    bucket.sync(limit=200, remaining=50)
+    assert bucket.capacity == 200
+    assert bucket.level == 50
+
+    # The server reporting more left than the bucket holds does not raise it
+    bucket.sync(limit=None, remaining=150)
+    assert bucket.level == 50
+    assert bucket.capacity == 200
@@ -0,0 +1,64 @@
+from concurrent.futures import Future
+import fitz
+import utils.pdf_extraction as pdf_extraction
+
+
+class InlinePool:
+    """Runs each submitted range right away, recording the submissions"""
+
+    def __init__(self):
+        self.submitted = []
+
+    def submit(self, fn, *args):
+        self.submitted.append(args[1:])
+        future = Future()
+        future.set_result(fn(*args))
+        return future
+
+
+def make_pdf(pages: int) -> bytes:
+    doc = fitz.open()
+    for number in range(pages):
+        doc.new_page().insert_text((72, 72), f"page {number + 1}")
+    data = doc.tobytes()
+    doc.close()
+    return data
+
+
+def test_ranges_are_capped():
+    assert pdf_extraction.page_ranges(1000, 2, max_pages=32)[:2] == [(0, 32), (32, 64)]
+    assert pdf_extraction.page_ranges(10, 1, max_pages=32) == [(0, 5), (5, 10)]
+
+
+def test_submissions_stay_within_the_window(monkeypatch):
+    pool = InlinePool()
+    monkeypatch.setattr(pdf_extraction, "_get_pool", lambda: pool)
+    monkeypatch.setattr(pdf_extraction, "PDF_PARALLEL_MIN_PAGES", 0)
+    monkeypatch.setattr(pdf_extraction, "PDF_EXTRACT_WORKERS", 2)
+    monkeypatch.setattr(pdf_extraction, "PDF_EXTRACT_RANGE_PAGES", 2)
+    monkeypatch.setattr(pdf_extraction, "PDF_EXTRACT_MAX_IN_FLIGHT", 3)
+
+    pages = []
+    for page_num, text in pdf_extraction.iter_pdf_pages(make_pdf(20)):
+        consumed_ranges = (page_num - 1) // 2
+        # The range being yielded, plus at most the window submitted ahead of it
+        assert len(pool.submitted) <= consumed_ranges + 1 + 3
+        pages.append((page_num, text.strip()))
+
+    assert pages == [(i, f"page {i}") for i in range(1, 21)]
+    assert pool.submitted == [(start, start + 2) for start in range(0, 20, 2)]
+
+
+def test_stopping_early_cancels_pending_ranges(monkeypatch):
+    pool = InlinePool()
+    monkeypatch.setattr(pdf_extraction, "_get_pool", lambda: pool)
+    monkeypatch.setattr(pdf_extraction, "PDF_PARALLEL_MIN_PAGES", 0)
+    monkeypatch.setattr(pdf_extraction, "PDF_EXTRACT_WORKERS", 2)
+    monkeypatch.setattr(pdf_extraction, "PDF_EXTRACT_RANGE_PAGES", 1)
+    monkeypatch.setattr(pdf_extraction, "PDF_EXTRACT_MAX_IN_FLIGHT", 2)
+
+    pages = pdf_extraction.iter_pdf_pages(make_pdf(50))
+    next(pages)
+    pages.close()
+
+    assert len(pool.submitted) == 3
@@ -0,0 +1,21 @@
+import asyncio
+from utils.embedding_cache import DiskEmbeddingCache, cache_key
+from utils.query_embedding_cache import QueryEmbeddingCache
+
+
+def test_shared_lookups_stay_out_of_ingestion_stats(tmp_path):
+    shared = DiskEmbeddingCache(str(tmp_path / "cache.sqlite3"))
+    shared.put_many("model", {cache_key("model", "known question"): [1.0, 0.0]})
+    cache = QueryEmbeddingCache(shared=shared)
+
+    assert cache.get("model", "known question") == [1.0, 0.0]
+    assert cache.get("model", "new question") is None
+    vector = asyncio.run(cache.aget_or_compute("model", "other question", lambda text: asyncio.sleep(0, [0.0, 1.0])))
+
+    assert vector == [0.0, 1.0]
+    assert shared.stats()["hits"] == shared.stats()["misses"] == 0
+    assert cache.stats()["shared_hits"] == 1
+    assert cache.stats()["misses"] == 1
+    # Ingestion lookups are still counted
+    shared.get_many([cache_key("model", "known question"), cache_key("model", "unknown")])
+    assert (shared.stats()["hits"], shared.stats()["misses"]) == (1, 1)
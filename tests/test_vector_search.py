@@ -0,0 +1,87 @@
+import models.context_model, models.user_model, models.document_model  # noqa: F401  (mapper registry)
+import math
+import pytest
+from sqlalchemy.dialects import postgresql
+from repository.chat_repository import ChatRepository, ChunkHit
+from utils import vector_index
+
+
+def compile(statement) -> str:
+    return str(statement.compile(dialect=postgresql.dialect()))
+
+
+@pytest.fixture
+def hnsw(monkeypatch):
+    monkeypatch.setattr(vector_index, "VECTOR_INDEX_TYPE", "hnsw")
+    monkeypatch.setattr(vector_index, "VECTOR_ITERATIVE_SCAN", "relaxed_order")
+    monkeypatch.setattr(vector_index, "VECTOR_EXACT_SCAN_MAX_ROWS", 2000)
+
+
+def test_search_settings_count_the_context_up_to_the_threshold(hnsw):
+    statement, params = vector_index._search_settings_statement(40, "context")
+
+    assert "WHERE context_id = :context_id LIMIT :exact_limit" in str(statement)
+    assert params["exact_limit"] == 2001
+    assert params["exact_max_rows"] == 2000
+    assert {params["name_0"], params["name_1"]} == {"hnsw.ef_search", "hnsw.iterative_scan"}
+
+
+def test_search_settings_skip_the_count_without_threshold(hnsw, monkeypatch):
+    monkeypatch.setattr(vector_index, "VECTOR_EXACT_SCAN_MAX_ROWS", 0)
+    statement, params = vector_index._search_settings_statement(40, "context")
+
+    assert "context_id" not in params
+    assert "document_chunks" not in str(statement)
+
+
+def test_exact_candidates_are_not_ordered_by_the_indexed_expression():
+    query = [0.1] * 4
+    ann = compile(ChatRepository._candidate_statement("context", query, 3, mmr=False))
+    exact = compile(ChatRepository._candidate_statement("context", query, 3, mmr=False, exact=True))
+
+    assert "ORDER BY document_chunks.embedding <=> %(embedding_1)s" in ann
+    assert "ORDER BY (document_chunks.embedding <=> %(embedding_1)s) + %(" in exact
+
+
+def test_candidates_are_sorted_after_a_relaxed_scan():
+    def hit(score):
+        return ChunkHit(id=score, document_id=None, chunk_index=0, content="", source_page=None, filename=None, score=score)
+
+    candidates = [hit(0.8), hit(0.9), hit(math.nan), hit(0.7)]
+    picked = ChatRepository._filter_chunks_by_similarity(candidates, top_k=2, similarity_threshold=0.75, mmr=False)
+
+    assert [chunk.score for chunk in picked] == [0.9, 0.8]
+
+
+@pytest.mark.parametrize("version, supported", [("0.7.4", False), ("0.8.0", True), ("0.10.1", True), ("1.0", True), (None, False)])
+def test_iterative_scan_needs_pgvector_0_8(version, supported):
+    assert vector_index.supports_iterative_scan(version) is supported
+
+
+class FakeSession:
+    """Answers the pgvector version lookup and keeps the settings statements"""
+
+    def __init__(self, version: str):
+        self.version = version
+        self.statements = []
+
+    def execute(self, statement, params=None):
+        self.statements.append((str(statement), params))
+        if "pg_extension" in str(statement):
+            return type("Result", (), {"scalar": lambda _: self.version})()
+        return type("Result", (), {"one": lambda _: (None, None, True)})()
+
+
+@pytest.mark.parametrize("version, iterative", [("0.7.4", False), ("0.8.0", True)])
+def test_iterative_scan_is_only_set_when_pgvector_has_it(hnsw, monkeypatch, version, iterative):
+    monkeypatch.setattr(vector_index, "_iterative_scan_supported", None)
+    db = FakeSession(version)
+
+    vector_index.apply_search_settings(db, 40, "context")
+    vector_index.apply_search_settings(db, 40, "context")
+
+    lookups = [statement for statement, _ in db.statements if "pg_extension" in statement]
+    settings = [params for statement, params in db.statements if "set_config" in statement]
+    assert len(lookups) == 1
+    assert len(settings) == 2
+    assert ("hnsw.iterative_scan" in settings[0].values()) is iterative
@@ -0,0 +1,152 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from typing import List, Optional, Tuple
+import numpy as np
+
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE_ENABLED", "0") == "1"
+# Cosine similarity between query embeddings above which a cached answer is reused
+ANSWER_CACHE_SIMILARITY_THRESHOLD = float(os.getenv("ANSWER_CACHE_SIMILARITY_THRESHOLD", 0.95))
+ANSWER_CACHE_TTL_SECONDS = int(os.getenv("ANSWER_CACHE_TTL_SECONDS", 86400))
+ANSWER_CACHE_MAX_ENTRIES_PER_CONTEXT = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES_PER_CONTEXT", 256))
+ANSWER_CACHE_MAX_CONTEXTS = int(os.getenv("ANSWER_CACHE_MAX_CONTEXTS", 1024))
+
+
+class _ContextAnswers:
+    """Cached answers of one context, valid for one fingerprint of its documents"""
+
+    def __init__(self, fingerprint: str):
+        self.fingerprint = fingerprint
+        self.vectors = np.empty((0, 0), dtype=np.float32)
+        self.answers: List[Tuple[str, List[str], float]] = []  # (response, sources, stored at)
+
+    def expire(self, now: float, ttl_seconds: int):
+        keep = [i for i, (_, _, stored_at) in enumerate(self.answers) if now - stored_at < ttl_seconds]
+        if len(keep) < len(self.answers):
+            self.vectors = self.vectors[keep]
+            self.answers = [self.answers[i] for i in keep]
+
+
+class SemanticAnswerCache:
+    """
+    Per-context cache of chat answers looked up by query embedding similarity, so a question
+    already answered in other words is served without another completion.
+
+    Entries of a context are tied to a fingerprint of its documents and dropped as soon as
+    a lookup or store sees a different one, which happens in every process once a document
+    is added, replaced or removed. Only history-free questions are cached, since an answer
+    that depends on a conversation cannot be reused for another one.
+    """
+
+    def __init__(
+        self,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY_THRESHOLD,
+        ttl_seconds: int = ANSWER_CACHE_TTL_SECONDS,
+        max_entries_per_context: int = ANSWER_CACHE_MAX_ENTRIES_PER_CONTEXT,
+        max_contexts: int = ANSWER_CACHE_MAX_CONTEXTS,
+    ):
+        self.similarity_threshold = similarity_threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries_per_context = max_entries_per_context
+        self.max_contexts = max_contexts
+        self._contexts: "OrderedDict[str, _ContextAnswers]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector: List[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else None
+
+    def _entries(self, context_id: str, fingerprint: str, create: bool) -> Optional[_ContextAnswers]:
+        entries = self._contexts.get(context_id)
+        if entries is not None and entries.fingerprint != fingerprint:
+            del self._contexts[context_id]
+            self.invalidations += 1
+            entries = None
+        if entries is None and create:
+            entries = self._contexts[context_id] = _ContextAnswers(fingerprint)
+            while len(self._contexts) > self.max_contexts:
+                self._contexts.popitem(last=False)
+        if entries is not None:
+            self._contexts.move_to_end(context_id)
+        return entries
+
+    def get(self, context_id, fingerprint: str, query_embedding: List[float]) -> Optional[Tuple[str, List[str]]]:
+        """Return (response, sources) of the most similar cached question above the threshold, or None"""
+        query = self._normalize(query_embedding)
+        with self._lock:
+            entries = self._entries(str(context_id), fingerprint, create=False)
+            if query is None or entries is None:
+                self.misses += 1
+                return None
+            entries.expire(time.time(), self.ttl_seconds)
+            if not entries.answers:
+                self.misses += 1
+                return None
+
+            similarities = entries.vectors @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] < self.similarity_threshold:
+                self.misses += 1
+                return None
+            self.hits += 1
+            response, sources, _ = entries.answers[best]
+            return response, list(sources)
+
+    def put(self, context_id, fingerprint: str, query_embedding: List[float], response: str, sources: List[str]):
+        """Cache the answer to a question, failed (zero) embeddings are ignored"""
+        query = self._normalize(query_embedding)
+        if query is None:
+            return
+        with self._lock:
+            entries = self._entries(str(context_id), fingerprint, create=True)
+            entries.expire(time.time(), self.ttl_seconds)
+            if len(entries.answers) >= self.max_entries_per_context:
+                # Oldest first
+                entries.vectors = entries.vectors[1:]
+                entries.answers = entries.answers[1:]
+            vectors = entries.vectors if len(entries.vectors) else np.empty((0, len(query)), dtype=np.float32)
+            entries.vectors = np.vstack([vectors, query[None, :]])
+            entries.answers.append((response, list(sources), time.time()))
+            self.stores += 1
+
+    def invalidate(self, context_id):
+        """Drop every cached answer of a context in this process"""
+        with self._lock:
+            if self._contexts.pop(str(context_id), None) is not None:
+                self.invalidations += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "contexts": len(self._contexts),
+                "entries": sum(len(entries.answers) for entries in self._contexts.values()),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+                "stores": self.stores,
+                "invalidations": self.invalidations,
+            }
+
+
+_cache: Optional[SemanticAnswerCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_answer_cache() -> Optional[SemanticAnswerCache]:
+    """Return the process-wide semantic answer cache, or None unless ANSWER_CACHE_ENABLED is set"""
+    global _cache
+    if not ANSWER_CACHE_ENABLED:
+        return None
+    with _cache_lock:
+        if _cache is None:
+            _cache = SemanticAnswerCache()
+    return _cache
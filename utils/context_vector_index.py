@@ -0,0 +1,336 @@
+"""
+Memory-mapped per-context vector index, used when RETRIEVAL_ENGINE=mmap.
+
+Every context's chunk embeddings are materialized once into a matrix of L2-normalized
+float32 rows on local disk. All API processes on the host memory-map the same file, so
+the pages are shared through the page cache, and top-k is one matrix-vector product.
+
+Files are named after a fingerprint of the context's documents (id, last update, status).
+Uploading, replacing or deleting a document changes the fingerprint, so every process
+picks up a new file on its next query without any messaging between processes. A new
+file reuses the rows of unchanged documents from the previous one and only loads the
+embeddings of new or changed documents from Postgres.
+
+Building, cleaning up and removing a context's files happens under an flock on the
+context directory, so processes never delete files another one is writing or about to map.
+"""
+import os
+import json
+import uuid
+import fcntl
+import shutil
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, List, Optional
+import numpy as np
+from sqlalchemy.orm import Session
+from utils.embedding_provider import EMBEDDING_DIMENSION
+
+
+RETRIEVAL_ENGINE = os.getenv("RETRIEVAL_ENGINE", "postgres")  # postgres or mmap
+MMAP_INDEX_DIR = os.getenv("MMAP_INDEX_DIR", os.path.join(tempfile.gettempdir(), "context-vector-index"))
+# Contexts kept mapped per process, and kept on disk per host
+MMAP_INDEX_MAX_CONTEXTS = int(os.getenv("MMAP_INDEX_MAX_CONTEXTS", 64))
+
+_row_dtype = np.dtype([("chunk_id", "S16"), ("document_id", "S16")])
+# Held while a context's files are built, cleaned up or removed, by any process on the host
+_LOCK_NAME = ".lock"
+
+
+def document_versions(documents) -> Dict[str, str]:
+    """Map document id to a version string that changes whenever its chunks may have"""
+    versions = {}
+    for doc in documents:
+        changed_at = doc.updated_at or doc.created_at
+        versions[str(doc.id)] = f"{changed_at.isoformat() if changed_at else ''}:{doc.upload_status}"
+    return versions
+
+
+def fingerprint(versions: Dict[str, str]) -> str:
+    digest = hashlib.sha256()
+    for document_id in sorted(versions):
+        digest.update(f"{document_id}={versions[document_id]};".encode("utf-8"))
+    return digest.hexdigest()[:32]
+
+
+class ContextMatrix:
+    """One context's mapped matrix and the chunk and document id of each row"""
+
+    def __init__(self, path: str, version: str):
+        self.version = version
+        with open(os.path.join(path, f"{version}.json")) as f:
+            self.documents: Dict[str, str] = json.load(f)
+        self.matrix = np.load(os.path.join(path, f"{version}.matrix.npy"), mmap_mode="r")
+        self.rows = np.load(os.path.join(path, f"{version}.rows.npy"), mmap_mode="r")
+
+    def search(self, query: np.ndarray, limit: int):
+        """Row positions and cosine similarities of the limit best rows, best first"""
+        if not len(self.matrix):
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        scores = self.matrix @ query
+        if limit < len(scores):
+            top = np.argpartition(-scores, limit)[:limit]
+        else:
+            top = np.arange(len(scores))
+        top = top[np.argsort(-scores[top])]
+        return top, scores[top]
+
+
+class ContextVectorIndex:
+    """Builds, maps and searches the per-context matrix files, keeping an LRU of mapped contexts"""
+
+    def __init__(self, directory: str = MMAP_INDEX_DIR, max_contexts: int = MMAP_INDEX_MAX_CONTEXTS):
+        self.directory = directory
+        self.max_contexts = max_contexts
+        self._mapped: "OrderedDict[str, ContextMatrix]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        os.makedirs(directory, exist_ok=True)
+
+    def _context_path(self, context_id) -> str:
+        return os.path.join(self.directory, str(context_id))
+
+    def search(self, db: Session, context_id, documents, query: List[float], limit: int, with_vectors: bool = False):
+        """
+        Return the limit chunks of the context most similar to query.
+
+        Args:
+            documents: The context's documents, with id, created_at, updated_at and upload_status
+            query: Query embedding
+            with_vectors: Also return each chunk's normalized embedding
+
+        Returns:
+            List of (chunk id, cosine similarity) pairs, or (chunk id, cosine similarity, embedding)
+            triples with with_vectors, best first
+        """
+        query_vector = np.asarray(query, dtype=np.float32)
+        norm = np.linalg.norm(query_vector)
+        if not norm:
+            return []
+
+        matrix = self._get(db, str(context_id), document_versions(documents))
+        positions, scores = matrix.search(query_vector / norm, limit)
+        chunk_ids = matrix.rows["chunk_id"][positions]
+        if with_vectors:
+            # Copied out of the mapping, which may be replaced while the caller holds them
+            vectors = np.array(matrix.matrix[positions])
+            return [(_uuid(chunk_id), float(score), vector) for chunk_id, score, vector in zip(chunk_ids, scores, vectors)]
+        return [(_uuid(chunk_id), float(score)) for chunk_id, score in zip(chunk_ids, scores)]
+
+    def _get(self, db: Session, context_id: str, versions: Dict[str, str]) -> ContextMatrix:
+        version = fingerprint(versions)
+        with self._lock:
+            matrix = self._mapped.get(context_id)
+            if matrix is not None and matrix.version == version:
+                self._mapped.move_to_end(context_id)
+                return matrix
+            build_lock = self._build_locks.setdefault(context_id, threading.Lock())
+
+        path = self._context_path(context_id)
+        with build_lock, _locked(path):
+            try:
+                loaded = ContextMatrix(path, version)
+            except (OSError, ValueError):
+                # Not built yet, or left incomplete by a process that died while writing it
+                self._build(db, path, version, versions, previous=matrix or self._load_latest(path))
+                loaded = ContextMatrix(path, version)
+            # Marks the context as recently used for pruning on disk
+            os.utime(path)
+        matrix = loaded
+
+        with self._lock:
+            self._mapped[context_id] = matrix
+            self._mapped.move_to_end(context_id)
+            while len(self._mapped) > self.max_contexts:
+                self._mapped.popitem(last=False)
+        return matrix
+
+    def _load_latest(self, path: str) -> Optional[ContextMatrix]:
+        """The most recent complete file of a context, written by any process, called with the context locked"""
+        try:
+            manifests = [name for name in os.listdir(path) if name.endswith(".json")]
+        except FileNotFoundError:
+            return None
+        if not manifests:
+            return None
+        latest = max(manifests, key=lambda name: os.path.getmtime(os.path.join(path, name)))
+        try:
+            return ContextMatrix(path, latest[:-len(".json")])
+        except (OSError, ValueError):
+            return None
+
+    def _build(self, db: Session, path: str, version: str, versions: Dict[str, str], previous: Optional[ContextMatrix]):
+        from repository.document_chunk_repository import DocumentChunkRepository
+
+        reused_documents = set()
+        parts, row_parts = [], []
+        if previous is not None:
+            reused_documents = {doc_id for doc_id, doc_version in versions.items() if previous.documents.get(doc_id) == doc_version}
+            if reused_documents and len(previous.rows):
+                keep = np.isin(previous.rows["document_id"], [_uuid_bytes(doc_id) for doc_id in reused_documents])
+                parts.append(np.asarray(previous.matrix[keep]))
+                row_parts.append(np.asarray(previous.rows[keep]))
+
+        changed_documents = [doc_id for doc_id in versions if doc_id not in reused_documents]
+        if changed_documents:
+            embeddings, rows = [], []
+            for chunk_id, document_id, embedding in DocumentChunkRepository.get_embeddings_by_document_ids(db, changed_documents):
+                if embedding is None:
+                    continue
+                vector = np.asarray(embedding, dtype=np.float32)
+                norm = np.linalg.norm(vector)
+                # Chunks without text have a zero embedding and can never match
+                if not norm:
+                    continue
+                embeddings.append(vector / norm)
+                rows.append((_uuid_bytes(chunk_id), _uuid_bytes(document_id)))
+            if embeddings:
+                parts.append(np.vstack(embeddings).astype(np.float32))
+                row_parts.append(np.array(rows, dtype=_row_dtype))
+
+        # Files of contexts without chunks written before had (0, 0) matrices, empty parts are left out
+        parts = [part for part in parts if len(part)]
+        row_parts = [part for part in row_parts if len(part)]
+        matrix = np.vstack(parts) if parts else np.empty((0, EMBEDDING_DIMENSION), dtype=np.float32)
+        rows = np.concatenate(row_parts) if row_parts else np.empty(0, dtype=_row_dtype)
+
+        os.makedirs(path, exist_ok=True)
+        # Data files first and the manifest last, each moved into place atomically,
+        # so a manifest is only visible once its data is complete
+        _atomic_write(path, f"{version}.matrix.npy", lambda f: np.save(f, matrix))
+        _atomic_write(path, f"{version}.rows.npy", lambda f: np.save(f, rows))
+        _atomic_write(path, f"{version}.json", lambda f: f.write(json.dumps(versions).encode("utf-8")))
+
+        # Versions written before this one are no longer needed, processes still mapping them keep
+        # their pages. Nobody else writes here while the context is locked, so older leftovers of a
+        # process that died while writing go as well.
+        written_at = os.path.getmtime(os.path.join(path, f"{version}.json"))
+        for name in os.listdir(path):
+            if name == _LOCK_NAME or name.startswith(version):
+                continue
+            try:
+                if os.path.getmtime(os.path.join(path, name)) <= written_at:
+                    _remove(os.path.join(path, name))
+            except FileNotFoundError:
+                pass
+        self._prune()
+
+    def _prune(self):
+        """
+        Delete the least recently used contexts from disk beyond max_contexts, skipping
+        those another thread or process holds locked
+        """
+        contexts = []
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            try:
+                if os.path.isdir(path):
+                    contexts.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                pass
+        if len(contexts) <= self.max_contexts:
+            return
+        contexts.sort()
+        for _, path in contexts[:len(contexts) - self.max_contexts]:
+            with _locked(path, blocking=False) as acquired:
+                if acquired:
+                    shutil.rmtree(path, ignore_errors=True)
+
+    def invalidate(self, context_id):
+        """Unmap a context in this process, other processes notice the changed fingerprint themselves"""
+        with self._lock:
+            self._mapped.pop(str(context_id), None)
+
+    def drop(self, context_id):
+        """Unmap a deleted context and remove its files"""
+        self.invalidate(context_id)
+        path = self._context_path(context_id)
+        if os.path.isdir(path):
+            with _locked(path):
+                shutil.rmtree(path, ignore_errors=True)
+
+
+@contextmanager
+def _locked(path: str, blocking: bool = True):
+    """
+    Hold the exclusive lock of a context directory, creating the directory when blocking.
+    Yields whether the lock was acquired, which is always the case when blocking.
+    """
+    lock_path = os.path.join(path, _LOCK_NAME)
+    while True:
+        if blocking:
+            os.makedirs(path, exist_ok=True)
+        try:
+            fd = os.open(lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        except FileNotFoundError:
+            # Removed meanwhile
+            if not blocking:
+                yield False
+                return
+            continue
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            yield False
+            return
+        # The directory may have been removed, and maybe created again, while waiting for the lock
+        try:
+            current = os.stat(lock_path).st_ino == os.fstat(fd).st_ino
+        except FileNotFoundError:
+            current = False
+        if current:
+            break
+        os.close(fd)
+        if not blocking:
+            yield False
+            return
+    try:
+        yield True
+    finally:
+        os.close(fd)
+
+
+def _uuid_bytes(value) -> bytes:
+    return (value if isinstance(value, uuid.UUID) else uuid.UUID(str(value))).bytes
+
+
+def _uuid(value: bytes) -> uuid.UUID:
+    # numpy strips trailing zero bytes from fixed-size byte strings
+    return uuid.UUID(bytes=bytes(value).ljust(16, b"\0"))
+
+
+def _atomic_write(path: str, name: str, write):
+    fd, tmp = tempfile.mkstemp(dir=path, prefix=".tmp-")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            write(f)
+        os.replace(tmp, os.path.join(path, name))
+    except BaseException:
+        _remove(tmp)
+        raise
+
+
+def _remove(path: str):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+_index: Optional[ContextVectorIndex] = None
+_index_lock = threading.Lock()
+
+
+def get_context_vector_index() -> Optional[ContextVectorIndex]:
+    """Return the process-wide context vector index, or None unless RETRIEVAL_ENGINE is mmap"""
+    global _index
+    if RETRIEVAL_ENGINE != "mmap":
+        return None
+    with _index_lock:
+        if _index is None:
+            _index = ContextVectorIndex()
+    return _index
@@ -1,15 +1,36 @@
 import os
 from sqlalchemy import create_engine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker
 from models.user_model import Base
 
 
 DATABASE_URL = os.getenv("DATABASE_URL")
+# The async chat path talks to the same database through asyncpg
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or (
+    DATABASE_URL.replace("postgresql+psycopg2://", "postgresql://", 1).replace("postgresql://", "postgresql+asyncpg://", 1)
+    if DATABASE_URL else None
+)
+# Async sessions only hold a connection while they query, so a pool this size serves
+# far more concurrent chats than it has connections
+ASYNC_DB_POOL_SIZE = int(os.getenv("ASYNC_DB_POOL_SIZE", 20))
+ASYNC_DB_MAX_OVERFLOW = int(os.getenv("ASYNC_DB_MAX_OVERFLOW", 20))
 
 engine = create_engine(DATABASE_URL, echo=True)
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    echo=True,
+    pool_size=ASYNC_DB_POOL_SIZE,
+    max_overflow=ASYNC_DB_MAX_OVERFLOW,
+)
+# pgvector's SQLAlchemy types bind vectors as text, which asyncpg sends as is for extension
+# types, so no asyncpg codec registration is needed (it would expect binary values)
+AsyncSessionLocal = async_sessionmaker(bind=async_engine, autoflush=False, expire_on_commit=False)
+
+
 Base = declarative_base()
 
 def get_db():
@@ -19,5 +40,9 @@ def get_db():
     finally:
         db.close()
 
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
+
 def create_tables():
-    Base.metadata.create_all(bind=engine)
\ No newline at end of file
+    Base.metadata.create_all(bind=engine)
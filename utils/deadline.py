@@ -0,0 +1,112 @@
+import os
+import time
+import asyncio
+from typing import Awaitable, List, Optional, TypeVar
+
+T = TypeVar("T")
+
+
+# Latency budget of a chat in milliseconds when the request sets none, 0 for no budget
+CHAT_LATENCY_BUDGET_MS = int(os.getenv("CHAT_LATENCY_BUDGET_MS", 0))
+LATENCY_BUDGET_HEADER = "X-Latency-Budget-Ms"
+# Time kept for the completion, optional stages only use the budget beyond it
+CHAT_COMPLETION_RESERVE_MS = int(os.getenv("CHAT_COMPLETION_RESERVE_MS", 1500))
+# Expected time to the first completion token and generation rate, to fit max_tokens in the time left
+CHAT_FIRST_TOKEN_MS = int(os.getenv("CHAT_FIRST_TOKEN_MS", 800))
+CHAT_COMPLETION_TOKENS_PER_SECOND = float(os.getenv("CHAT_COMPLETION_TOKENS_PER_SECOND", 50))
+CHAT_MIN_COMPLETION_TOKENS = int(os.getenv("CHAT_MIN_COMPLETION_TOKENS", 64))
+# Share of the budget each stage may take at most
+STAGE_BUDGET_SHARES = {
+    "embedding": float(os.getenv("CHAT_EMBEDDING_BUDGET_SHARE", 0.25)),
+    "retrieval": float(os.getenv("CHAT_RETRIEVAL_BUDGET_SHARE", 0.25)),
+    "compaction": float(os.getenv("CHAT_COMPACTION_BUDGET_SHARE", 0.3)),
+    "mmr": float(os.getenv("CHAT_MMR_BUDGET_SHARE", 0.05)),
+}
+
+
+class DeadlineExceeded(Exception):
+    """A stage the answer cannot do without ran out of time"""
+
+    def __init__(self, stage: str):
+        super().__init__(f"Latency budget exceeded during {stage}")
+        self.stage = stage
+
+
+class Deadline:
+    """
+    Latency budget of one request, shared by its stages.
+
+    Required stages get their share of the budget, or what is left of it, and raise
+    DeadlineExceeded when they run over. Optional stages also leave CHAT_COMPLETION_RESERVE_MS
+    for the completion; they are skipped when that leaves them nothing and abandoned when
+    they run over, and either way recorded in degradations. Without a budget nothing times out.
+    """
+
+    def __init__(self, budget_ms: Optional[float] = None):
+        self.budget = budget_ms / 1000 if budget_ms else None
+        self.started = time.monotonic()
+        self.degradations: List[str] = []
+
+    @classmethod
+    def from_header(cls, value: Optional[str]) -> "Deadline":
+        """Deadline from the latency budget header, or CHAT_LATENCY_BUDGET_MS when it is missing or invalid"""
+        try:
+            budget = float(value) if value else CHAT_LATENCY_BUDGET_MS
+        except ValueError:
+            budget = CHAT_LATENCY_BUDGET_MS
+        return cls(budget if budget > 0 else None)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, None without a budget"""
+        if self.budget is None:
+            return None
+        return self.budget - (time.monotonic() - self.started)
+
+    def expired(self) -> bool:
+        return self.budget is not None and self.remaining() <= 0
+
+    def degrade(self, name: str):
+        if name not in self.degradations:
+            self.degradations.append(name)
+
+    def timeout(self, stage: str, optional: bool = False) -> Optional[float]:
+        """Seconds stage may take, None without a budget"""
+        remaining = self.remaining()
+        if remaining is None:
+            return None
+        if optional:
+            remaining -= CHAT_COMPLETION_RESERVE_MS / 1000
+        return max(0.0, min(self.budget * STAGE_BUDGET_SHARES.get(stage, 1.0), remaining))
+
+    def allows(self, stage: str) -> bool:
+        """Whether there is time for optional stage, recording it as skipped when there is not"""
+        timeout = self.timeout(stage, optional=True)
+        if timeout is None or timeout >= self.budget * STAGE_BUDGET_SHARES.get(stage, 1.0):
+            return True
+        self.degrade(stage)
+        return False
+
+    async def required(self, stage: str, awaitable: Awaitable[T]) -> T:
+        try:
+            return await asyncio.wait_for(awaitable, self.timeout(stage))
+        except asyncio.TimeoutError:
+            raise DeadlineExceeded(stage)
+
+    async def optional(self, stage: str, awaitable: Awaitable[T], fallback: T) -> T:
+        """awaitable's result, or fallback when it does not finish in time"""
+        try:
+            return await asyncio.wait_for(awaitable, self.timeout(stage, optional=True))
+        except asyncio.TimeoutError:
+            self.degrade(stage)
+            return fallback
+
+    def max_tokens(self, default: int) -> int:
+        """Completion tokens that can be generated in the time left, at most default"""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        fitting = int((remaining - CHAT_FIRST_TOKEN_MS / 1000) * CHAT_COMPLETION_TOKENS_PER_SECOND)
+        if fitting >= default:
+            return default
+        self.degrade("max_tokens")
+        return max(CHAT_MIN_COMPLETION_TOKENS, fitting)
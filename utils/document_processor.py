@@ -1,5 +1,6 @@
 import os
 import json
+import hashlib
 import PyPDF2
 from io import BytesIO, StringIO
 import openai
@@ -7,15 +8,17 @@ from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_openai import OpenAIEmbeddings, ChatOpenAI
 from langchain_chroma import Chroma
 from fastapi import UploadFile
-import fitz 
 import pandas as pd
 import filetype
+from typing import List, Optional
+from utils.embedding_cache import get_embedding_cache, cache_key
+from utils.embedding_provider import get_embedding_provider
+from utils.pdf_extraction import iter_pdf_pages
 
 
 openai.api_key = os.getenv("OPENAI_API_KEY")
 CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", 1000))
 CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", 200))
-EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
 embeddings = OpenAIEmbeddings()
 client = openai.OpenAI()
 
@@ -31,25 +34,33 @@ class DocumentProcessor:
             mime_type: file type
             
         Returns:
-            str: Extracted text from the file.
+            dict: Extracted text from the file, {page_num: text}
         """
-        
-        text = {}
+        return dict(DocumentProcessor.iter_pages(contents, mime_type))
+
+    @staticmethod
+    def iter_pages(contents:bytes, mime_type: str):
+        """
+        Lazily reads text from a file one page at a time, detecting type via MIME type.
 
+        Args:
+            contents (bytes): The uploaded file content.
+            mime_type: file type
+            
+        Yields:
+            tuple: (page_num, text) for every page
+        """
         if mime_type == "application/pdf":
-            with fitz.open(stream=BytesIO(contents), filetype="pdf") as pdf:
-                for i, page in enumerate(pdf):
-                    text[i+1] = page.get_text("text") + "\n"  # Extract text from each page
+            yield from iter_pdf_pages(contents)
         elif mime_type in ["text/markdown", "text/plain", "text/url-scrape"]:
-            text[1] = contents.decode('utf-8')  # Read markdown or plain text
+            yield 1, contents.decode('utf-8')  # Read markdown or plain text
 
         else:
             try:
-                text[1] = contents.decode('utf-8')
+                text = contents.decode('utf-8')
             except Exception:
                 raise ValueError(f"Unsupported MIME type: {mime_type}")
-        
-        return text
+            yield 1, text
 
     @staticmethod
     def extract_text_from_pdf(file_data):
@@ -85,7 +96,20 @@ class DocumentProcessor:
             pages_dict: Dictionary mapping page numbers to page content {page_num: text}
         
         Returns:
-            List of tuples: [(chunk_text, page_num), ...]
+            List of tuples: [(page_num, chunk_text), ...]
+        """
+        return list(DocumentProcessor.iter_chunks_with_page_tracking(pages_dict.items()))
+
+    @staticmethod
+    def iter_chunks_with_page_tracking(pages):
+        """
+        Lazily split pages into chunks while tracking the source page
+        
+        Args:
+            pages: Iterable of (page_num, text) tuples, e.g. from iter_pages
+        
+        Yields:
+            tuple: (page_num, chunk_text) for every chunk
         """
         text_splitter = RecursiveCharacterTextSplitter(
             chunk_size=CHUNK_SIZE,
@@ -93,25 +117,119 @@ class DocumentProcessor:
             length_function=len,
         )
         
-        chunks_with_source = []
-        
-        for page_num, page_text in pages_dict.items():
-            page_chunks = text_splitter.split_text(page_text)
-            
+        for page_num, page_text in pages:
             # Associate each chunk with its source page
-            for chunk in page_chunks:
-                chunks_with_source.append((page_num, chunk))
-        
-        return chunks_with_source
+            for chunk in text_splitter.split_text(page_text):
+                yield page_num, chunk
+
+    @staticmethod
+    def content_hash(text: str) -> str:
+        """Hash identifying a chunk's exact content within a document"""
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
 
     @staticmethod
     def get_embedding(text):
         """Get embedding for text using OpenAI API"""
-        response = client.embeddings.create(
-            input=text,
-            model=EMBEDDING_MODEL
+        return DocumentProcessor.get_embeddings([text])[0]
+
+    @staticmethod
+    def pack_embedding_batches(token_counts: List[int], max_inputs: int, max_tokens: Optional[int] = None) -> List[List[int]]:
+        """
+        Group inputs into embedding requests that respect the per-request limits
+
+        Args:
+            token_counts: Token count of every input, in input order
+            max_inputs: Maximum number of inputs per request
+            max_tokens: Maximum total tokens per request, None for no limit
+
+        Returns:
+            List of batches, each a list of input indices
+        """
+        batches = []
+        current = []
+        current_tokens = 0
+
+        for i, tokens in enumerate(token_counts):
+            if current and (
+                len(current) >= max_inputs
+                or (max_tokens is not None and current_tokens + tokens > max_tokens)
+            ):
+                batches.append(current)
+                current = []
+                current_tokens = 0
+            current.append(i)
+            current_tokens += tokens
+
+        if current:
+            batches.append(current)
+        return batches
+
+    @staticmethod
+    def get_embeddings(texts: List[str]) -> List[List[float]]:
+        """
+        Get embeddings for many texts from the configured embedding provider, using as few
+        requests as its limits allow. Texts already in the embedding cache, or repeated
+        within texts, are not sent again.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            List of embedding vectors, in the same order as texts
+        """
+        provider = get_embedding_provider()
+        embeddings = [None] * len(texts)
+        positions = {}  # cache key -> indices in texts sharing that content
+        pending = []  # (cache key, text to send, token count) per unique content
+
+        for i, text in enumerate(texts):
+            if not text or text.strip() == "":
+                embeddings[i] = provider.zero_vector()  # The API rejects empty input
+                continue
+            key = cache_key(provider.model, text)
+            if key in positions:
+                positions[key].append(i)
+                continue
+            positions[key] = [i]
+            tokens = provider.count_tokens(text)
+            if tokens > provider.max_input_tokens:
+                text = provider.truncate(text)
+                tokens = provider.max_input_tokens
+            pending.append((key, text, tokens))
+
+        cache = get_embedding_cache()
+        if cache is not None:
+            cached = cache.get_many([key for key, _, _ in pending])
+            for key, vector in cached.items():
+                for i in positions[key]:
+                    embeddings[i] = vector
+            pending = [item for item in pending if item[0] not in cached]
+
+        batches = DocumentProcessor.pack_embedding_batches(
+            [tokens for _, _, tokens in pending], provider.max_batch_inputs, provider.max_batch_tokens
         )
-        return response.data[0].embedding
+        if not batches:
+            return embeddings
+
+        # With the OpenAI provider, batches from every ingestion job share the scheduler's rate-limit budget
+        results = provider.embed_batches([
+            ([pending[j][1] for j in batch], sum(pending[j][2] for j in batch))
+            for batch in batches
+        ])
+
+        computed = {}
+        for batch, vectors in zip(batches, results):
+            for j, vector in zip(batch, vectors):
+                computed[pending[j][0]] = vector
+
+        for key, vector in computed.items():
+            for i in positions[key]:
+                embeddings[i] = vector
+
+        if cache is not None:
+            cache.put_many(provider.model, computed)
+
+        return embeddings
 
     @staticmethod
     def get_vectorspace(textChunks):
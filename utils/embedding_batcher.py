@@ -0,0 +1,145 @@
+import os
+import asyncio
+import threading
+import weakref
+from typing import Dict, List, Optional
+from utils.embedding_provider import EmbeddingProvider, get_embedding_provider
+
+
+# How long the first query of a batch waits for others to join it, 0 sends every query on its own
+EMBEDDING_BATCH_WINDOW_MS = float(os.getenv("EMBEDDING_BATCH_WINDOW_MS", 5))
+# A batch is sent as soon as it holds this many distinct texts
+EMBEDDING_BATCH_MAX_SIZE = int(os.getenv("EMBEDDING_BATCH_MAX_SIZE", 64))
+
+
+class _Batch:
+    def __init__(self):
+        self.slots: Dict[str, asyncio.Future] = {}  # truncated text -> its vector
+        self.tokens = 0
+        self.timer: Optional[asyncio.TimerHandle] = None
+
+
+class EmbeddingBatcher:
+    """
+    Collects the query embeddings requested by concurrent chats and sends them as one
+    multi-input embeddings request.
+
+    The first text of a batch opens a window of EMBEDDING_BATCH_WINDOW_MS; the batch is sent
+    when the window closes or when it is full, i.e. holds EMBEDDING_BATCH_MAX_SIZE texts or as
+    many inputs or tokens as one request of the provider takes. A text that is already waiting,
+    in the open batch or in a request on its way, is not sent again. Each event loop has its
+    own batches.
+    """
+
+    def __init__(
+        self,
+        provider: Optional[EmbeddingProvider] = None,
+        window_ms: float = EMBEDDING_BATCH_WINDOW_MS,
+        max_size: int = EMBEDDING_BATCH_MAX_SIZE,
+    ):
+        self.provider = provider or get_embedding_provider()
+        self.window = window_ms / 1000
+        self.max_size = max(1, min(max_size, self.provider.max_batch_inputs))
+        self._batches: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, _Batch]" = weakref.WeakKeyDictionary()
+        # Every text not answered yet, in the open batch or in a request already sent
+        self._waiting: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, asyncio.Future]]" = weakref.WeakKeyDictionary()
+        self._sending = set()
+        self._lock = threading.Lock()
+        self.texts = 0
+        self.coalesced = 0
+        self.requests = 0
+        self.failures = 0
+
+    async def embed(self, text: str) -> List[float]:
+        """
+        Embedding of text, sent together with the texts other requests ask for meanwhile.
+        Exceptions from the embeddings request propagate to every text of the batch.
+        """
+        text = self.provider.truncate(text)
+        loop = asyncio.get_running_loop()
+
+        waiting = self._waiting.get(loop)
+        if waiting is None:
+            waiting = self._waiting[loop] = {}
+        future = waiting.get(text)
+        if future is not None:
+            with self._lock:
+                self.coalesced += 1
+            # Shielded, so a caller going away does not fail the others waiting for the text
+            return await asyncio.shield(future)
+
+        batch = self._batches.get(loop)
+        tokens = self.provider.count_tokens(text)
+        max_tokens = self.provider.max_batch_tokens
+        if batch is not None and max_tokens is not None and batch.tokens + tokens > max_tokens:
+            self._flush(loop)
+            batch = None
+        if batch is None:
+            batch = self._batches[loop] = _Batch()
+            if self.window > 0:
+                batch.timer = loop.call_later(self.window, self._flush, loop)
+
+        future = batch.slots[text] = waiting[text] = loop.create_future()
+        future.add_done_callback(lambda _: waiting.pop(text, None))
+        batch.tokens += tokens
+        with self._lock:
+            self.texts += 1
+        if len(batch.slots) >= self.max_size or self.window <= 0:
+            self._flush(loop)
+        return await asyncio.shield(future)
+
+    def _flush(self, loop: asyncio.AbstractEventLoop):
+        batch = self._batches.pop(loop, None)
+        if batch is None:
+            return
+        if batch.timer is not None:
+            batch.timer.cancel()
+        task = loop.create_task(self._send(batch))
+        # The loop only keeps weak references to tasks
+        self._sending.add(task)
+        task.add_done_callback(self._sending.discard)
+
+    async def _send(self, batch: _Batch):
+        texts = list(batch.slots)
+        try:
+            vectors = (await self.provider.aembed_batches([(texts, batch.tokens)]))[0]
+        except Exception as e:
+            with self._lock:
+                self.requests += 1
+                self.failures += 1
+            for future in batch.slots.values():
+                if not future.done():
+                    future.set_exception(e)
+                    # Every caller may have gone away, mark the exception as retrieved
+                    future.exception()
+            return
+
+        with self._lock:
+            self.requests += 1
+        for text, vector in zip(texts, vectors):
+            future = batch.slots[text]
+            if not future.done():
+                future.set_result(vector)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "texts": self.texts,
+                "coalesced": self.coalesced,
+                "requests": self.requests,
+                "failures": self.failures,
+                "average_batch_size": self.texts / self.requests if self.requests else 0.0,
+            }
+
+
+_batcher: Optional[EmbeddingBatcher] = None
+_batcher_lock = threading.Lock()
+
+
+def get_embedding_batcher() -> EmbeddingBatcher:
+    """Return the process-wide query embedding batcher"""
+    global _batcher
+    with _batcher_lock:
+        if _batcher is None:
+            _batcher = EmbeddingBatcher()
+    return _batcher
@@ -0,0 +1,251 @@
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional
+from sqlalchemy import select, update, delete, func
+from sqlalchemy.dialects.postgresql import insert
+
+
+EMBEDDING_CACHE_BACKEND = os.getenv("EMBEDDING_CACHE_BACKEND", "none")  # none, postgres or disk
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", "embedding_cache.sqlite3")
+EMBEDDING_CACHE_MAX_ENTRIES = int(os.getenv("EMBEDDING_CACHE_MAX_ENTRIES", 500000))
+EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+# Eviction scans the whole table, so it runs after this many written entries or seconds, not on every write
+EMBEDDING_CACHE_EVICT_EVERY_WRITES = int(os.getenv("EMBEDDING_CACHE_EVICT_EVERY_WRITES", 50000))
+EMBEDDING_CACHE_EVICT_INTERVAL_SECONDS = int(os.getenv("EMBEDDING_CACHE_EVICT_INTERVAL_SECONDS", 600))
+# A hit only refreshes last_used_at when the stored one is older than this
+EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS = int(os.getenv("EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS", 24 * 3600))
+
+logger = logging.getLogger(__name__)
+
+_whitespace = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Normalize text so that formatting-only differences share one cache entry"""
+    return _whitespace.sub(" ", unicodedata.normalize("NFC", text)).strip()
+
+
+def cache_key(model: str, text: str) -> str:
+    """Content address of a text embedded with a given model"""
+    return hashlib.sha256(f"{model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    """Base class for persistent embedding caches keyed by cache_key"""
+
+    def __init__(
+        self,
+        max_entries: int = EMBEDDING_CACHE_MAX_ENTRIES,
+        ttl_seconds: int = EMBEDDING_CACHE_TTL_SECONDS,
+        evict_every_writes: int = EMBEDDING_CACHE_EVICT_EVERY_WRITES,
+        evict_interval_seconds: int = EMBEDDING_CACHE_EVICT_INTERVAL_SECONDS,
+        touch_interval_seconds: int = EMBEDDING_CACHE_TOUCH_INTERVAL_SECONDS,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.evict_every_writes = evict_every_writes
+        self.evict_interval_seconds = evict_interval_seconds
+        self.touch_interval_seconds = touch_interval_seconds
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+        self._writes_since_eviction = 0
+        self._evicted_at = time.monotonic()
+
+    def get_many(self, keys: List[str], count: bool = True) -> Dict[str, List[float]]:
+        """
+        Look up keys, refresh the last use of those not refreshed lately and return the ones found.
+        count=False leaves the hit and miss counters alone, for lookups that keep their own stats.
+        """
+        try:
+            found = self._get_many(keys) if keys else {}
+        except Exception as e:
+            # A broken cache must never fail ingestion, treat it as a miss
+            logger.warning(f"Embedding cache lookup failed: {e}")
+            found = {}
+        if not count:
+            return found
+        with self._stats_lock:
+            self.hits += len(found)
+            self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, model: str, entries: Dict[str, List[float]]):
+        """Store embeddings, evicting entries beyond the size and age limits when eviction is due"""
+        if not entries:
+            return
+        try:
+            self._put_many(model, entries)
+            if self._eviction_due(len(entries)):
+                self._evict()
+        except Exception as e:
+            logger.warning(f"Embedding cache write failed: {e}")
+
+    def _eviction_due(self, written: int) -> bool:
+        with self._stats_lock:
+            self._writes_since_eviction += written
+            if (
+                self._writes_since_eviction < self.evict_every_writes
+                and time.monotonic() - self._evicted_at < self.evict_interval_seconds
+            ):
+                return False
+            self._writes_since_eviction = 0
+            self._evicted_at = time.monotonic()
+            return True
+
+    def stats(self) -> dict:
+        with self._stats_lock:
+            lookups = self.hits + self.misses
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+
+    def _get_many(self, keys: List[str]) -> Dict[str, List[float]]:
+        raise NotImplementedError
+
+    def _put_many(self, model: str, entries: Dict[str, List[float]]):
+        raise NotImplementedError
+
+    def _evict(self):
+        raise NotImplementedError
+
+
+class PostgresEmbeddingCache(EmbeddingCache):
+    """Embedding cache stored in the embedding_cache table, shared by every worker and replica"""
+
+    def __init__(self, session_factory, **kwargs):
+        super().__init__(**kwargs)
+        self.session_factory = session_factory
+
+    def _get_many(self, keys):
+        from models.embedding_cache_model import EmbeddingCacheEntry
+
+        with self.session_factory() as db:
+            rows = db.execute(
+                select(EmbeddingCacheEntry.key, EmbeddingCacheEntry.embedding, EmbeddingCacheEntry.last_used_at)
+                .where(EmbeddingCacheEntry.key.in_(keys))
+            ).all()
+            touched_before = datetime.now(timezone.utc) - timedelta(seconds=self.touch_interval_seconds)
+            stale = [row.key for row in rows if row.last_used_at is None or row.last_used_at < touched_before]
+            if stale:
+                db.execute(
+                    update(EmbeddingCacheEntry)
+                    .where(EmbeddingCacheEntry.key.in_(stale))
+                    .values(last_used_at=func.now())
+                )
+                db.commit()
+        return {row.key: list(row.embedding) for row in rows}
+
+    def _put_many(self, model, entries):
+        from models.embedding_cache_model import EmbeddingCacheEntry
+
+        with self.session_factory() as db:
+            db.execute(
+                insert(EmbeddingCacheEntry)
+                .values([{"key": key, "model": model, "embedding": embedding} for key, embedding in entries.items()])
+                .on_conflict_do_nothing(index_elements=["key"])
+            )
+            db.commit()
+
+    def _evict(self):
+        from models.embedding_cache_model import EmbeddingCacheEntry
+
+        expired_before = datetime.now(timezone.utc) - timedelta(seconds=self.ttl_seconds)
+        overflow = (
+            select(EmbeddingCacheEntry.key)
+            .order_by(EmbeddingCacheEntry.last_used_at.desc())
+            .offset(self.max_entries)
+        )
+        with self.session_factory() as db:
+            db.execute(delete(EmbeddingCacheEntry).where(EmbeddingCacheEntry.last_used_at < expired_before))
+            db.execute(delete(EmbeddingCacheEntry).where(EmbeddingCacheEntry.key.in_(overflow)))
+            db.commit()
+
+
+class DiskEmbeddingCache(EmbeddingCache):
+    """Embedding cache stored in a local SQLite file, private to one host"""
+
+    def __init__(self, path: str = EMBEDDING_CACHE_PATH, **kwargs):
+        super().__init__(**kwargs)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embedding_cache ("
+            "key TEXT PRIMARY KEY, model TEXT NOT NULL, embedding BLOB NOT NULL, "
+            "created_at REAL NOT NULL, last_used_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS ix_embedding_cache_last_used_at ON embedding_cache (last_used_at)")
+        self._conn.commit()
+
+    def _get_many(self, keys):
+        found = {}
+        stale = []
+        now = time.time()
+        with self._lock:
+            # Stay below SQLite's bound parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start:start + 500]
+                placeholders = ",".join("?" * len(batch))
+                rows = self._conn.execute(
+                    f"SELECT key, embedding, last_used_at FROM embedding_cache WHERE key IN ({placeholders})", batch
+                ).fetchall()
+                for key, blob, last_used_at in rows:
+                    found[key] = array("f", blob).tolist()
+                    if last_used_at < now - self.touch_interval_seconds:
+                        stale.append(key)
+            if stale:
+                self._conn.executemany(
+                    "UPDATE embedding_cache SET last_used_at = ? WHERE key = ?", [(now, key) for key in stale]
+                )
+                self._conn.commit()
+        return found
+
+    def _put_many(self, model, entries):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO embedding_cache (key, model, embedding, created_at, last_used_at) VALUES (?, ?, ?, ?, ?)",
+                [(key, model, array("f", embedding).tobytes(), now, now) for key, embedding in entries.items()],
+            )
+            self._conn.commit()
+
+    def _evict(self):
+        with self._lock:
+            self._conn.execute("DELETE FROM embedding_cache WHERE last_used_at < ?", (time.time() - self.ttl_seconds,))
+            self._conn.execute(
+                "DELETE FROM embedding_cache WHERE key IN "
+                "(SELECT key FROM embedding_cache ORDER BY last_used_at DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            self._conn.commit()
+
+
+_cache: Optional[EmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_embedding_cache() -> Optional[EmbeddingCache]:
+    """Return the process-wide embedding cache selected by EMBEDDING_CACHE_BACKEND, or None when disabled"""
+    global _cache
+    if EMBEDDING_CACHE_BACKEND not in ("postgres", "disk"):
+        return None
+
+    with _cache_lock:
+        if _cache is None:
+            if EMBEDDING_CACHE_BACKEND == "postgres":
+                from utils.database import SessionLocal
+                _cache = PostgresEmbeddingCache(SessionLocal)
+            else:
+                _cache = DiskEmbeddingCache()
+            logger.info(f"Embedding cache enabled with {EMBEDDING_CACHE_BACKEND} backend")
+    return _cache
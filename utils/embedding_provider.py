@@ -0,0 +1,196 @@
+import os
+import re
+import asyncio
+import hashlib
+import threading
+from typing import List, Optional, Tuple
+import numpy as np
+from utils.tokenizer import count_tokens, truncate_to_tokens
+
+
+EMBEDDING_PROVIDER = os.getenv("EMBEDDING_PROVIDER", "openai")  # openai, local or hashing
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", 1536))
+# Per-request limits of the OpenAI embeddings endpoint
+EMBEDDING_MAX_BATCH_INPUTS = int(os.getenv("EMBEDDING_MAX_BATCH_INPUTS", 2048))
+EMBEDDING_MAX_BATCH_TOKENS = int(os.getenv("EMBEDDING_MAX_BATCH_TOKENS", 300000))
+EMBEDDING_MAX_INPUT_TOKENS = int(os.getenv("EMBEDDING_MAX_INPUT_TOKENS", 8191))
+# Directory holding model.onnx and tokenizer.json for the local provider
+LOCAL_EMBEDDING_MODEL_PATH = os.getenv("LOCAL_EMBEDDING_MODEL_PATH")
+LOCAL_EMBEDDING_BATCH_SIZE = int(os.getenv("LOCAL_EMBEDDING_BATCH_SIZE", 32))
+LOCAL_EMBEDDING_MAX_TOKENS = int(os.getenv("LOCAL_EMBEDDING_MAX_TOKENS", 512))
+LOCAL_EMBEDDING_THREADS = int(os.getenv("LOCAL_EMBEDDING_THREADS", 0))  # 0 lets onnxruntime decide
+
+Batch = Tuple[List[str], int]
+
+
+class EmbeddingProvider:
+    """
+    Turns texts into vectors of EMBEDDING_DIMENSION floats.
+
+    Callers pack inputs into batches within max_batch_inputs and max_batch_tokens,
+    measured with count_tokens, and hand them to embed_batches, which returns one
+    list of vectors per batch in input order.
+    """
+    model: str
+    dimension: int = EMBEDDING_DIMENSION
+    max_batch_inputs: int = EMBEDDING_MAX_BATCH_INPUTS
+    max_batch_tokens: int = EMBEDDING_MAX_BATCH_TOKENS
+    max_input_tokens: int = EMBEDDING_MAX_INPUT_TOKENS
+
+    def count_tokens(self, text: str) -> int:
+        raise NotImplementedError
+
+    def truncate(self, text: str) -> str:
+        """Cut text down to max_input_tokens"""
+        raise NotImplementedError
+
+    def embed_batches(self, batches: List[Batch]) -> List[List[List[float]]]:
+        raise NotImplementedError
+
+    async def aembed_batches(self, batches: List[Batch]) -> List[List[List[float]]]:
+        return await asyncio.to_thread(self.embed_batches, batches)
+
+    def zero_vector(self) -> List[float]:
+        return [0.0] * self.dimension
+
+
+class OpenAIEmbeddingProvider(EmbeddingProvider):
+    """OpenAI embeddings API, rate limited by the process-wide EmbeddingScheduler"""
+
+    def __init__(self, model: str = EMBEDDING_MODEL):
+        self.model = model
+
+    def count_tokens(self, text):
+        return count_tokens(text, self.model)
+
+    def truncate(self, text):
+        return truncate_to_tokens(text, self.model, self.max_input_tokens)
+
+    def embed_batches(self, batches):
+        from utils.embedding_scheduler import get_embedding_scheduler
+        return get_embedding_scheduler().embed_batches(batches)
+
+    async def aembed_batches(self, batches):
+        from utils.embedding_scheduler import get_embedding_scheduler
+        return await get_embedding_scheduler().aembed_batches(batches)
+
+
+class LocalEmbeddingProvider(EmbeddingProvider):
+    """
+    Sentence-embedding model run in-process on CPU with onnxruntime.
+    The model directory holds model.onnx and its tokenizer.json; token embeddings
+    are mean-pooled over the attention mask and L2-normalized.
+    """
+    max_batch_tokens = None
+
+    def __init__(self, path: str = LOCAL_EMBEDDING_MODEL_PATH):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        if not path:
+            raise ValueError("LOCAL_EMBEDDING_MODEL_PATH is required for the local embedding provider")
+
+        self.model = f"local:{os.path.basename(os.path.normpath(path))}"
+        self.max_batch_inputs = LOCAL_EMBEDDING_BATCH_SIZE
+        self.max_input_tokens = LOCAL_EMBEDDING_MAX_TOKENS
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=self.max_input_tokens)
+        self.tokenizer.enable_padding()
+
+        options = onnxruntime.SessionOptions()
+        if LOCAL_EMBEDDING_THREADS:
+            options.intra_op_num_threads = LOCAL_EMBEDDING_THREADS
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(path, "model.onnx"), options, providers=["CPUExecutionProvider"]
+        )
+        self.input_names = {model_input.name for model_input in self.session.get_inputs()}
+        # onnxruntime sessions are thread-safe, but running batches one at a time
+        # keeps CPU use predictable next to the request handlers
+        self._lock = threading.Lock()
+
+        dimension = len(self._embed(["dimension probe"])[0])
+        if dimension != self.dimension:
+            raise ValueError(f"Local model produces {dimension} dimensions, EMBEDDING_DIMENSION is {self.dimension}")
+
+    def count_tokens(self, text):
+        return len(self.tokenizer.encode(text, add_special_tokens=False).ids)
+
+    def truncate(self, text):
+        # The tokenizer truncates to max_input_tokens itself
+        return text
+
+    def _embed(self, texts: List[str]) -> List[List[float]]:
+        encodings = self.tokenizer.encode_batch(texts)
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        feeds = {"input_ids": input_ids, "attention_mask": attention_mask}
+        if "token_type_ids" in self.input_names:
+            feeds["token_type_ids"] = np.zeros_like(input_ids)
+
+        with self._lock:
+            output = self.session.run(None, {name: value for name, value in feeds.items() if name in self.input_names})[0]
+
+        if output.ndim == 3:
+            mask = attention_mask[..., None].astype(np.float32)
+            output = (output * mask).sum(axis=1) / np.clip(mask.sum(axis=1), 1e-9, None)
+        norms = np.linalg.norm(output, axis=1, keepdims=True)
+        return (output / np.clip(norms, 1e-12, None)).tolist()
+
+    def embed_batches(self, batches):
+        return [self._embed(texts) for texts, _ in batches]
+
+
+class HashingEmbeddingProvider(EmbeddingProvider):
+    """
+    Deterministic feature-hashing embeddings for load tests and offline benchmarks.
+    Every word and word bigram is hashed to a signed dimension; texts sharing words
+    get similar vectors, so retrieval still behaves plausibly. No model, no network.
+    """
+    max_batch_tokens = None
+    _words = re.compile(r"\w+")
+
+    def __init__(self, dimension: int = EMBEDDING_DIMENSION):
+        self.dimension = dimension
+        self.model = f"hashing-{dimension}"
+
+    def count_tokens(self, text):
+        return len(self._words.findall(text))
+
+    def truncate(self, text):
+        return text
+
+    def _embed_one(self, text: str) -> List[float]:
+        words = self._words.findall(text.lower())
+        features = words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+        vector = np.zeros(self.dimension, dtype=np.float32)
+        for feature in features:
+            digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+            value = int.from_bytes(digest, "little")
+            vector[value % self.dimension] += 1.0 if value >> 63 else -1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist()
+
+    def embed_batches(self, batches):
+        return [[self._embed_one(text) for text in texts] for texts, _ in batches]
+
+
+_provider: Optional[EmbeddingProvider] = None
+_provider_lock = threading.Lock()
+
+
+def get_embedding_provider() -> EmbeddingProvider:
+    """Return the process-wide embedding provider selected by EMBEDDING_PROVIDER"""
+    global _provider
+    with _provider_lock:
+        if _provider is None:
+            if EMBEDDING_PROVIDER == "openai":
+                _provider = OpenAIEmbeddingProvider()
+            elif EMBEDDING_PROVIDER == "local":
+                _provider = LocalEmbeddingProvider()
+            elif EMBEDDING_PROVIDER == "hashing":
+                _provider = HashingEmbeddingProvider()
+            else:
+                raise ValueError(f"Unknown EMBEDDING_PROVIDER: {EMBEDDING_PROVIDER}")
+    return _provider
@@ -0,0 +1,237 @@
+import os
+import re
+import time
+import random
+import asyncio
+import logging
+import threading
+from typing import List, Optional, Tuple
+import openai
+
+
+EMBEDDING_MODEL = os.getenv("EMBEDDING_MODEL", "text-embedding-ada-002")
+EMBEDDING_RPM_LIMIT = int(os.getenv("EMBEDDING_RPM_LIMIT", 3000))
+EMBEDDING_TPM_LIMIT = int(os.getenv("EMBEDDING_TPM_LIMIT", 1000000))
+EMBEDDING_MIN_CONCURRENCY = int(os.getenv("EMBEDDING_MIN_CONCURRENCY", 1))
+EMBEDDING_MAX_CONCURRENCY = int(os.getenv("EMBEDDING_MAX_CONCURRENCY", 16))
+EMBEDDING_MAX_RETRIES = int(os.getenv("EMBEDDING_MAX_RETRIES", 5))
+
+logger = logging.getLogger(__name__)
+
+_duration_part = re.compile(r"(\d+(?:\.\d+)?)(ms|h|m|s)")
+_duration_units = {"ms": 0.001, "s": 1, "m": 60, "h": 3600}
+
+
+def parse_reset_duration(value: Optional[str]) -> Optional[float]:
+    """Parse rate-limit reset headers such as "20ms", "1s" or "6m0s" into seconds"""
+    if not value:
+        return None
+    parts = _duration_part.findall(value)
+    if not parts:
+        try:
+            return float(value)
+        except ValueError:
+            return None
+    return sum(float(amount) * _duration_units[unit] for amount, unit in parts)
+
+
+def _header_int(headers, name) -> Optional[int]:
+    try:
+        return int(headers.get(name))
+    except (TypeError, ValueError):
+        return None
+
+
+class TokenBucket:
+    """Token bucket refilled continuously at capacity per minute"""
+
+    def __init__(self, capacity_per_minute: int):
+        self.capacity = float(capacity_per_minute)
+        self.level = float(capacity_per_minute)
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated_at) * self.capacity / 60)
+        self.updated_at = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until amount can be taken, 0 if it can be taken now"""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float):
+        self._refill()
+        self.level -= min(amount, self.capacity)
+
+    def sync(self, limit: Optional[int], remaining: Optional[int]):
+        """Align the bucket with the limit and remaining budget reported by the server"""
+        self._refill()
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+
+
+class EmbeddingScheduler:
+    """
+    Process-wide admission control for embedding requests.
+
+    Every request is admitted against a requests-per-minute and a tokens-per-minute
+    bucket, and the number of requests in flight adapts to the rate-limit headers
+    returned by the API: it grows while there is headroom and halves on 429s.
+    The scheduler owns an event loop in a background thread, so sync ingestion code,
+    NSQ handlers and async endpoints all share the same budget.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        model: str = EMBEDDING_MODEL,
+        rpm_limit: int = EMBEDDING_RPM_LIMIT,
+        tpm_limit: int = EMBEDDING_TPM_LIMIT,
+        min_concurrency: int = EMBEDDING_MIN_CONCURRENCY,
+        max_concurrency: int = EMBEDDING_MAX_CONCURRENCY,
+        max_retries: int = EMBEDDING_MAX_RETRIES,
+    ):
+        # Retries are handled here, with awareness of the shared budget
+        self.client = client or openai.AsyncOpenAI(max_retries=0)
+        self.model = model
+        self.requests = TokenBucket(rpm_limit)
+        self.tokens = TokenBucket(tpm_limit)
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.concurrency = min_concurrency
+        self.max_retries = max_retries
+        self.in_flight = 0
+
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, name="embedding-scheduler", daemon=True)
+        self._thread.start()
+        self._admission = None  # created on the scheduler loop
+
+    def _run(self, coro):
+        return asyncio.run_coroutine_threadsafe(coro, self._loop)
+
+    def embed_batches(self, batches: List[Tuple[List[str], int]]) -> List[List[List[float]]]:
+        """
+        Embed several batches concurrently, blocking the calling thread
+
+        Args:
+            batches: List of (texts, token_count) tuples, one per embeddings request
+
+        Returns:
+            One list of vectors per batch, in batch order
+        """
+        return self._run(self._embed_all(batches)).result()
+
+    async def aembed_batches(self, batches: List[Tuple[List[str], int]]) -> List[List[List[float]]]:
+        """Async variant of embed_batches for callers running on another event loop"""
+        return await asyncio.wrap_future(self._run(self._embed_all(batches)))
+
+    async def _embed_all(self, batches):
+        return await asyncio.gather(*(self._embed_batch(texts, tokens) for texts, tokens in batches))
+
+    async def _acquire(self, tokens: int):
+        if self._admission is None:
+            self._admission = asyncio.Condition()
+
+        async with self._admission:
+            while True:
+                if self.in_flight < self.concurrency:
+                    wait = max(self.requests.wait_time(1), self.tokens.wait_time(tokens))
+                    if wait == 0:
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        self.in_flight += 1
+                        return
+                else:
+                    wait = None
+                try:
+                    await asyncio.wait_for(self._admission.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def _release(self):
+        async with self._admission:
+            self.in_flight -= 1
+            self._admission.notify_all()
+
+    def _adapt(self, headers, throttled: bool = False):
+        self.requests.sync(
+            _header_int(headers, "x-ratelimit-limit-requests"),
+            _header_int(headers, "x-ratelimit-remaining-requests"),
+        )
+        self.tokens.sync(
+            _header_int(headers, "x-ratelimit-limit-tokens"),
+            _header_int(headers, "x-ratelimit-remaining-tokens"),
+        )
+
+        if throttled:
+            self.concurrency = max(self.min_concurrency, self.concurrency // 2)
+            return
+
+        # Additive increase while both budgets have more than a fifth left
+        if (
+            self.requests.level > self.requests.capacity / 5
+            and self.tokens.level > self.tokens.capacity / 5
+        ):
+            self.concurrency = min(self.max_concurrency, self.concurrency + 1)
+        else:
+            self.concurrency = max(self.min_concurrency, self.concurrency - 1)
+
+    async def _embed_batch(self, texts: List[str], tokens: int) -> List[List[float]]:
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(tokens)
+            try:
+                raw = await self.client.embeddings.with_raw_response.create(input=texts, model=self.model)
+                error = None
+            except (openai.RateLimitError, openai.APIConnectionError, openai.InternalServerError) as e:
+                error = e
+            finally:
+                await self._release()
+
+            if error is None:
+                self._adapt(raw.headers)
+                response = raw.parse()
+                # The API does not guarantee the order of data, index does
+                return [item.embedding for item in sorted(response.data, key=lambda item: item.index)]
+
+            if attempt == self.max_retries:
+                raise error
+            headers = getattr(getattr(error, "response", None), "headers", None) or {}
+            self._adapt(headers, throttled=isinstance(error, openai.RateLimitError))
+            delay = _retry_delay(headers, attempt)
+            logger.warning(f"Embedding request failed ({error.__class__.__name__}), retrying in {delay:.2f}s")
+            await asyncio.sleep(delay + random.uniform(0, 0.25))
+
+
+def _retry_delay(headers, attempt: int) -> float:
+    """Seconds to wait before retrying, preferring what the server asked for"""
+    retry_after_ms = headers.get("retry-after-ms")
+    if retry_after_ms:
+        return parse_reset_duration(retry_after_ms + "ms")
+    retry_after = parse_reset_duration(headers.get("retry-after"))
+    if retry_after:
+        return retry_after
+    reset = max(
+        parse_reset_duration(headers.get("x-ratelimit-reset-requests")) or 0,
+        parse_reset_duration(headers.get("x-ratelimit-reset-tokens")) or 0,
+    )
+    return reset or 2 ** attempt
+
+
+_scheduler: Optional[EmbeddingScheduler] = None
+_scheduler_lock = threading.Lock()
+
+
+def get_embedding_scheduler() -> EmbeddingScheduler:
+    """Return the process-wide embedding scheduler"""
+    global _scheduler
+    with _scheduler_lock:
+        if _scheduler is None:
+            _scheduler = EmbeddingScheduler()
+    return _scheduler
@@ -0,0 +1,183 @@
+import os
+import asyncio
+import hashlib
+import logging
+import threading
+from typing import Dict, List, Optional
+import openai
+from cachetools import TTLCache
+from utils.tokenizer import count_tokens
+
+
+# History above this many tokens has its older turns summarized, 0 disables compaction
+HISTORY_COMPACTION_THRESHOLD_TOKENS = int(os.getenv("HISTORY_COMPACTION_THRESHOLD_TOKENS", 2000))
+# Most recent messages that always stay verbatim
+HISTORY_KEEP_RECENT_MESSAGES = int(os.getenv("HISTORY_KEEP_RECENT_MESSAGES", 6))
+# The summarized prefix grows in blocks of this many messages, so it stays the same (and cached)
+# for several turns in a row and each new summary only has to fold one block into the last one
+HISTORY_COMPACTION_BLOCK_MESSAGES = int(os.getenv("HISTORY_COMPACTION_BLOCK_MESSAGES", 8))
+HISTORY_SUMMARY_MODEL = os.getenv("HISTORY_SUMMARY_MODEL", os.getenv("LLM_MODEL", "gpt-4"))
+HISTORY_SUMMARY_MAX_TOKENS = int(os.getenv("HISTORY_SUMMARY_MAX_TOKENS", 300))
+HISTORY_SUMMARY_CACHE_SIZE = int(os.getenv("HISTORY_SUMMARY_CACHE_SIZE", 10000))
+HISTORY_SUMMARY_CACHE_TTL_SECONDS = int(os.getenv("HISTORY_SUMMARY_CACHE_TTL_SECONDS", 86400))
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PREFIX = "Summary of the earlier conversation:\n"
+
+_summary_instructions = (
+    "You maintain a running summary of a conversation between a user and an assistant that answers "
+    "questions about the user's documents. Fold the new messages into the existing summary. Keep the "
+    "user's goals, the facts, figures and document references given in answers, and open questions. "
+    "Be concise and write plain prose."
+)
+
+
+def _block_hash(previous: str, messages: List[dict]) -> str:
+    """Hash of a history prefix, chained block by block so every prefix hash extends the previous one"""
+    digest = hashlib.sha256(previous.encode("ascii"))
+    for message in messages:
+        digest.update(f"\x1e{message.get('role', '')}\x1f{message.get('content', '')}".encode("utf-8"))
+    return digest.hexdigest()
+
+
+class HistoryCompactor:
+    """
+    Replaces the older part of a long chat history with a running summary.
+
+    The summarized prefix is block-aligned and its summaries are cached by the prefix hash, so
+    a conversation pays for one summarization every HISTORY_COMPACTION_BLOCK_MESSAGES messages,
+    each folding one block into the cached summary of the previous prefix. Requests arriving
+    together for the same prefix share one summarization.
+    """
+
+    def __init__(self, model: str = HISTORY_SUMMARY_MODEL, client: Optional[openai.AsyncOpenAI] = None):
+        self.model = model
+        self.client = client or openai.AsyncOpenAI()
+        self._summaries = TTLCache(maxsize=HISTORY_SUMMARY_CACHE_SIZE, ttl=HISTORY_SUMMARY_CACHE_TTL_SECONDS)
+        self._lock = threading.Lock()
+        self._pending: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.summarizations = 0
+        self.failures = 0
+
+    def needs_compaction(self, history: List[dict], tokenizer_model: str) -> bool:
+        """Whether compact would summarize part of history, i.e. it is over the threshold with a block to fold"""
+        if not history or HISTORY_COMPACTION_THRESHOLD_TOKENS <= 0:
+            return False
+        if len(history) - HISTORY_KEEP_RECENT_MESSAGES < max(1, HISTORY_COMPACTION_BLOCK_MESSAGES):
+            return False
+        return sum(count_tokens(message.get("content", ""), tokenizer_model) for message in history) > HISTORY_COMPACTION_THRESHOLD_TOKENS
+
+    async def compact(self, history: List[dict], tokenizer_model: str) -> List[dict]:
+        """
+        Return history with everything but the recent messages replaced by a summary message,
+        or history unchanged while it is below the threshold or if summarizing fails
+        """
+        if not self.needs_compaction(history, tokenizer_model):
+            return history
+
+        block = max(1, HISTORY_COMPACTION_BLOCK_MESSAGES)
+        blocks = (len(history) - HISTORY_KEEP_RECENT_MESSAGES) // block
+
+        try:
+            summary = await self._summary(history, blocks, block)
+        except Exception as e:
+            logger.warning(f"Failed to compact chat history: {e}")
+            with self._lock:
+                self.failures += 1
+            return history
+
+        return [{"role": "system", "content": SUMMARY_PREFIX + summary}] + history[blocks * block:]
+
+    async def _summary(self, history: List[dict], blocks: int, block: int) -> str:
+        # Prefix hashes of every block boundary, the last one identifies the prefix to summarize
+        hashes = []
+        previous = ""
+        for number in range(blocks):
+            previous = _block_hash(previous, history[number * block:(number + 1) * block])
+            hashes.append(previous)
+
+        with self._lock:
+            summary = self._summaries.get(hashes[-1])
+            if summary is not None:
+                self.hits += 1
+                return summary
+            pending = self._pending.get(hashes[-1])
+            if pending is None:
+                pending = self._pending[hashes[-1]] = asyncio.get_running_loop().create_future()
+                owner = True
+            else:
+                owner = False
+
+        if not owner:
+            try:
+                return await asyncio.shield(pending)
+            except asyncio.CancelledError:
+                if pending.cancelled():
+                    # The request summarizing it went away, this one carries on uncompacted
+                    raise RuntimeError("Shared summarization was cancelled")
+                raise
+
+        try:
+            # Fold into the longest prefix already summarized, or summarize from the start
+            start, summary = 0, ""
+            with self._lock:
+                for number in range(blocks - 2, -1, -1):
+                    cached = self._summaries.get(hashes[number])
+                    if cached is not None:
+                        start, summary = number + 1, cached
+                        break
+            summary = await self._summarize(summary, history[start * block:blocks * block])
+            with self._lock:
+                self._summaries[hashes[-1]] = summary
+            pending.set_result(summary)
+            return summary
+        except asyncio.CancelledError:
+            pending.cancel()
+            raise
+        except Exception as e:
+            pending.set_exception(e)
+            # Nobody else may be waiting, mark the exception as retrieved
+            pending.exception()
+            raise
+        finally:
+            with self._lock:
+                self._pending.pop(hashes[-1], None)
+
+    async def _summarize(self, summary: str, messages: List[dict]) -> str:
+        transcript = "\n".join(f"{message.get('role', '')}: {message.get('content', '')}" for message in messages)
+        response = await self.client.chat.completions.create(
+            model=self.model,
+            messages=[
+                {"role": "system", "content": _summary_instructions},
+                {"role": "user", "content": f"Existing summary:\n{summary or '(none)'}\n\nNew messages:\n{transcript}"},
+            ],
+            temperature=0,
+            max_tokens=HISTORY_SUMMARY_MAX_TOKENS,
+        )
+        with self._lock:
+            self.summarizations += 1
+        return response.choices[0].message.content.strip()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "size": len(self._summaries),
+                "hits": self.hits,
+                "summarizations": self.summarizations,
+                "failures": self.failures,
+            }
+
+
+_compactor: Optional[HistoryCompactor] = None
+_compactor_lock = threading.Lock()
+
+
+def get_history_compactor() -> HistoryCompactor:
+    """Return the process-wide history compactor"""
+    global _compactor
+    with _compactor_lock:
+        if _compactor is None:
+            _compactor = HistoryCompactor()
+    return _compactor
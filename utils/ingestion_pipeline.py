@@ -0,0 +1,94 @@
+import os
+import queue
+import threading
+from itertools import islice
+from typing import Callable, Iterable, Iterator, List
+
+
+INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", 256))
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 2))
+
+_END = object()
+
+
+class _StageError:
+    def __init__(self, error: BaseException):
+        self.error = error
+
+
+def batched(items: Iterable, size: int = INGEST_BATCH_SIZE) -> Iterator[list]:
+    """Group an iterable into lists of at most size items without materializing it"""
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, size))
+        if not batch:
+            return
+        yield batch
+
+
+def pipeline(source: Iterable, stages: List[Callable], queue_size: int = INGEST_QUEUE_SIZE) -> Iterator:
+    """
+    Stream items from source through stages, each running in its own thread
+
+    Stages are connected by queues holding at most queue_size items, so a slow
+    stage applies back-pressure upstream instead of letting work pile up in memory.
+    Results are yielded in source order in the calling thread, which is where the
+    database writes belong. An exception in any stage is re-raised to the caller,
+    and stopping the iteration early shuts the stage threads down.
+
+    Args:
+        source: Iterable producing the work items, iterated in a background thread
+        stages: Functions applied to every item, in order
+        queue_size: Capacity of each queue between stages
+
+    Yields:
+        The output of the last stage for every source item
+    """
+    stop = threading.Event()
+
+    def put(q, item):
+        while not stop.is_set():
+            try:
+                q.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def drain(q):
+        while True:
+            try:
+                item = q.get(timeout=0.1)
+            except queue.Empty:
+                if stop.is_set():
+                    return
+                continue
+            if item is _END:
+                return
+            if isinstance(item, _StageError):
+                raise item.error
+            yield item
+
+    def pump(items, fn, outbox):
+        try:
+            for item in items:
+                if not put(outbox, fn(item) if fn else item):
+                    return
+        except BaseException as e:
+            put(outbox, _StageError(e))
+            return
+        put(outbox, _END)
+
+    inbox = queue.Queue(maxsize=queue_size)
+    threads = [threading.Thread(target=pump, args=(source, None, inbox), daemon=True)]
+    for stage in stages:
+        outbox = queue.Queue(maxsize=queue_size)
+        threads.append(threading.Thread(target=pump, args=(drain(inbox), stage, outbox), daemon=True))
+        inbox = outbox
+
+    for thread in threads:
+        thread.start()
+    try:
+        yield from drain(inbox)
+    finally:
+        stop.set()
@@ -0,0 +1,90 @@
+import os
+from typing import List, Optional, Sequence
+import numpy as np
+from utils.tokenizer import count_tokens
+
+
+# Pick retrieved chunks by maximal marginal relevance instead of similarity alone
+RETRIEVAL_MMR_ENABLED = os.getenv("RETRIEVAL_MMR_ENABLED", "0") == "1"
+# 1 ranks by relevance only, lower values favor chunks unlike those already picked
+RETRIEVAL_MMR_LAMBDA = float(os.getenv("RETRIEVAL_MMR_LAMBDA", 0.5))
+# Candidates fetched per chunk to pick, with their embeddings, when MMR is enabled
+RETRIEVAL_MMR_OVERFETCH_FACTOR = int(os.getenv("RETRIEVAL_MMR_OVERFETCH_FACTOR", 4))
+# Tokens of chunk text the picked chunks may add up to, 0 for no cap
+RETRIEVAL_MMR_MAX_TOKENS = int(os.getenv("RETRIEVAL_MMR_MAX_TOKENS", 0))
+RETRIEVAL_MMR_TOKENIZER_MODEL = os.getenv("LLM_MODEL", "gpt-4")
+
+
+def mmr_select(
+    relevance: Sequence[float],
+    embeddings: np.ndarray,
+    k: int,
+    lambda_mult: float = RETRIEVAL_MMR_LAMBDA,
+    token_counts: Optional[Sequence[int]] = None,
+    max_tokens: Optional[int] = None,
+) -> List[int]:
+    """
+    Greedy maximal marginal relevance over candidates.
+
+    Each step picks the candidate maximizing lambda * relevance - (1 - lambda) * its highest
+    cosine similarity to the candidates already picked. The candidate similarity matrix is
+    computed once, so a step is one vector update. With max_tokens, candidates that no longer
+    fit are passed over; the first pick is always made.
+
+    Args:
+        relevance: Cosine similarity of each candidate to the query
+        embeddings: One row per candidate
+        k: Candidates to pick
+        token_counts: Tokens of each candidate, required with max_tokens
+
+    Returns:
+        Positions of the picked candidates, in the order they were picked
+    """
+    count = len(relevance)
+    if not count or k <= 0:
+        return []
+
+    vectors = np.asarray(embeddings, dtype=np.float32)
+    vectors = vectors / np.clip(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12, None)
+    similarity = vectors @ vectors.T
+    relevance = np.asarray(relevance, dtype=np.float32)
+    tokens = np.asarray(token_counts, dtype=np.int64) if max_tokens else None
+
+    redundancy = np.zeros(count, dtype=np.float32)
+    available = np.ones(count, dtype=bool)
+    remaining = max_tokens
+    picked = []
+    while len(picked) < k:
+        if tokens is not None and picked:
+            available &= tokens <= remaining
+        if not available.any():
+            break
+        scores = np.where(available, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+        if tokens is not None:
+            remaining -= tokens[best]
+    return picked
+
+
+def select_diverse(hits: list, k: int) -> list:
+    """
+    The k hits picked by mmr_select under RETRIEVAL_MMR_LAMBDA and RETRIEVAL_MMR_MAX_TOKENS.
+    Hits need a score and an embedding; without embeddings the first k are returned.
+    """
+    if len(hits) <= 1 or any(hit.embedding is None for hit in hits):
+        return hits[:k]
+
+    token_counts = None
+    if RETRIEVAL_MMR_MAX_TOKENS:
+        token_counts = [count_tokens(hit.content, RETRIEVAL_MMR_TOKENIZER_MODEL) for hit in hits]
+    picked = mmr_select(
+        [hit.score for hit in hits],
+        np.stack([np.asarray(hit.embedding, dtype=np.float32) for hit in hits]),
+        k,
+        token_counts=token_counts,
+        max_tokens=RETRIEVAL_MMR_MAX_TOKENS or None,
+    )
+    return [hits[position] for position in picked]
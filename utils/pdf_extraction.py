@@ -0,0 +1,90 @@
+import os
+import tempfile
+import threading
+import multiprocessing
+from io import BytesIO
+from collections import deque
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List, Optional, Tuple
+import fitz
+
+
+PDF_PARALLEL_MIN_PAGES = int(os.getenv("PDF_PARALLEL_MIN_PAGES", 64))
+PDF_EXTRACT_WORKERS = int(os.getenv("PDF_EXTRACT_WORKERS", os.cpu_count() or 1))
+# forkserver keeps workers from inheriting the ingestion threads' locks
+PDF_EXTRACT_START_METHOD = os.getenv("PDF_EXTRACT_START_METHOD", "forkserver")
+# Most pages per extraction task, and most tasks submitted but not yet yielded (0 for twice the workers),
+# so the extracted text held at once stays bounded however large the PDF is
+PDF_EXTRACT_RANGE_PAGES = int(os.getenv("PDF_EXTRACT_RANGE_PAGES", 32))
+PDF_EXTRACT_MAX_IN_FLIGHT = int(os.getenv("PDF_EXTRACT_MAX_IN_FLIGHT", 0))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_lock = threading.Lock()
+
+
+def extract_pdf_page_range(path: str, start: int, stop: int) -> List[str]:
+    """Extract the text of pages [start, stop) of the PDF file at path, runs inside the worker processes"""
+    with fitz.open(path, filetype="pdf") as pdf:
+        return [pdf[i].get_text("text") + "\n" for i in range(start, stop)]
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=PDF_EXTRACT_WORKERS,
+                mp_context=multiprocessing.get_context(PDF_EXTRACT_START_METHOD),
+            )
+    return _pool
+
+
+def page_ranges(page_count: int, workers: int, max_pages: int = PDF_EXTRACT_RANGE_PAGES) -> List[Tuple[int, int]]:
+    """
+    Split pages into contiguous ranges, at least two per worker so a slow range does not
+    stall the rest, and at most max_pages pages each
+    """
+    size = max(1, min(-(-page_count // (workers * 2)), max_pages))
+    return [(start, min(start + size, page_count)) for start in range(0, page_count, size)]
+
+
+def iter_pdf_pages(contents: bytes) -> Iterator[Tuple[int, str]]:
+    """
+    Yield (page_num, text) for every page of a PDF, in page order.
+    PDFs with at least PDF_PARALLEL_MIN_PAGES pages are split into page ranges
+    extracted by a process pool, smaller ones are read in-process. The pool workers
+    read the PDF from a temporary file rather than receiving its bytes with every range.
+    At most PDF_EXTRACT_MAX_IN_FLIGHT ranges are submitted ahead of the one being yielded,
+    so a slow consumer holds back extraction instead of letting the text pile up.
+    """
+    with fitz.open(stream=BytesIO(contents), filetype="pdf") as pdf:
+        page_count = pdf.page_count
+        if page_count < PDF_PARALLEL_MIN_PAGES or PDF_EXTRACT_WORKERS < 2:
+            for i, page in enumerate(pdf):
+                yield i+1, page.get_text("text") + "\n"  # Extract text from each page
+            return
+
+    ranges = iter(page_ranges(page_count, PDF_EXTRACT_WORKERS, PDF_EXTRACT_RANGE_PAGES))
+    window = max(1, PDF_EXTRACT_MAX_IN_FLIGHT or PDF_EXTRACT_WORKERS * 2)
+    pool = _get_pool()
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as f:
+        f.write(contents)
+    # Futures in submission order, which reassembles the pages in order
+    in_flight = deque()
+    try:
+        for start, stop in islice(ranges, window):
+            in_flight.append((start, pool.submit(extract_pdf_page_range, f.name, start, stop)))
+        while in_flight:
+            start, future = in_flight.popleft()
+            texts = future.result()
+            # Refill the window before yielding so the workers keep going while the pages are consumed
+            for next_start, next_stop in islice(ranges, 1):
+                in_flight.append((next_start, pool.submit(extract_pdf_page_range, f.name, next_start, next_stop)))
+            for offset, text in enumerate(texts):
+                yield start + offset + 1, text
+    finally:
+        for _, future in in_flight:
+            future.cancel()
+        os.unlink(f.name)
@@ -0,0 +1,129 @@
+import struct
+import uuid
+from io import BytesIO
+from typing import Any, Callable, Dict, Iterable, List, NamedTuple, Sequence, Tuple
+import numpy as np
+from sqlalchemy import text
+from sqlalchemy.orm import Session
+
+
+PGCOPY_HEADER = b"PGCOPY\n\xff\r\n\x00" + struct.pack(">ii", 0, 0)
+PGCOPY_TRAILER = struct.pack(">h", -1)
+
+_text_escapes = str.maketrans({"\\": "\\\\", "\t": "\\t", "\n": "\\n", "\r": "\\r"})
+# Column types whose binary COPY format is the UTF-8 of the text
+_textual_types = {"text", "character varying", "character"}
+
+
+class CopyType(NamedTuple):
+    """How to write a value of one Postgres type in COPY binary and text format"""
+    binary: Callable[[Any], bytes]
+    text: Callable[[Any], str]
+
+
+def _vector_text(values) -> str:
+    return "[" + ",".join(str(float(v)) for v in values) + "]"
+
+
+UUID = CopyType(
+    binary=lambda v: (v if isinstance(v, uuid.UUID) else uuid.UUID(str(v))).bytes,
+    text=str,
+)
+INT4 = CopyType(binary=lambda v: struct.pack(">i", v), text=str)
+TEXT = CopyType(binary=lambda v: v.encode("utf-8"), text=lambda v: v)
+# pgvector's binary format: int16 dimensions, int16 unused, then big-endian float4 values
+VECTOR = CopyType(
+    binary=lambda v: struct.pack(">HH", len(v), 0) + np.asarray(v, dtype=">f4").tobytes(),
+    text=_vector_text,
+)
+# halfvec: int16 dimensions, int16 unused, then big-endian float2 values
+HALFVEC = CopyType(
+    binary=lambda v: struct.pack(">HH", len(v), 0) + np.asarray(v, dtype=">f2").tobytes(),
+    text=_vector_text,
+)
+# bit strings such as "0110": int32 bit length, then the bits packed into bytes
+BIT = CopyType(
+    binary=lambda v: struct.pack(">i", len(v)) + np.packbits(np.frombuffer(v.encode("ascii"), dtype=np.uint8) == ord("1")).tobytes(),
+    text=lambda v: v,
+)
+
+
+def as_text(copy_type: CopyType) -> CopyType:
+    """copy_type for a text column, e.g. uuids kept in VARCHAR: written as its text format in both formats"""
+    return CopyType(binary=lambda v: copy_type.text(v).encode("utf-8"), text=copy_type.text)
+
+
+def column_types(db: Session, table: str) -> Dict[str, str]:
+    """Declared type of each column of table, e.g. uuid or character varying(36)"""
+    rows = db.execute(
+        text(
+            "SELECT attname, format_type(atttypid, atttypmod) FROM pg_attribute "
+            "WHERE attrelid = CAST(:table AS regclass) AND attnum > 0 AND NOT attisdropped"
+        ),
+        {"table": table},
+    )
+    return {name: type_name for name, type_name in rows}
+
+
+def match_column_types(columns: Sequence[Tuple[str, CopyType]], types: Dict[str, str]) -> List[Tuple[str, CopyType]]:
+    """
+    columns with the CopyType of every column the table declares as text or varchar
+    replaced by as_text, since binary COPY writes the bytes as they are into such columns
+    """
+    return [
+        (name, as_text(copy_type) if types.get(name, "").split("(")[0] in _textual_types else copy_type)
+        for name, copy_type in columns
+    ]
+
+
+def encode_binary(columns: Sequence[Tuple[str, CopyType]], rows: Iterable[Sequence]) -> BytesIO:
+    """Encode rows in COPY binary format"""
+    buf = BytesIO()
+    buf.write(PGCOPY_HEADER)
+    field_count = struct.pack(">h", len(columns))
+    null = struct.pack(">i", -1)
+    for row in rows:
+        buf.write(field_count)
+        for (_, copy_type), value in zip(columns, row):
+            if value is None:
+                buf.write(null)
+                continue
+            data = copy_type.binary(value)
+            buf.write(struct.pack(">i", len(data)))
+            buf.write(data)
+    buf.write(PGCOPY_TRAILER)
+    buf.seek(0)
+    return buf
+
+
+def encode_text(columns: Sequence[Tuple[str, CopyType]], rows: Iterable[Sequence]) -> BytesIO:
+    """Encode rows in COPY text format"""
+    lines: List[str] = []
+    for row in rows:
+        lines.append("\t".join(
+            "\\N" if value is None else copy_type.text(value).translate(_text_escapes)
+            for (_, copy_type), value in zip(columns, row)
+        ))
+    buf = BytesIO(("\n".join(lines) + "\n").encode("utf-8") if lines else b"")
+    return buf
+
+
+def copy_rows(db: Session, table: str, columns: Sequence[Tuple[str, CopyType]], rows: Iterable[Sequence], fmt: str = "binary"):
+    """
+    Stream rows into a table with COPY FROM STDIN on the session's connection,
+    so they are written in the session's current transaction.
+
+    Args:
+        table: Table name
+        columns: (column name, CopyType) pairs, in the order of the values in each row
+        rows: Row value tuples
+        fmt: "binary" or "text"
+    """
+    buf = encode_binary(columns, rows) if fmt == "binary" else encode_text(columns, rows)
+    column_names = ", ".join(name for name, _ in columns)
+
+    cursor = db.connection().connection.cursor()
+    try:
+        cursor.copy_expert(f"COPY {table} ({column_names}) FROM STDIN WITH (FORMAT {fmt})", buf)
+    finally:
+        cursor.close()
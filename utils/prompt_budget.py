@@ -0,0 +1,122 @@
+import os
+import math
+from typing import Any, Callable, List, Optional
+from utils.tokenizer import count_tokens, truncate_to_tokens
+
+
+# Tokens of prompt, i.e. the model's context window minus the completion's max_tokens and a margin
+PROMPT_TOKEN_BUDGET = int(os.getenv("PROMPT_TOKEN_BUDGET", 6000))
+# A chunk that does not fit is cut down to the remaining budget only if at least this much is left
+PROMPT_MIN_CHUNK_TOKENS = int(os.getenv("PROMPT_MIN_CHUNK_TOKENS", 64))
+# Chat formatting adds a few tokens per message (role and separators) and for the reply priming
+MESSAGE_OVERHEAD_TOKENS = 4
+REPLY_PRIMING_TOKENS = 3
+
+
+def _chunk_text(number: int, content: str) -> str:
+    return f"Document {number}: {content}"
+
+
+def pack_prompt(
+    render_system: Callable[[str], str],
+    chunks: list,
+    history: Optional[List[dict]],
+    query: str,
+    model: str,
+    budget: int = PROMPT_TOKEN_BUDGET,
+    chunk_order: Optional[Callable[[Any], Any]] = None,
+) -> dict:
+    """
+    Build chat messages within a token budget, measured with the model's tokenizer.
+
+    The instructions and the query are always included. The budget left is filled with the
+    highest-scoring chunks first, the first chunk that does not fit is cut down to the rest
+    of the budget (when at least PROMPT_MIN_CHUNK_TOKENS remain) and the others are dropped.
+    History follows, most recent turn first; the first turn that does not fit and every
+    older one are dropped. The same inputs always produce the same prompt.
+
+    The chunks included are numbered in score order, or re-ordered and numbered by
+    chunk_order when it is given (a sort key), without changing which chunks fit.
+
+    Args:
+        render_system: Builds the system message from the context text
+        chunks: Retrieved chunks with content and score
+        history: Previous messages, [{"role": ..., "content": ...}, ...]
+        query: The user's message
+
+    Returns:
+        dict with "messages", "chunks", the chunks included in prompt order, and "usage",
+        the tokens used per section and what was dropped
+    """
+    history = history or []
+
+    instructions_tokens = count_tokens(render_system(""), model) + MESSAGE_OVERHEAD_TOKENS
+    query_tokens = count_tokens(query, model) + MESSAGE_OVERHEAD_TOKENS
+    remaining = budget - instructions_tokens - query_tokens - REPLY_PRIMING_TOKENS
+
+    # Highest score first, ties keep retrieval order
+    ranked = sorted(chunks, key=lambda chunk: -_score(chunk))
+    included, bodies = [], []
+    context_tokens = 0
+    truncated_chunks = 0
+    for chunk in ranked:
+        text = _chunk_text(len(included) + 1, chunk.content)
+        # The separator between chunks is one token
+        tokens = count_tokens(text, model) + (1 if included else 0)
+        if tokens > remaining:
+            if remaining - 1 < PROMPT_MIN_CHUNK_TOKENS:
+                break
+            text = truncate_to_tokens(text, model, remaining - 1)
+            tokens = count_tokens(text, model) + (1 if included else 0)
+            truncated_chunks += 1
+        included.append(chunk)
+        bodies.append(text[len(_chunk_text(len(included), "")):])
+        context_tokens += tokens
+        remaining -= tokens
+        if truncated_chunks:
+            break
+
+    history_tokens = 0
+    kept_turns = []
+    for message in reversed(history):
+        tokens = count_tokens(message["content"], model) + MESSAGE_OVERHEAD_TOKENS
+        if tokens > remaining:
+            break
+        kept_turns.append(message)
+        history_tokens += tokens
+        remaining -= tokens
+    kept_turns.reverse()
+
+    if chunk_order is not None:
+        order = sorted(range(len(included)), key=lambda i: chunk_order(included[i]))
+        included = [included[i] for i in order]
+        bodies = [bodies[i] for i in order]
+    # Renumbering keeps the counts, numbers below 1000 are a single token
+    sections = [_chunk_text(number, body) for number, body in enumerate(bodies, 1)]
+
+    messages = [{"role": "system", "content": render_system("\n\n".join(sections))}]
+    messages.extend({"role": message["role"], "content": message["content"]} for message in kept_turns)
+    messages.append({"role": "user", "content": query})
+
+    return {
+        "messages": messages,
+        "chunks": included,
+        "usage": {
+            "budget": budget,
+            "instructions": instructions_tokens,
+            "context": context_tokens,
+            "history": history_tokens,
+            "query": query_tokens,
+            "total": instructions_tokens + context_tokens + history_tokens + query_tokens + REPLY_PRIMING_TOKENS,
+            "chunks_used": len(included),
+            "chunks_truncated": truncated_chunks,
+            "chunks_dropped": len(chunks) - len(included),
+            "history_turns_used": len(kept_turns),
+            "history_turns_dropped": len(history) - len(kept_turns),
+        },
+    }
+
+
+def _score(chunk) -> float:
+    score = getattr(chunk, "score", None)
+    return score if score is not None and not math.isnan(score) else -math.inf
@@ -0,0 +1,80 @@
+import os
+import threading
+from typing import Optional
+from cachetools import LRUCache
+
+
+# legacy puts the retrieved context inside the instructions, prefix_cache puts the static
+# instructions first so every prompt starts with the same tokens and the provider can reuse
+# its cached prefix, followed by the chunks in document order, the history and the query
+PROMPT_LAYOUT = os.getenv("PROMPT_LAYOUT", "legacy")
+# Contexts whose prompt cache use is kept per process
+PROMPT_CACHE_STATS_MAX_CONTEXTS = int(os.getenv("PROMPT_CACHE_STATS_MAX_CONTEXTS", 1000))
+
+
+def chunk_order(chunk):
+    """Sort key placing chunks by document and position in it, so the same chunks give the same prompt"""
+    return (str(chunk.document_id), chunk.chunk_index)
+
+
+def cached_tokens(usage) -> int:
+    """Prompt tokens the provider served from its prefix cache, from a completion's usage"""
+    details = getattr(usage, "prompt_tokens_details", None)
+    return (getattr(details, "cached_tokens", None) or 0) if details is not None else 0
+
+
+class PromptCacheStats:
+    """
+    Prompt and cached prompt tokens and completion time of the completions made in this process,
+    per prompt layout and per context, to compare what the prefix cache saves
+    """
+
+    def __init__(self, max_contexts: int = PROMPT_CACHE_STATS_MAX_CONTEXTS):
+        self._layouts = {}
+        self._contexts = LRUCache(maxsize=max_contexts)
+        self._lock = threading.Lock()
+
+    def record(self, context_id, layout: str, prompt_tokens: int, cached: int, seconds: float):
+        with self._lock:
+            for totals in (
+                self._layouts.setdefault(layout, _totals()),
+                self._contexts.setdefault(str(context_id), _totals()),
+            ):
+                totals["completions"] += 1
+                totals["prompt_tokens"] += prompt_tokens
+                totals["cached_tokens"] += cached
+                totals["seconds"] += seconds
+
+    def stats(self, context_id: Optional[str] = None) -> dict:
+        """Totals per layout, or of one context"""
+        with self._lock:
+            if context_id is not None:
+                totals = self._contexts.get(str(context_id))
+                return _report(totals) if totals else None
+            return {layout: _report(totals) for layout, totals in self._layouts.items()}
+
+
+def _totals() -> dict:
+    return {"completions": 0, "prompt_tokens": 0, "cached_tokens": 0, "seconds": 0.0}
+
+
+def _report(totals: dict) -> dict:
+    return {
+        **totals,
+        "seconds": round(totals["seconds"], 3),
+        "cached_ratio": totals["cached_tokens"] / totals["prompt_tokens"] if totals["prompt_tokens"] else 0.0,
+        "average_seconds": totals["seconds"] / totals["completions"] if totals["completions"] else 0.0,
+    }
+
+
+_stats: Optional[PromptCacheStats] = None
+_stats_lock = threading.Lock()
+
+
+def get_prompt_cache_stats() -> PromptCacheStats:
+    """Return the process-wide prompt cache statistics"""
+    global _stats
+    with _stats_lock:
+        if _stats is None:
+            _stats = PromptCacheStats()
+    return _stats
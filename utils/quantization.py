@@ -0,0 +1,29 @@
+import os
+from typing import List
+import numpy as np
+
+
+# Compact representation written next to the full embedding and used for the candidate pass
+EMBEDDING_STORAGE_TIER = os.getenv("EMBEDDING_STORAGE_TIER", "full")  # full, half or binary
+# How many more candidates than needed the compact pass fetches before the exact rerank
+HALF_OVERFETCH_FACTOR = int(os.getenv("HALF_OVERFETCH_FACTOR", 2))
+BINARY_OVERFETCH_FACTOR = int(os.getenv("BINARY_OVERFETCH_FACTOR", 10))
+
+
+def quantize_half(vector) -> List[float]:
+    """Round a vector to half precision, as stored in a halfvec column"""
+    return np.asarray(vector, dtype=np.float16).astype(np.float32).tolist()
+
+
+def quantize_binary(vector) -> str:
+    """Sign-quantize a vector to a bit string, matching pgvector's binary_quantize"""
+    return "".join("1" if bit else "0" for bit in (np.asarray(vector) > 0))
+
+
+def compact_embeddings(vector) -> dict:
+    """Compact column values to store for a chunk embedding under EMBEDDING_STORAGE_TIER"""
+    if EMBEDDING_STORAGE_TIER == "half":
+        return {"embedding_half": quantize_half(vector)}
+    if EMBEDDING_STORAGE_TIER == "binary":
+        return {"embedding_binary": quantize_binary(vector)}
+    return {}
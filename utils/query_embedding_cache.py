@@ -0,0 +1,140 @@
+import os
+import time
+import asyncio
+import threading
+from typing import Awaitable, Callable, List, Optional
+from cachetools import TTLCache
+from utils.embedding_cache import EmbeddingCache, get_embedding_cache, cache_key
+
+
+QUERY_EMBEDDING_CACHE_SIZE = int(os.getenv("QUERY_EMBEDDING_CACHE_SIZE", 10000))
+QUERY_EMBEDDING_CACHE_TTL_SECONDS = int(os.getenv("QUERY_EMBEDDING_CACHE_TTL_SECONDS", 3600))
+# Use the persistent embedding cache (EMBEDDING_CACHE_BACKEND) as a second level shared by replicas
+QUERY_EMBEDDING_CACHE_SHARED = os.getenv("QUERY_EMBEDDING_CACHE_SHARED", "0") == "1"
+
+
+class QueryEmbeddingCache:
+    """
+    In-process LRU cache of query embeddings with a TTL, keyed by model and normalized text,
+    optionally backed by a shared EmbeddingCache so every API replica benefits from a miss
+    computed by any of them.
+    """
+
+    def __init__(
+        self,
+        maxsize: int = QUERY_EMBEDDING_CACHE_SIZE,
+        ttl_seconds: int = QUERY_EMBEDDING_CACHE_TTL_SECONDS,
+        shared: Optional[EmbeddingCache] = None,
+    ):
+        self._local = TTLCache(maxsize=maxsize, ttl=ttl_seconds)
+        self._lock = threading.Lock()
+        self.shared = shared
+        self.hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.miss_seconds = 0.0
+        self.saved_seconds = 0.0
+
+    def _average_miss_seconds(self) -> float:
+        return self.miss_seconds / self.misses if self.misses else 0.0
+
+    def get(self, model: str, text: str) -> Optional[List[float]]:
+        """Return the cached embedding of text, or None"""
+        vector = self._get_local(model, text)
+        if vector is None and self.shared is not None:
+            vector = self._get_shared(model, text)
+        return vector
+
+    def _get_local(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        with self._lock:
+            vector = self._local.get(key)
+            if vector is not None:
+                self.hits += 1
+                self.saved_seconds += self._average_miss_seconds()
+            return vector
+
+    def _get_shared(self, model: str, text: str) -> Optional[List[float]]:
+        key = cache_key(model, text)
+        start = time.perf_counter()
+        # Counted as a query hit or miss here, not in the ingestion stats of the shared cache
+        vector = self.shared.get_many([key], count=False).get(key)
+        if vector is None:
+            return None
+        with self._lock:
+            self._local[key] = vector
+            self.shared_hits += 1
+            self.saved_seconds += max(0.0, self._average_miss_seconds() - (time.perf_counter() - start))
+        return vector
+
+    def put(self, model: str, text: str, vector: List[float]):
+        """Cache an embedding, empty and all-zero (failed) embeddings are ignored"""
+        if self._put_local(model, text, vector) and self.shared is not None:
+            self.shared.put_many(model, {cache_key(model, text): vector})
+
+    def _put_local(self, model: str, text: str, vector: List[float]) -> bool:
+        if not vector or not any(vector):
+            return False
+        with self._lock:
+            self._local[cache_key(model, text)] = vector
+        return True
+
+    def _record_miss(self, seconds: float):
+        with self._lock:
+            self.misses += 1
+            self.miss_seconds += seconds
+
+    def get_or_compute(self, model: str, text: str, compute: Callable[[str], List[float]]) -> List[float]:
+        """
+        Return the cached embedding of text, computing and caching it on a miss.
+        Exceptions from compute propagate and nothing is cached.
+        """
+        vector = self.get(model, text)
+        if vector is not None:
+            return vector
+
+        start = time.perf_counter()
+        vector = compute(text)
+        self._record_miss(time.perf_counter() - start)
+        self.put(model, text, vector)
+        return vector
+
+    async def aget_or_compute(self, model: str, text: str, compute: Callable[[str], Awaitable[List[float]]]) -> List[float]:
+        """get_or_compute with an async compute, the shared cache is queried off the event loop"""
+        vector = self._get_local(model, text)
+        if vector is None and self.shared is not None:
+            vector = await asyncio.to_thread(self._get_shared, model, text)
+        if vector is not None:
+            return vector
+
+        start = time.perf_counter()
+        vector = await compute(text)
+        self._record_miss(time.perf_counter() - start)
+        if self._put_local(model, text, vector) and self.shared is not None:
+            await asyncio.to_thread(self.shared.put_many, model, {cache_key(model, text): vector})
+        return vector
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.shared_hits + self.misses
+            return {
+                "size": len(self._local),
+                "hits": self.hits,
+                "shared_hits": self.shared_hits,
+                "misses": self.misses,
+                "hit_ratio": (self.hits + self.shared_hits) / lookups if lookups else 0.0,
+                "saved_seconds": round(self.saved_seconds, 3),
+            }
+
+
+_cache: Optional[QueryEmbeddingCache] = None
+_cache_lock = threading.Lock()
+
+
+def get_query_embedding_cache() -> QueryEmbeddingCache:
+    """Return the process-wide query embedding cache"""
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = QueryEmbeddingCache(shared=get_embedding_cache() if QUERY_EMBEDDING_CACHE_SHARED else None)
+    return _cache
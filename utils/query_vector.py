@@ -0,0 +1,65 @@
+import os
+from typing import List, Optional, Tuple
+import numpy as np
+
+
+# concatenated embeds the recent history and the message as one text on every turn,
+# weighted embeds every message once (cached) and combines the vectors
+QUERY_VECTOR_MODE = os.getenv("QUERY_VECTOR_MODE", "concatenated")
+# Share of the new message in the weighted query vector, the history shares the rest
+QUERY_VECTOR_MESSAGE_WEIGHT = float(os.getenv("QUERY_VECTOR_MESSAGE_WEIGHT", 0.6))
+# Each older history message weighs this much of the one after it
+QUERY_VECTOR_HISTORY_DECAY = float(os.getenv("QUERY_VECTOR_HISTORY_DECAY", 0.5))
+# Most recent history messages that contribute, like the two exchanges of the concatenated text
+QUERY_VECTOR_HISTORY_MESSAGES = int(os.getenv("QUERY_VECTOR_HISTORY_MESSAGES", 4))
+
+
+def history_texts(chat_history: Optional[list], limit: int = QUERY_VECTOR_HISTORY_MESSAGES) -> List[str]:
+    """
+    The recent user and assistant messages as "Role: content" texts, oldest first.
+    A user message has the same text as when it was the new message, so its
+    embedding is already cached.
+    """
+    texts = []
+    for message in chat_history or []:
+        if not isinstance(message, dict) or "role" not in message or "content" not in message:
+            continue
+        role = message.get("role", "").lower()
+        content = message.get("content", "").strip()
+        if content and role in ["user", "assistant"]:
+            texts.append(f"{role.capitalize()}: {content}")
+    return texts[-limit:] if limit > 0 else []
+
+
+def combine(
+    message_vector: List[float],
+    history_vectors: List[List[float]],
+    message_weight: float = QUERY_VECTOR_MESSAGE_WEIGHT,
+    decay: float = QUERY_VECTOR_HISTORY_DECAY,
+) -> List[float]:
+    """
+    Weighted sum of the normalized message and history vectors, normalized. The message gets
+    message_weight, the history vectors (oldest first) share the rest with weights decaying
+    towards the oldest. Zero (failed) vectors are left out; when the message vector is one,
+    it is returned as is.
+    """
+    message = np.asarray(message_vector, dtype=np.float32)
+    message_norm = np.linalg.norm(message)
+    if not message_norm:
+        return message_vector
+
+    weighted: List[Tuple[float, np.ndarray]] = []
+    for age, vector in enumerate(reversed(history_vectors)):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        if norm:
+            weighted.append((decay ** age, vector / norm))
+    if not weighted:
+        return message_vector
+
+    history_total = sum(weight for weight, _ in weighted)
+    combined = message_weight * message / message_norm
+    for weight, vector in weighted:
+        combined += (1 - message_weight) * weight / history_total * vector
+    norm = np.linalg.norm(combined)
+    return (combined / norm).tolist() if norm else message_vector
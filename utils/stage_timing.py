@@ -0,0 +1,36 @@
+import time
+from contextlib import contextmanager
+from typing import Awaitable, Dict, TypeVar
+
+T = TypeVar("T")
+
+
+class StageTimer:
+    """
+    Wall-clock durations of the stages of one request, in milliseconds.
+    Stages may overlap, so the durations can add up to more than the request took.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = self.stages.get(name, 0.0) + (time.perf_counter() - start) * 1000
+
+    async def timed(self, name: str, awaitable: Awaitable[T]) -> T:
+        """Await awaitable, recording how long it took as stage name"""
+        with self.stage(name):
+            return await awaitable
+
+    def server_timing(self) -> str:
+        """The stages and the total so far as a Server-Timing header value"""
+        total = (time.perf_counter() - self.started) * 1000
+        entries = [f"{name};dur={duration:.1f}" for name, duration in self.stages.items()]
+        entries.append(f"total;dur={total:.1f}")
+        return ", ".join(entries)
@@ -0,0 +1,30 @@
+from functools import lru_cache
+import tiktoken
+
+
+DEFAULT_ENCODING = "cl100k_base"
+
+
+@lru_cache(maxsize=None)
+def get_encoding(model: str):
+    """Return the tiktoken encoding for a model, falling back to cl100k_base for unknown models"""
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding(DEFAULT_ENCODING)
+
+
+def count_tokens(text: str, model: str) -> int:
+    """Count the tokens the model's tokenizer produces for text"""
+    if not text:
+        return 0
+    return len(get_encoding(model).encode(text, disallowed_special=()))
+
+
+def truncate_to_tokens(text: str, model: str, max_tokens: int) -> str:
+    """Cut text down to at most max_tokens tokens of the model's tokenizer"""
+    encoding = get_encoding(model)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
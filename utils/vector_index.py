@@ -0,0 +1,222 @@
+"""
+ANN index on document_chunks for the vector candidate search.
+
+The index covers the column the candidate pass orders by, which depends on
+EMBEDDING_STORAGE_TIER, and is built with HNSW or IVFFlat per VECTOR_INDEX_TYPE.
+
+The index spans every context while a chat searches one. Filtering by context_id after
+the index scan can leave fewer rows than asked for, so by default the scan keeps going
+until enough rows pass the filter (VECTOR_ITERATIVE_SCAN, skipped below pgvector 0.8), and contexts
+of at most VECTOR_EXACT_SCAN_MAX_ROWS chunks are ranked exactly without the index.
+
+Usage (from the repository root):
+    python -m utils.vector_index ddl       # print the CREATE INDEX statement
+    python -m utils.vector_index create    # create it concurrently if missing
+    python -m utils.vector_index rebuild   # rebuild it concurrently, e.g. after changing parameters
+"""
+if __name__ == "__main__":
+    from dotenv import load_dotenv
+    load_dotenv()
+
+import os
+import sys
+import threading
+from typing import Optional
+from sqlalchemy import Index, text
+from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
+from utils.quantization import EMBEDDING_STORAGE_TIER
+
+
+VECTOR_INDEX_TYPE = os.getenv("VECTOR_INDEX_TYPE", "hnsw")  # hnsw, ivfflat or none
+VECTOR_INDEX_NAME = "ix_document_chunks_embedding_ann"
+HNSW_M = int(os.getenv("HNSW_M", 16))
+HNSW_EF_CONSTRUCTION = int(os.getenv("HNSW_EF_CONSTRUCTION", 64))
+HNSW_EF_SEARCH = int(os.getenv("HNSW_EF_SEARCH", 40))
+IVFFLAT_LISTS = int(os.getenv("IVFFLAT_LISTS", 100))
+IVFFLAT_PROBES = int(os.getenv("IVFFLAT_PROBES", 10))
+# pgvector >= 0.8 can keep scanning the index until enough rows pass the WHERE filter.
+# Older versions reject the setting, so it is only applied once the installed version is known to have it.
+VECTOR_ITERATIVE_SCAN = os.getenv("VECTOR_ITERATIVE_SCAN", "relaxed_order")  # off, relaxed_order or strict_order
+# Contexts with at most this many chunks are ranked exactly from the context_id index, 0 to always use the ANN index
+VECTOR_EXACT_SCAN_MAX_ROWS = int(os.getenv("VECTOR_EXACT_SCAN_MAX_ROWS", 2000))
+VECTOR_INDEX_MAINTENANCE_WORK_MEM = os.getenv("VECTOR_INDEX_MAINTENANCE_WORK_MEM")
+
+_operator_classes = {
+    "full": ("embedding", "vector_cosine_ops"),
+    "half": ("embedding_half", "halfvec_cosine_ops"),
+    "binary": ("embedding_binary", "bit_hamming_ops"),
+}
+
+
+def indexed_column():
+    """(column name, operator class) the candidate pass orders by"""
+    return _operator_classes.get(EMBEDDING_STORAGE_TIER, _operator_classes["full"])
+
+
+def index_parameters() -> dict:
+    if VECTOR_INDEX_TYPE == "ivfflat":
+        return {"lists": IVFFLAT_LISTS}
+    return {"m": HNSW_M, "ef_construction": HNSW_EF_CONSTRUCTION}
+
+
+def table_indexes() -> tuple:
+    """Index definitions for the model's __table_args__, so create_all builds the ANN index too"""
+    if VECTOR_INDEX_TYPE not in ("hnsw", "ivfflat"):
+        return ()
+    column, operator_class = indexed_column()
+    return (
+        Index(
+            VECTOR_INDEX_NAME,
+            column,
+            postgresql_using=VECTOR_INDEX_TYPE,
+            postgresql_with=index_parameters(),
+            postgresql_ops={column: operator_class},
+        ),
+    )
+
+
+def index_ddl(name: str = VECTOR_INDEX_NAME, concurrently: bool = True) -> str:
+    column, operator_class = indexed_column()
+    parameters = ", ".join(f"{key} = {value}" for key, value in index_parameters().items())
+    return (
+        f"CREATE INDEX {'CONCURRENTLY ' if concurrently else ''}IF NOT EXISTS {name} "
+        f"ON document_chunks USING {VECTOR_INDEX_TYPE} ({column} {operator_class}) WITH ({parameters})"
+    )
+
+
+def search_settings(candidates: int, iterative_scan: bool = True) -> dict:
+    """
+    Index scan settings for one query.
+    HNSW returns at most ef_search rows, so it is raised to the number of candidates needed.
+    iterative_scan is whether the installed pgvector has VECTOR_ITERATIVE_SCAN.
+    """
+    settings = {}
+    iterative_scan = iterative_scan and VECTOR_ITERATIVE_SCAN != "off"
+    if VECTOR_INDEX_TYPE == "hnsw":
+        settings["hnsw.ef_search"] = str(max(HNSW_EF_SEARCH, candidates))
+        if iterative_scan:
+            settings["hnsw.iterative_scan"] = VECTOR_ITERATIVE_SCAN
+    elif VECTOR_INDEX_TYPE == "ivfflat":
+        settings["ivfflat.probes"] = str(min(IVFFLAT_PROBES, IVFFLAT_LISTS))
+        if iterative_scan:
+            settings["ivfflat.iterative_scan"] = VECTOR_ITERATIVE_SCAN
+    return settings
+
+
+_EXTENSION_VERSION_QUERY = text("SELECT extversion FROM pg_extension WHERE extname = 'vector'")
+_iterative_scan_supported: Optional[bool] = None
+_iterative_scan_lock = threading.Lock()
+
+
+def supports_iterative_scan(version: Optional[str]) -> bool:
+    """Whether a pgvector version, e.g. "0.8.0", has the iterative_scan settings"""
+    try:
+        return tuple(int(part) for part in (version or "").split(".")[:2]) >= (0, 8)
+    except ValueError:
+        return False
+
+
+def _remember_extension_version(version: Optional[str]) -> bool:
+    global _iterative_scan_supported
+    with _iterative_scan_lock:
+        _iterative_scan_supported = supports_iterative_scan(version)
+    return _iterative_scan_supported
+
+
+def _search_settings_statement(candidates: int, context_id=None, iterative_scan: bool = True):
+    # All settings in one round trip, scoped to the current transaction, with whether
+    # the context is small enough to rank exactly as the last column
+    settings = search_settings(candidates, iterative_scan)
+    if not settings:
+        return None, {}
+    calls = [f"set_config(:name_{i}, :value_{i}, true)" for i in range(len(settings))]
+    params = {}
+    for i, (name, value) in enumerate(settings.items()):
+        params[f"name_{i}"] = name
+        params[f"value_{i}"] = value
+    if context_id is not None and VECTOR_EXACT_SCAN_MAX_ROWS > 0:
+        # Counts no further than one row past the threshold, from the context_id index
+        calls.append(
+            "(SELECT count(*) FROM (SELECT 1 FROM document_chunks WHERE context_id = :context_id LIMIT :exact_limit) AS rows)"
+            " <= :exact_max_rows"
+        )
+        params.update(context_id=str(context_id), exact_limit=VECTOR_EXACT_SCAN_MAX_ROWS + 1, exact_max_rows=VECTOR_EXACT_SCAN_MAX_ROWS)
+    return text(f"SELECT {', '.join(calls)}"), params
+
+
+def apply_search_settings(db: Session, candidates: int, context_id=None) -> bool:
+    """
+    Tune the index scan for one query, scoped to the current transaction.
+    The pgvector version is looked up on the first call, to leave out settings it does not have.
+    Returns whether the context has few enough chunks to rank them exactly instead.
+    """
+    iterative_scan = _iterative_scan_supported
+    if iterative_scan is None and VECTOR_ITERATIVE_SCAN != "off":
+        iterative_scan = _remember_extension_version(db.execute(_EXTENSION_VERSION_QUERY).scalar())
+    statement, params = _search_settings_statement(candidates, context_id, bool(iterative_scan))
+    if statement is None:
+        return False
+    row = db.execute(statement, params).one()
+    return "context_id" in params and bool(row[-1])
+
+
+async def aapply_search_settings(db: AsyncSession, candidates: int, context_id=None) -> bool:
+    """apply_search_settings for an AsyncSession"""
+    iterative_scan = _iterative_scan_supported
+    if iterative_scan is None and VECTOR_ITERATIVE_SCAN != "off":
+        iterative_scan = _remember_extension_version((await db.execute(_EXTENSION_VERSION_QUERY)).scalar())
+    statement, params = _search_settings_statement(candidates, context_id, bool(iterative_scan))
+    if statement is None:
+        return False
+    row = (await db.execute(statement, params)).one()
+    return "context_id" in params and bool(row[-1])
+
+
+def _autocommit_execute(engine, statements):
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        if VECTOR_INDEX_MAINTENANCE_WORK_MEM:
+            conn.execute(text("SELECT set_config('maintenance_work_mem', :value, false)"), {"value": VECTOR_INDEX_MAINTENANCE_WORK_MEM})
+        for statement in statements:
+            print(statement)
+            conn.execute(text(statement))
+
+
+def create_index(engine):
+    """Create the ANN index if it does not exist, without blocking writes"""
+    _autocommit_execute(engine, [index_ddl()])
+
+
+def rebuild_index(engine):
+    """
+    Build a fresh index next to the current one and swap it in.
+    The build and the final drop run CONCURRENTLY and the swap is two quick renames,
+    so ingestion keeps writing and chats keep using the old index until the new one is ready.
+    """
+    staging = f"{VECTOR_INDEX_NAME}_rebuild"
+    retired = f"{VECTOR_INDEX_NAME}_retired"
+    _autocommit_execute(engine, [
+        # Leftovers of an interrupted rebuild
+        f"DROP INDEX CONCURRENTLY IF EXISTS {staging}",
+        f"DROP INDEX CONCURRENTLY IF EXISTS {retired}",
+        index_ddl(staging),
+        f"ALTER INDEX IF EXISTS {VECTOR_INDEX_NAME} RENAME TO {retired}",
+        f"ALTER INDEX {staging} RENAME TO {VECTOR_INDEX_NAME}",
+        f"DROP INDEX CONCURRENTLY IF EXISTS {retired}",
+    ])
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else "ddl"
+    if command == "ddl" and VECTOR_INDEX_TYPE in ("hnsw", "ivfflat"):
+        print(index_ddl() + ";")
+    elif command in ("create", "rebuild") and VECTOR_INDEX_TYPE in ("hnsw", "ivfflat"):
+        from utils.database import engine
+        if command == "create":
+            create_index(engine)
+        else:
+            rebuild_index(engine)
+    else:
+        print(__doc__)
+        sys.exit(1)